@@ -1,16 +1,47 @@
 """
 Клиент для работы с OpenAI API
 """
+import asyncio
+import base64
 import logging
-from typing import List, Dict, Optional
-from openai import OpenAI
+from typing import Any, AsyncIterator, List, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from conversation_store import ConversationStore, SQLiteConversationBackend
+from response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
+SUMMARY_INSTRUCTIONS = (
+    "Ты ведешь краткую сводку разговора пользователя с ассистентом. "
+    "Объедини текущую сводку и новые сообщения в одну компактную сводку на русском языке: "
+    "факты о пользователе, договоренности, открытые вопросы. Без вступлений, не длиннее 150 слов."
+)
+
+IMAGE_PROMPT = (
+    "Опиши, что на изображении, кратко и по-русски. Если это чек, счет или квитанция - "
+    "укажи магазин и итоговую сумму в формате 'Итого: <сумма>'. Если на изображении есть задача, "
+    "список дел или дата - перечисли их."
+)
+
+
+class StreamInterrupted(Exception):
+    """Потоковый ответ оборвался после того, как часть текста уже была выдана"""
+
+
 class ChatGPTClient:
     """Клиент для взаимодействия с ChatGPT API"""
     
-    def __init__(self, api_key: str = None, model: str = "gpt-4", max_tokens: int = 2000, temperature: float = 0.7):
+    def __init__(self, api_key: str = None, model: str = "gpt-4", max_tokens: int = 2000, temperature: float = 0.7,
+                 transport: str = "async", max_concurrency: int = 8, max_connections: int = 20,
+                 request_timeout: float = 60.0, stream_chunk_timeout: float = 30.0, context_token_budget: int = 6000,
+                 summarize_history: bool = True, summary_model: str = "gpt-3.5-turbo",
+                 summary_max_tokens: int = 400, conversation_backend: str = "memory",
+                 conversation_db_path: str = "/tmp/conversations.db", conversation_cache_size: int = 256,
+                 response_cache_size: int = 0, response_cache_ttl: float = 3600, cache_chat_responses: bool = False,
+                 vision_model: str = "gpt-4-vision-preview"):
         """Инициализация клиента OpenAI"""
         # Импортируем конфигурацию внутри метода, чтобы избежать циклических импортов
         if not api_key:
@@ -19,50 +50,178 @@ class ChatGPTClient:
             model = Config.OPENAI_MODEL
             max_tokens = Config.OPENAI_MAX_TOKENS
             temperature = Config.OPENAI_TEMPERATURE
+            transport = Config.OPENAI_TRANSPORT
+            max_concurrency = Config.OPENAI_MAX_CONCURRENCY
+            max_connections = Config.OPENAI_MAX_CONNECTIONS
+            request_timeout = Config.OPENAI_REQUEST_TIMEOUT
+            stream_chunk_timeout = Config.OPENAI_STREAM_CHUNK_TIMEOUT
+            context_token_budget = Config.OPENAI_CONTEXT_TOKEN_BUDGET
+            summarize_history = Config.OPENAI_SUMMARIZE_HISTORY
+            summary_model = Config.OPENAI_SUMMARY_MODEL
+            summary_max_tokens = Config.OPENAI_SUMMARY_MAX_TOKENS
+            conversation_backend = Config.CONVERSATION_BACKEND
+            conversation_db_path = Config.CONVERSATION_DB_PATH
+            conversation_cache_size = Config.CONVERSATION_CACHE_SIZE
+            response_cache_size = Config.OPENAI_RESPONSE_CACHE_SIZE
+            response_cache_ttl = Config.OPENAI_RESPONSE_CACHE_TTL
+            cache_chat_responses = Config.OPENAI_CACHE_CHAT_RESPONSES
+            vision_model = Config.OPENAI_VISION_MODEL
+        
+        if transport not in ("async", "sync"):
+            raise ValueError(f"Неизвестный транспорт OpenAI: {transport}")
         
-        self.client = OpenAI(api_key=api_key)
         self.model = model
+        self.vision_model = vision_model
         self.max_tokens = max_tokens
         self.temperature = temperature
+        self.transport = transport
+        self.request_timeout = request_timeout
+        self.stream_chunk_timeout = stream_chunk_timeout
+        
+        # Один общий пул HTTP-соединений на весь процесс
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_concurrency
+            ),
+            timeout=httpx.Timeout(request_timeout, connect=10.0)
+        )
+        self.async_client = AsyncOpenAI(api_key=api_key, http_client=self.http_client, timeout=request_timeout)
+        self.client = OpenAI(api_key=api_key, timeout=request_timeout)
+        
+        # Ограничение числа одновременных запросов к OpenAI
+        self.request_semaphore = asyncio.Semaphore(max_concurrency)
+        
+        # Хранилище контекста разговоров для каждого пользователя (окно по токенам)
+        if conversation_backend == "sqlite":
+            backend = SQLiteConversationBackend(conversation_db_path)
+        elif conversation_backend == "memory":
+            backend = None
+        else:
+            raise ValueError(f"Неизвестное хранилище разговоров: {conversation_backend}")
+        self.conversations = ConversationStore(
+            model=model,
+            token_budget=context_token_budget,
+            backend=backend,
+            max_cached=conversation_cache_size
+        )
+        
+        # Кэш ответов включается явно (размер 0 - кэш выключен)
+        self.response_cache = ResponseCache(response_cache_size, response_cache_ttl) if response_cache_size > 0 else None
+        self.cache_chat_responses = cache_chat_responses
         
-        # Хранилище контекста разговоров для каждого пользователя
-        self.conversations: Dict[int, List[Dict[str, str]]] = {}
+        # Фоновая сводка вытесненных сообщений (не более одной задачи на пользователя)
+        self.summarize_history = summarize_history
+        self.summary_model = summary_model
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_tasks: Dict[int, asyncio.Task] = {}
         
         logger.info(f"ChatGPT клиент инициализирован с моделью: {self.model}")
     
+    def _conversation(self, user_id: int):
+        """Разговор пользователя; очередь сводки, сохраненная до перезапуска, сворачивается в фоне"""
+        conversation = self.conversations.get(user_id)
+        if self.summarize_history and conversation.pending_summary:
+            self._schedule_summary(user_id)
+        return conversation
+    
     def get_conversation(self, user_id: int) -> List[Dict[str, str]]:
         """Получить историю разговора для пользователя"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = [
-                {
-                    "role": "system",
-                    "content": "Ты полезный ассистент. Отвечай на русском языке, если пользователь пишет на русском. Будь дружелюбным и помогай пользователю."
-                }
-            ]
-        return self.conversations[user_id]
+        return self._conversation(user_id).to_messages()
     
     def add_message_to_conversation(self, user_id: int, role: str, content: str):
         """Добавить сообщение в историю разговора"""
-        conversation = self.get_conversation(user_id)
-        conversation.append({"role": role, "content": content})
+        # Старые сообщения вытесняются, когда история превышает бюджет токенов
+        conversation = self._conversation(user_id)
+        evicted = conversation.append(role, content)
+        if evicted:
+            logger.debug(f"Из истории пользователя {user_id} вытеснено сообщений: {len(evicted)}")
+            if self.summarize_history:
+                conversation.pending_summary.extend(evicted)
+                self._schedule_summary(user_id)
+        self.conversations.save(conversation)
+    
+    def _schedule_summary(self, user_id: int):
+        """Запустить фоновое обновление сводки, если оно еще не идет"""
+        task = self.summary_tasks.get(user_id)
+        if task and not task.done():
+            # Текущая задача подхватит новые сообщения сама
+            return
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий сводка будет обновлена при следующем вытеснении
+            return
+        
+        self.summary_tasks[user_id] = loop.create_task(self._update_summary(user_id))
+    
+    async def _update_summary(self, user_id: int):
+        """Свернуть накопленные вытесненные сообщения в сводку пользователя"""
+        conversation = self.conversations.peek(user_id)
+        try:
+            while conversation is not None and conversation.pending_summary:
+                # Сообщения остаются в очереди (и в сохраненном состоянии) до успешной сводки
+                batch = list(conversation.pending_summary)
+                try:
+                    summary = await self.summarize(conversation.summary, batch)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления сводки разговора для пользователя {user_id}: {e}")
+                    return
+                if self.conversations.peek(user_id) is not conversation:
+                    # Разговор очищен или выгружен из памяти - очередь будет свернута позже
+                    return
+                del conversation.pending_summary[:len(batch)]
+                if summary:
+                    # Вытесненные выросшей сводкой сообщения попадут в очередь и в следующий круг
+                    conversation.set_summary(summary)
+                    self.conversations.save(conversation)
+                    logger.info(f"Сводка разговора обновлена для пользователя {user_id}")
+        finally:
+            if self.summary_tasks.get(user_id) is asyncio.current_task():
+                del self.summary_tasks[user_id]
+    
+    async def summarize(self, summary: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Объединить текущую сводку с новыми сообщениями
+        
+        Args:
+            summary: Текущая сводка (может быть пустой)
+            messages: Вытесненные из окна сообщения
+            
+        Returns:
+            Обновленная сводка
+        """
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        prompt = f"Текущая сводка:\n{summary or '(пусто)'}\n\nНовые сообщения:\n{transcript}"
         
-        # Ограничиваем размер истории (оставляем системное сообщение + последние 20 сообщений)
-        if len(conversation) > 21:
-            self.conversations[user_id] = [conversation[0]] + conversation[-20:]
+        return await self.complete(
+            [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": prompt}
+            ],
+            cache=False,
+            model=self.summary_model,
+            max_tokens=self.summary_max_tokens,
+            temperature=0.3
+        )
     
     def clear_conversation(self, user_id: int):
         """Очистить историю разговора для пользователя"""
-        if user_id in self.conversations:
-            del self.conversations[user_id]
+        self.conversations.clear(user_id)
+        task = self.summary_tasks.pop(user_id, None)
+        if task:
+            task.cancel()
         logger.info(f"История разговора очищена для пользователя {user_id}")
     
-    async def get_response(self, user_id: int, message: str) -> Optional[str]:
+    async def get_response(self, user_id: int, message: str, cache: Optional[bool] = None) -> Optional[str]:
         """
         Получить ответ от ChatGPT
         
         Args:
             user_id: ID пользователя Telegram
             message: Сообщение пользователя
+            cache: Использовать кэш ответов (по умолчанию - настройка cache_chat_responses)
             
         Returns:
             Ответ от ChatGPT или None в случае ошибки
@@ -77,35 +236,254 @@ class ChatGPTClient:
             logger.info(f"Отправка запроса к OpenAI для пользователя {user_id}")
             
             # Отправляем запрос к OpenAI
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=conversation,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            assistant_message = await self.complete(
+                conversation,
+                cache=self.cache_chat_responses if cache is None else cache
             )
             
-            # Извлекаем ответ
-            assistant_message = response.choices[0].message.content
-            
             # Добавляем ответ ассистента в историю
             self.add_message_to_conversation(user_id, "assistant", assistant_message)
             
             logger.info(f"Получен ответ от OpenAI для пользователя {user_id}")
             return assistant_message
             
+        except asyncio.TimeoutError:
+            logger.error(f"Превышено время ожидания ответа OpenAI для пользователя {user_id}")
+            return None
         except Exception as e:
             logger.error(f"Ошибка при обращении к OpenAI API: {e}")
             return None
     
+    async def stream_response(self, user_id: int, message: str, cache: Optional[bool] = None) -> AsyncIterator[str]:
+        """
+        Получить ответ от ChatGPT потоком фрагментов
+        
+        Args:
+            user_id: ID пользователя Telegram
+            message: Сообщение пользователя
+            cache: Использовать кэш ответов (по умолчанию - настройка cache_chat_responses)
+            
+        Yields:
+            Фрагменты (дельты токенов) ответа по мере генерации
+        
+        Raises:
+            StreamInterrupted: Поток оборвался после части ответа (часть уже сохранена в истории)
+        """
+        self.add_message_to_conversation(user_id, "user", message)
+        conversation = self.get_conversation(user_id)
+        
+        logger.info(f"Отправка потокового запроса к OpenAI для пользователя {user_id}")
+        
+        parts: List[str] = []
+        error: Optional[Exception] = None
+        try:
+            async for delta in self.stream_completion(
+                conversation,
+                cache=self.cache_chat_responses if cache is None else cache
+            ):
+                parts.append(delta)
+                yield delta
+        except asyncio.TimeoutError as e:
+            logger.error(f"Превышено время ожидания потока OpenAI для пользователя {user_id}")
+            error = e
+        except Exception as e:
+            logger.error(f"Ошибка при потоковом обращении к OpenAI API: {e}")
+            error = e
+        
+        # В историю попадает то, что пользователь реально увидел
+        if parts:
+            self.add_message_to_conversation(user_id, "assistant", "".join(parts))
+            if error is None:
+                logger.info(f"Потоковый ответ OpenAI завершен для пользователя {user_id}")
+            else:
+                # Обрезанный ответ не должен выглядеть окончательным
+                raise StreamInterrupted(str(error) or type(error).__name__) from error
+    
+    def _build_request(self, messages: List[Dict[str, str]], **params) -> Dict:
+        """Собрать параметры запроса chat completion"""
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+        }
+        request.update(params)
+        return request
+    
+    def _cache_key(self, request: Dict, cache: Optional[bool]) -> Optional[str]:
+        """
+        Ключ кэша для запроса или None, если кэш не используется
+        
+        По умолчанию (cache=None) кэшируются только детерминированные запросы с temperature=0.
+        """
+        if self.response_cache is None:
+            return None
+        if cache is None:
+            cache = request["temperature"] == 0
+        if not cache:
+            return None
+        return ResponseCache.make_key(
+            request["model"], request["messages"], request["temperature"], request["max_tokens"]
+        )
+    
+    async def complete(self, messages: List[Dict[str, str]], cache: Optional[bool] = None, **params) -> Optional[str]:
+        """
+        Получить текст ответа с учетом кэша
+        
+        Args:
+            messages: Сообщения для модели
+            cache: True - использовать кэш, False - обойти, None - только для temperature=0
+            **params: Переопределение параметров запроса
+            
+        Returns:
+            Текст ответа
+        """
+        request = self._build_request(messages, **params)
+        key = self._cache_key(request, cache)
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        response = await self.create_completion(messages, **params)
+        content = response.choices[0].message.content
+        
+        if key is not None and content:
+            self.response_cache.set(key, content)
+        return content
+    
+    async def stream_completion(self, messages: List[Dict[str, str]], cache: Optional[bool] = None,
+                                **params) -> AsyncIterator[str]:
+        """
+        Выполнить потоковый запрос chat completion
+        
+        В режиме sync потоковая выдача недоступна, и ответ отдается одним фрагментом.
+        Ответ из кэша также отдается одним фрагментом.
+        
+        Args:
+            messages: Сообщения для модели
+            cache: True - использовать кэш, False - обойти, None - только для temperature=0
+            **params: Переопределение параметров запроса
+            
+        Yields:
+            Текстовые дельты ответа
+        """
+        request = self._build_request(messages, **params)
+        key = self._cache_key(request, cache)
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        parts: List[str] = []
+        async with self.request_semaphore:
+            if self.transport == "sync":
+                response = await asyncio.wait_for(
+                    asyncio.to_thread(self.client.chat.completions.create, **request),
+                    timeout=self.request_timeout
+                )
+                content = response.choices[0].message.content
+                if content:
+                    parts.append(content)
+                    yield content
+            else:
+                stream = await asyncio.wait_for(
+                    self.async_client.chat.completions.create(stream=True, **request),
+                    timeout=self.request_timeout
+                )
+                # Ожидание каждого фрагмента ограничено отдельно: зависший поток не держит
+                # слот семафора и сообщение пользователя бесконечно
+                chunks = stream.__aiter__()
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.stream_chunk_timeout)
+                        except StopAsyncIteration:
+                            break
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+                finally:
+                    await stream.response.aclose()
+        
+        # Кэшируется только полностью полученный ответ
+        if key is not None and parts:
+            self.response_cache.set(key, "".join(parts))
+    
+    async def create_completion(self, messages: List[Dict[str, str]], **params):
+        """
+        Выполнить запрос chat completion, не блокируя цикл событий
+        
+        Args:
+            messages: Сообщения для модели
+            **params: Переопределение параметров запроса (model, max_tokens, temperature, ...)
+            
+        Returns:
+            Ответ OpenAI
+        """
+        request = self._build_request(messages, **params)
+        
+        async with self.request_semaphore:
+            if self.transport == "async":
+                call = self.async_client.chat.completions.create(**request)
+            else:
+                call = asyncio.to_thread(self.client.chat.completions.create, **request)
+            return await asyncio.wait_for(call, timeout=self.request_timeout)
+    
+    async def analyze_image_with_text(self, image: bytes, prompt: str = IMAGE_PROMPT,
+                                      mime_type: str = "image/jpeg") -> Optional[str]:
+        """
+        Проанализировать изображение моделью зрения
+        
+        Args:
+            image: Уже уменьшенное изображение
+            prompt: Инструкция для модели
+            mime_type: Тип изображения
+            
+        Returns:
+            Описание изображения или None
+        """
+        try:
+            data_url = f"data:{mime_type};base64,{base64.b64encode(image).decode('ascii')}"
+            messages = [{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": data_url, "detail": "auto"}}
+                ]
+            }]
+            return await self.complete(messages, cache=False, model=self.vision_model, max_tokens=600)
+        except Exception as e:
+            logger.error(f"Ошибка анализа изображения OpenAI: {e}")
+            return None
+    
+    async def close(self):
+        """Закрыть общий пул HTTP-соединений и хранилище разговоров"""
+        await self.http_client.aclose()
+        self.conversations.close()
+        logger.info("HTTP-пул ChatGPT клиента закрыт")
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Получить статистику кэша ответов"""
+        if self.response_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.response_cache.get_stats()}
+    
     def get_conversation_stats(self, user_id: int) -> Dict[str, int]:
         """Получить статистику разговора"""
-        conversation = self.get_conversation(user_id)
-        user_messages = sum(1 for msg in conversation if msg["role"] == "user")
-        assistant_messages = sum(1 for msg in conversation if msg["role"] == "assistant")
+        conversation = self.conversations.get(user_id)
+        user_messages = conversation.role_counts.get("user", 0)
+        assistant_messages = conversation.role_counts.get("assistant", 0)
         
         return {
-            "total_messages": len(conversation) - 1,  # Исключаем системное сообщение
+            "total_messages": len(conversation.messages),  # Без системного сообщения
             "user_messages": user_messages,
-            "assistant_messages": assistant_messages
+            "assistant_messages": assistant_messages,
+            "prompt_tokens": conversation.prompt_tokens,
+            "summary_tokens": conversation.summary_tokens,
+            "token_budget": conversation.token_budget
         }
-
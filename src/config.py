@@ -15,6 +15,81 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 # Authorized User ID
 AUTHORIZED_USER_ID = int(os.getenv('AUTHORIZED_USER_ID', 0))
 
+# Транспорт OpenAI: async (AsyncOpenAI с общим пулом соединений) или sync (OpenAI в пуле потоков)
+OPENAI_TRANSPORT = os.getenv('OPENAI_TRANSPORT', 'async')
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', 8))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 20))
+OPENAI_REQUEST_TIMEOUT = float(os.getenv('OPENAI_REQUEST_TIMEOUT', 60))
+# Сколько секунд поток ответа может молчать между фрагментами
+OPENAI_STREAM_CHUNK_TIMEOUT = float(os.getenv('OPENAI_STREAM_CHUNK_TIMEOUT', 30))
+
+# Бюджет токенов на историю разговора (системный промпт + сообщения)
+OPENAI_CONTEXT_TOKEN_BUDGET = int(os.getenv('OPENAI_CONTEXT_TOKEN_BUDGET', 6000))
+
+# Фоновое сжатие вытесненной истории в сводку
+OPENAI_SUMMARIZE_HISTORY = os.getenv('OPENAI_SUMMARIZE_HISTORY', 'true').lower() == 'true'
+OPENAI_SUMMARY_MODEL = os.getenv('OPENAI_SUMMARY_MODEL', 'gpt-3.5-turbo')
+OPENAI_SUMMARY_MAX_TOKENS = int(os.getenv('OPENAI_SUMMARY_MAX_TOKENS', 400))
+
+# Хранилище разговоров: sqlite (переживает перезапуск) или memory
+CONVERSATION_BACKEND = os.getenv('CONVERSATION_BACKEND', 'sqlite')
+CONVERSATION_DB_PATH = os.getenv('CONVERSATION_DB_PATH', '/tmp/conversations.db')
+CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', 256))
+
+# Кэш ответов OpenAI (0 - выключен); обычный чат кэшируется только явно
+OPENAI_RESPONSE_CACHE_SIZE = int(os.getenv('OPENAI_RESPONSE_CACHE_SIZE', 0))
+OPENAI_RESPONSE_CACHE_TTL = float(os.getenv('OPENAI_RESPONSE_CACHE_TTL', 3600))
+OPENAI_CACHE_CHAT_RESPONSES = os.getenv('OPENAI_CACHE_CHAT_RESPONSES', 'false').lower() == 'true'
+
+# TickTick Open API (TICKTICK_FIXTURES - путь к записанным ответам для работы без сети)
+TICKTICK_ACCESS_TOKEN = os.getenv('TICKTICK_ACCESS_TOKEN', '')
+TICKTICK_API_URL = os.getenv('TICKTICK_API_URL', 'https://api.ticktick.com/open/v1')
+TICKTICK_PROJECT_ID = os.getenv('TICKTICK_PROJECT_ID', 'inbox')
+TICKTICK_RATE_LIMIT = float(os.getenv('TICKTICK_RATE_LIMIT', 2))
+TICKTICK_BURST = int(os.getenv('TICKTICK_BURST', 10))
+TICKTICK_FIXTURES = os.getenv('TICKTICK_FIXTURES')
+
+# Часовой пояс пользователя для сроков задач (например, Europe/Kyiv), по умолчанию - системный
+TIMEZONE = os.getenv('TIMEZONE') or None
+
+# Журнал расходов (SQLite)
+FINANCE_DB_PATH = os.getenv('FINANCE_DB_PATH', '/tmp/finance.db')
+# Ниже этой уверенности локального категоризатора категорию расхода выбирает ChatGPT
+EXPENSE_CATEGORY_CONFIDENCE = float(os.getenv('EXPENSE_CATEGORY_CONFIDENCE', 0.6))
+
+# Анализ изображений: уменьшение до IMAGE_MAX_SIDE, локальный OCR (tesseract), модель зрения
+# вызывается, только если средняя уверенность OCR ниже OCR_MIN_CONFIDENCE
+OPENAI_VISION_MODEL = os.getenv('OPENAI_VISION_MODEL', 'gpt-4-vision-preview')
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 1280))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 80))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+OCR_LANGUAGES = os.getenv('OCR_LANGUAGES', 'rus+ukr+eng')
+OCR_MIN_CONFIDENCE = float(os.getenv('OCR_MIN_CONFIDENCE', 70))
+
+# Медиафайлы держатся в памяти до MEDIA_MEMORY_LIMIT байт, крупнее - в анонимном временном файле
+MEDIA_MEMORY_LIMIT = int(os.getenv('MEDIA_MEMORY_LIMIT', 8 * 1024 * 1024))
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', 20 * 1024 * 1024))
+
+# Кэш расшифровок и анализа изображений по file_unique_id
+MEDIA_CACHE_PATH = os.getenv('MEDIA_CACHE_PATH', '/tmp/media_cache.db')
+MEDIA_CACHE_SIZE = int(os.getenv('MEDIA_CACHE_SIZE', 5000))
+
+# Распознавание речи: VOICE_BACKEND=local (faster-whisper на CPU) или openai (Whisper API)
+VOICE_BACKEND = os.getenv('VOICE_BACKEND', 'local')
+VOICE_MODEL = os.getenv('VOICE_MODEL') or None
+VOICE_DEVICE = os.getenv('VOICE_DEVICE', 'cpu')
+VOICE_COMPUTE_TYPE = os.getenv('VOICE_COMPUTE_TYPE', 'int8')
+# VOICE_WORKERS процессов распознают куски длинных записей (VOICE_CHUNK_SECONDS) параллельно
+VOICE_WORKERS = int(os.getenv('VOICE_WORKERS', min(4, os.cpu_count() or 1)))
+VOICE_CHUNK_SECONDS = float(os.getenv('VOICE_CHUNK_SECONDS', 30))
+VOICE_LANGUAGE = os.getenv('VOICE_LANGUAGE', 'ru') or None
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+
+# Анализ задач через LLM (при превышении TASK_LLM_DEADLINE секунд используется эвристика)
+TASK_LLM_ANALYSIS = os.getenv('TASK_LLM_ANALYSIS', 'false').lower() == 'true'
+TASK_LLM_MODEL = os.getenv('TASK_LLM_MODEL', 'gpt-3.5-turbo-1106')
+TASK_LLM_DEADLINE = float(os.getenv('TASK_LLM_DEADLINE', 3.0))
+
 # Проверка обязательных переменных
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не установлен")
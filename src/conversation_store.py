@@ -0,0 +1,279 @@
+"""
+Хранилище контекста разговоров с ограничением по токенам
+"""
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # токенизатор необязателен
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = "Ты полезный ассистент. Отвечай на русском языке, если пользователь пишет на русском. Будь дружелюбным и помогай пользователю."
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора: "
+
+# Служебные токены, которые OpenAI добавляет к каждому сообщению чата
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """Локальный подсчет токенов для модели"""
+    
+    def __init__(self, model: str = "gpt-4"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        else:
+            logger.warning("tiktoken не установлен, используется приблизительный подсчет токенов")
+    
+    def count(self, text: str) -> int:
+        """Количество токенов в тексте"""
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        # Грубая оценка: ~3 символа на токен для смешанного русского/английского текста
+        return len(text) // 3 + 1
+    
+    def count_message(self, content: str) -> int:
+        """Количество токенов, которое сообщение займет в запросе"""
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+class Conversation:
+    """История одного разговора с текущей суммой токенов"""
+    
+    def __init__(self, user_id: int, system_prompt: str, counter: TokenCounter, token_budget: int):
+        self.user_id = user_id
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.system_tokens = counter.count_message(system_prompt)
+        self.counter = counter
+        self.token_budget = token_budget
+        
+        # (сообщение, число токенов)
+        self.messages: Deque[Tuple[Dict[str, str], int]] = deque()
+        self.history_tokens = 0
+        self.role_counts: Dict[str, int] = {"user": 0, "assistant": 0}
+        
+        # Сводка вытесненной истории и сообщения, которые еще не вошли в нее
+        self.summary = ""
+        self.summary_tokens = 0
+        self.pending_summary: List[Dict[str, str]] = []
+    
+    @property
+    def prompt_tokens(self) -> int:
+        """Токены, которые займет вся история в запросе"""
+        return self.system_tokens + self.summary_tokens + self.history_tokens
+    
+    def set_summary(self, summary: str) -> List[Dict[str, str]]:
+        """
+        Заменить сводку вытесненной истории
+        
+        Выросшая сводка занимает часть бюджета, поэтому история сразу обрезается;
+        вытесненные сообщения встают в очередь следующей сводки.
+        
+        Returns:
+            Вытесненные сообщения (от старых к новым)
+        """
+        self.summary = summary
+        self.summary_tokens = self.counter.count_message(SUMMARY_PREFIX + summary) if summary else 0
+        evicted = self.trim()
+        self.pending_summary.extend(evicted)
+        return evicted
+    
+    def append(self, role: str, content: str) -> List[Dict[str, str]]:
+        """
+        Добавить сообщение и обрезать историю под бюджет
+        
+        Returns:
+            Вытесненные из окна сообщения (от старых к новым)
+        """
+        message = {"role": role, "content": content}
+        tokens = self.counter.count_message(content)
+        self.messages.append((message, tokens))
+        self.history_tokens += tokens
+        self.role_counts[role] = self.role_counts.get(role, 0) + 1
+        return self.trim()
+    
+    def trim(self) -> List[Dict[str, str]]:
+        """Вытеснить старые сообщения, пока история не уложится в бюджет"""
+        evicted = []
+        # Последнее сообщение остается всегда, даже если само по себе больше бюджета
+        while len(self.messages) > 1 and self.prompt_tokens > self.token_budget:
+            message, tokens = self.messages.popleft()
+            self.history_tokens -= tokens
+            self.role_counts[message["role"]] -= 1
+            evicted.append(message)
+        return evicted
+    
+    def to_messages(self) -> List[Dict[str, str]]:
+        """Сообщения в формате запроса OpenAI"""
+        messages = [self.system_message]
+        if self.summary:
+            messages.append({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+        messages.extend(message for message, _ in self.messages)
+        return messages
+    
+    def to_state(self) -> Dict[str, Any]:
+        """Состояние разговора для сохранения в хранилище"""
+        return {
+            "summary": self.summary,
+            "messages": [[message, tokens] for message, tokens in self.messages],
+            "pending_summary": self.pending_summary
+        }
+    
+    def load_state(self, state: Dict[str, Any]):
+        """Восстановить разговор из сохраненного состояния"""
+        self.pending_summary = state.get("pending_summary", [])
+        for message, tokens in state.get("messages", []):
+            self.messages.append((message, tokens))
+            self.history_tokens += tokens
+            self.role_counts[message["role"]] = self.role_counts.get(message["role"], 0) + 1
+        # Сводка ставится последней: бюджет мог уменьшиться с момента сохранения, и
+        # set_summary обрежет историю
+        self.set_summary(state.get("summary", ""))
+
+
+class ConversationBackend:
+    """Базовый интерфейс постоянного хранилища разговоров"""
+    
+    def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Загрузить состояние разговора или None"""
+        raise NotImplementedError
+    
+    def save(self, user_id: int, state: Dict[str, Any]):
+        """Сохранить состояние разговора"""
+        raise NotImplementedError
+    
+    def delete(self, user_id: int):
+        """Удалить разговор"""
+        raise NotImplementedError
+    
+    def close(self):
+        """Освободить ресурсы"""
+
+
+class SQLiteConversationBackend(ConversationBackend):
+    """Хранилище разговоров в локальной SQLite базе в режиме WAL"""
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                user_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        logger.info(f"SQLite хранилище разговоров открыто: {db_path}")
+    
+    def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute(
+            "SELECT state FROM conversations WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save(self, user_id: int, state: Dict[str, Any]):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO conversations (user_id, state, updated_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(state, ensure_ascii=False), time.time())
+        )
+    
+    def delete(self, user_id: int):
+        self.connection.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+    
+    def close(self):
+        self.connection.close()
+
+
+class ConversationStore:
+    """Хранилище разговоров: LRU-кэш горячих разговоров в памяти поверх постоянного хранилища"""
+    
+    def __init__(self, model: str = "gpt-4", token_budget: int = 6000,
+                 system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+                 backend: Optional[ConversationBackend] = None, max_cached: int = 256):
+        self.counter = TokenCounter(model)
+        self.token_budget = token_budget
+        self.system_prompt = system_prompt
+        self.backend = backend
+        self.max_cached = max_cached
+        self.conversations: "OrderedDict[int, Conversation]" = OrderedDict()
+        # Разговоры, последнее сохранение которых не удалось: их нельзя выгружать из памяти
+        self.unsaved: Set[int] = set()
+    
+    def get(self, user_id: int) -> Conversation:
+        """Получить (или создать) разговор пользователя"""
+        conversation = self.conversations.get(user_id)
+        if conversation is not None:
+            self.conversations.move_to_end(user_id)
+            return conversation
+        
+        conversation = Conversation(user_id, self.system_prompt, self.counter, self.token_budget)
+        if self.backend is not None:
+            state = self.backend.load(user_id)
+            if state:
+                conversation.load_state(state)
+        
+        self.conversations[user_id] = conversation
+        self._evict()
+        return conversation
+    
+    def _evict(self):
+        """
+        Выгрузить из памяти холодные разговоры сверх max_cached
+        
+        Выгружаются только разговоры, которые можно загрузить обратно: без постоянного
+        хранилища память - единственная копия истории, и ничего не выгружается.
+        """
+        if self.backend is None:
+            return
+        excess = len(self.conversations) - self.max_cached
+        if excess <= 0:
+            return
+        for user_id in list(self.conversations):
+            if excess <= 0:
+                break
+            if user_id in self.unsaved:
+                continue
+            del self.conversations[user_id]
+            excess -= 1
+    
+    def peek(self, user_id: int) -> Optional[Conversation]:
+        """Получить разговор из памяти, не загружая и не создавая его"""
+        return self.conversations.get(user_id)
+    
+    def save(self, conversation: Conversation):
+        """Записать изменения разговора в постоянное хранилище"""
+        if self.backend is None:
+            return
+        try:
+            self.backend.save(conversation.user_id, conversation.to_state())
+            self.unsaved.discard(conversation.user_id)
+        except Exception as e:
+            self.unsaved.add(conversation.user_id)
+            logger.error(f"Ошибка сохранения разговора пользователя {conversation.user_id}: {e}")
+    
+    def clear(self, user_id: int):
+        """Удалить разговор пользователя"""
+        self.conversations.pop(user_id, None)
+        self.unsaved.discard(user_id)
+        if self.backend is not None:
+            self.backend.delete(user_id)
+    
+    def close(self):
+        """Закрыть постоянное хранилище"""
+        if self.backend is not None:
+            self.backend.close()
@@ -0,0 +1,79 @@
+"""
+Кэш ответов ChatGPT для повторяющихся запросов
+"""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """LRU-кэш ответов с временем жизни записей"""
+    
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600):
+        """
+        Args:
+            max_entries: Максимальное число записей
+            ttl: Время жизни записи в секундах
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        """Хэш нормализованного запроса"""
+        normalized = [
+            [message["role"], " ".join(message["content"].split())]
+            for message in messages
+        ]
+        payload = json.dumps(
+            [model, normalized, round(float(temperature), 3), max_tokens],
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Получить ответ из кэша"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key: str, value: str):
+        """Сохранить ответ в кэш"""
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def clear(self):
+        """Очистить кэш"""
+        self.entries.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика попаданий"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
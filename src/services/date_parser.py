@@ -0,0 +1,447 @@
+"""
+Разбор сроков на естественном языке (русский и украинский) с учетом часового пояса
+"""
+import calendar
+import re
+import time
+from datetime import datetime, timedelta, tzinfo
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+# Время, если в выражении указан только день (конец рабочего дня)
+DEFAULT_HOUR = 18
+
+# Родительный падеж месяцев: "15 марта", "15 березня"
+MONTHS: Dict[str, int] = {}
+for number, forms in enumerate((
+    ('января', 'январь', 'січня', 'січень'),
+    ('февраля', 'февраль', 'лютого', 'лютий'),
+    ('марта', 'март', 'березня', 'березень'),
+    ('апреля', 'апрель', 'квітня', 'квітень'),
+    ('мая', 'май', 'травня', 'травень'),
+    ('июня', 'июнь', 'червня', 'червень'),
+    ('июля', 'июль', 'липня', 'липень'),
+    ('августа', 'август', 'серпня', 'серпень'),
+    ('сентября', 'сентябрь', 'вересня', 'вересень'),
+    ('октября', 'октябрь', 'жовтня', 'жовтень'),
+    ('ноября', 'ноябрь', 'листопада', 'листопад'),
+    ('декабря', 'декабрь', 'грудня', 'грудень'),
+), start=1):
+    for form in forms:
+        MONTHS[form] = number
+
+# Дни недели во всех употребимых формах и сокращениях (0 = понедельник)
+WEEKDAYS: Dict[str, int] = {}
+for number, forms in enumerate((
+    ('понедельник', 'пн', 'понеділок'),
+    ('вторник', 'вт', 'вівторок'),
+    ('среду', 'среда', 'ср', 'середу', 'середа'),
+    ('четверг', 'чт', 'четвер'),
+    ('пятницу', 'пятница', 'пт', "п'ятницю", "п'ятниця"),
+    ('субботу', 'суббота', 'сб', 'суботу', 'субота'),
+    ('воскресенье', 'вс', 'неділю', 'неділя', 'нд'),
+)):
+    for form in forms:
+        WEEKDAYS[form] = number
+
+# Родительный и дательный падежи для "до пятницы", "к пятнице", "до п'ятниці".
+# Только после "до/к": "окружающей среды" и "в среде разработки" - не срок
+WEEKDAYS_UNTIL: Dict[str, int] = {}
+for number, forms in enumerate((
+    ('понедельника', 'понедельнику', 'понеділка', 'понеділку'),
+    ('вторника', 'вторнику', 'вівторка', 'вівторку'),
+    ('среды', 'среде', 'середи', 'середі'),
+    ('четверга', 'четвергу'),
+    ('пятницы', 'пятнице', "п'ятниці"),
+    ('субботы', 'субботе', 'суботи', 'суботі'),
+    ('воскресенья', 'воскресенью', 'неділі'),
+)):
+    for form in forms:
+        WEEKDAYS_UNTIL[form] = number
+WEEKDAYS.update(WEEKDAYS_UNTIL)
+
+# Числа словами для "через три дня", "через пару годин"
+NUMBER_WORDS: Dict[str, int] = {
+    'один': 1, 'одну': 1, 'одна': 1, 'одного': 1,
+    'два': 2, 'две': 2, 'дві': 2, 'пару': 2, 'пара': 2,
+    'три': 3, 'четыре': 4, 'чотири': 4, 'пять': 5, "п'ять": 5,
+    'шесть': 6, 'шість': 6, 'семь': 7, 'сім': 7, 'восемь': 8, 'вісім': 8,
+    'девять': 9, "дев'ять": 9, 'десять': 10,
+}
+
+# Единицы относительных сроков: начало слова -> (единица, множитель)
+UNITS: List[Tuple[str, Tuple[str, int]]] = [
+    ('полчаса', ('minutes', 30)), ('півгодини', ('minutes', 30)),
+    ('мин', ('minutes', 1)), ('хвилин', ('minutes', 1)),
+    ('час', ('hours', 1)), ('годин', ('hours', 1)),
+    ('сут', ('days', 1)), ('доб', ('days', 1)),
+    ('ден', ('days', 1)), ('дн', ('days', 1)), ('день', ('days', 1)),
+    ('недел', ('weeks', 1)), ('тиж', ('weeks', 1)),
+    ('месяц', ('months', 1)), ('місяц', ('months', 1)),
+]
+
+# Слова "сегодня/завтра" -> смещение в днях
+DAY_WORDS: Dict[str, int] = {
+    'сегодня': 0, 'сьогодні': 0,
+    'завтра': 1, 'послезавтра': 2, 'післязавтра': 2,
+}
+
+# Части суток -> час по умолчанию и сдвиг для "в 7 вечера"
+DAY_PARTS: Dict[str, Tuple[int, int]] = {
+    'утра': (9, 0), 'утром': (9, 0), 'ранку': (9, 0), 'вранці': (9, 0), 'зранку': (9, 0),
+    'дня': (14, 12), 'днем': (14, 12), 'вдень': (14, 12),
+    'вечера': (19, 12), 'вечером': (19, 12), 'вечора': (19, 12), 'ввечері': (19, 12),
+    'ночи': (23, 12), 'ночью': (23, 12), 'ночі': (23, 12), 'вночі': (23, 12),
+}
+NIGHT_PARTS = ('ночи', 'ночью', 'ночі', 'вночі')
+
+
+def _alternation(words) -> str:
+    """Регулярное выражение "одно из слов" (длинные формы раньше коротких)"""
+    return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+# Грамматики компилируются один раз при импорте
+RELATIVE_RE = re.compile(
+    r"(?<!\w)(?:через|спустя)\s+(?:(\d{1,3}|" + _alternation(NUMBER_WORDS) + r")\s+)?"
+    r"(полчаса|півгодини|[а-яіїєґ]+)"
+)
+NUMERIC_DATE_RE = re.compile(r"(?<![\w.:])(\d{1,2})[./](\d{2})(?:[./](\d{2}|\d{4}))?(?![\w.:]|/\d)")
+MONTH_DATE_RE = re.compile(
+    r"(?<!\w)(\d{1,2})\s+(" + _alternation(MONTHS) + r")(?:\s+(\d{4}))?(?!\w)"
+)
+WEEKDAY_RE = re.compile(
+    r"(?<!\w)(?:(?:в|во|у|на)\s+)?(?:(следующ\w*|наступн\w*|ближайш\w*|этот|эту|цей|цю)\s+)?"
+    r"(" + _alternation(set(WEEKDAYS) - set(WEEKDAYS_UNTIL)) + r")(?!\w)"
+)
+WEEKDAY_UNTIL_RE = re.compile(
+    r"(?<!\w)(?:до|к|ко)\s+(?:(следующ\w*|наступн\w*|ближайш\w*|этой|этого|этому|цієї|цього)\s+)?"
+    r"(" + _alternation(WEEKDAYS_UNTIL) + r")(?!\w)"
+)
+DAY_WORD_RE = re.compile(r"(?<!\w)(" + _alternation(DAY_WORDS) + r")(?!\w)")
+PERIOD_RE = re.compile(
+    r"(?<!\w)(?:(на|до)\s+)?(?:(конц[аеу]|кінця)\s+)?"
+    r"(?:(этой|этой же|цьому|следующей|наступному|наступного)\s+)?"
+    r"(недел[еия]|тижн[яі]|тиждень|месяца|місяця)(?!\w)"
+)
+CLOCK_RE = re.compile(r"(?<![\w.:])(?:(?:в|во|к|до|о|об|на)\s+)?([01]?\d|2[0-3]):([0-5]\d)(?![\w:])")
+DOTTED_CLOCK_RE = re.compile(r"(?<!\w)(?:в|во|о|об)\s+([01]?\d|2[0-3])\.([0-5]\d)(?![\w.])")
+HOUR_RE = re.compile(
+    r"(?<!\w)(?:в|во|к|до|о|об|на)\s+(\d{1,2})(?![.:/]\d)(?:\s+(час\w*|годин\w*))?"
+    r"(?:\s+(" + _alternation(DAY_PARTS) + r"))?(?!\w)"
+)
+# "дня" само по себе - падеж слова "день" ("через 3 дня"), часть суток только после часа
+DAY_PART_RE = re.compile(r"(?<!\w)(" + _alternation(set(DAY_PARTS) - {'дня'}) + r")(?!\w)")
+
+# Быстрая проверка: без цифр и ключевых слов разбирать нечего
+TRIGGER_RE = re.compile(
+    r"\d|(?<!\w)(?:через|спустя|полчаса|півгодини|"
+    + _alternation(list(DAY_WORDS) + list(WEEKDAYS) + list(DAY_PARTS))
+    + r")(?!\w)|недел|тиж|месяц|місяц"
+)
+
+APOSTROPHES = str.maketrans({'’': "'", 'ʼ': "'", '`': "'", 'ё': 'е'})
+
+
+def _unit(word: str) -> Optional[Tuple[str, int]]:
+    """Единица относительного срока по началу слова"""
+    for prefix, unit in UNITS:
+        if word.startswith(prefix):
+            return unit
+    return None
+
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    """Сдвинуть дату на месяцы, прижимая день к концу короткого месяца"""
+    month_index = moment.month - 1 + months
+    year = moment.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
+class DeadlineParser:
+    """
+    Разбор сроков вида "в пятницу в 15:00", "через 3 дня", "15 марта", "завтра ввечері"
+    
+    Все грамматики и таблицы месяцев/дней недели собраны при импорте модуля,
+    поэтому разбор сообщения - несколько поисков по готовым регулярным выражениям.
+    """
+    
+    def __init__(self, timezone: Optional[str] = None, default_hour: int = DEFAULT_HOUR):
+        """
+        Args:
+            timezone: Часовой пояс пользователя (например, "Europe/Kyiv"), по умолчанию - системный
+            default_hour: Час срока, если указан только день
+        """
+        self.tz: Optional[tzinfo] = ZoneInfo(timezone) if timezone else None
+        self.default_hour = default_hour
+    
+    def now(self) -> datetime:
+        """Текущее время в часовом поясе пользователя"""
+        return datetime.now(self.tz) if self.tz else datetime.now().astimezone()
+    
+    def parse(self, text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+        """
+        Найти срок в тексте
+        
+        Args:
+            text: Текст сообщения
+            now: Точка отсчета (по умолчанию - текущее время в часовом поясе пользователя)
+        
+        Returns:
+            Срок с часовым поясом или None, если срок не найден
+        """
+        text = text.lower().translate(APOSTROPHES)
+        if not TRIGGER_RE.search(text):
+            return None
+        
+        if now is None:
+            now = self.now()
+        elif now.tzinfo is None:
+            now = now.replace(tzinfo=self.tz) if self.tz else now.astimezone()
+        
+        # Интервал "через N ..." задает момент целиком, кроме дней с явным временем
+        match = RELATIVE_RE.search(text)
+        if match:
+            unit = _unit(match.group(2))
+            if unit:
+                name, multiplier = unit
+                raw = match.group(1)
+                amount = (int(raw) if raw.isdigit() else NUMBER_WORDS[raw]) if raw else 1
+                amount *= multiplier
+                if name == 'months':
+                    moment = _add_months(now, amount)
+                else:
+                    moment = now + timedelta(**{name: amount})
+                if name in ('minutes', 'hours'):
+                    return moment.replace(second=0, microsecond=0)
+                clock = self._time(text, dated=True)
+                return self._combine(moment.date(), clock, now) if clock else moment.replace(second=0, microsecond=0)
+        
+        day = self._date(text, now)
+        clock = self._time(text, dated=day is not None)
+        
+        if day is None:
+            if clock is None:
+                return None
+            # Только время: сегодня, а если уже прошло - завтра
+            moment = self._combine(now.date(), clock, now)
+            return moment if moment > now else moment + timedelta(days=1)
+        
+        moment = self._combine(day, clock, now)
+        if moment <= now and day == now.date():
+            # "Сегодня" без времени после конца рабочего дня - до конца суток
+            moment = moment.replace(hour=23, minute=59) if clock is None else moment
+        return moment
+    
+    def _combine(self, day, clock: Optional[Tuple[int, int]], now: datetime) -> datetime:
+        """Собрать срок из дня и времени"""
+        hour, minute = clock if clock else (self.default_hour, 0)
+        if hour == 24:
+            # "12 ночи" - полночь в конце указанного дня
+            return datetime(day.year, day.month, day.day, 0, minute, tzinfo=now.tzinfo) + timedelta(days=1)
+        return datetime(day.year, day.month, day.day, hour, minute, tzinfo=now.tzinfo)
+    
+    def _date(self, text: str, now: datetime):
+        """День срока или None"""
+        today = now.date()
+        
+        match = MONTH_DATE_RE.search(text)
+        if match:
+            day = self._calendar_date(int(match.group(1)), MONTHS[match.group(2)], match.group(3), today)
+            if day:
+                return day
+        
+        match = NUMERIC_DATE_RE.search(text)
+        if match:
+            day = self._calendar_date(int(match.group(1)), int(match.group(2)), match.group(3), today)
+            if day:
+                return day
+        
+        match = DAY_WORD_RE.search(text)
+        if match:
+            return today + timedelta(days=DAY_WORDS[match.group(1)])
+        
+        match = WEEKDAY_RE.search(text) or WEEKDAY_UNTIL_RE.search(text)
+        if match:
+            weekday = WEEKDAYS[match.group(2)]
+            modifier = match.group(1) or ''
+            if modifier.startswith(('следующ', 'наступн')):
+                # Тот же день недели на следующей календарной неделе
+                return today + timedelta(days=7 - today.weekday() + weekday)
+            return today + timedelta(days=(weekday - today.weekday()) % 7 or 7)
+        
+        # Неделя или месяц - срок только с предлогом или уточнением ("на этой неделе",
+        # "наступного тижня"), а не длительность ("займет 2 недели")
+        match = next((m for m in PERIOD_RE.finditer(text) if any(m.groups()[:3])), None)
+        if match:
+            preposition, end, which, period = match.groups()
+            upcoming = bool(which) and which.startswith(('следующ', 'наступн'))
+            if period.startswith(('недел', 'тиж')):
+                if upcoming:
+                    # Следующая неделя: к концу ее рабочей части, иначе к понедельнику
+                    monday = today + timedelta(days=7 - today.weekday())
+                    return monday + timedelta(days=4) if end else monday
+                # Эта неделя: пятница, а в выходные - воскресенье
+                weekday = today.weekday()
+                return today + timedelta(days=4 - weekday if weekday <= 4 else 6 - weekday)
+            month_end = _add_months(now, 1 if upcoming else 0).date()
+            return month_end.replace(day=calendar.monthrange(month_end.year, month_end.month)[1])
+        
+        return None
+    
+    @staticmethod
+    def _calendar_date(day: int, month: int, year: Optional[str], today):
+        """Календарная дата; без года - ближайшая будущая"""
+        if not 1 <= month <= 12:
+            return None
+        if year:
+            year_value = int(year) + (2000 if len(year) == 2 else 0)
+        else:
+            year_value = today.year
+        if day < 1 or day > calendar.monthrange(year_value, month)[1]:
+            return None
+        candidate = today.replace(year=year_value, month=month, day=day)
+        if not year and candidate < today:
+            next_year = year_value + 1
+            candidate = candidate.replace(year=next_year, day=min(day, calendar.monthrange(next_year, month)[1]))
+        return candidate
+    
+    @staticmethod
+    def _time(text: str, dated: bool = False) -> Optional[Tuple[int, int]]:
+        """
+        Время срока (часы, минуты) или None
+        
+        Голое "в 5" считается часом только со словом "час", частью суток или рядом
+        с датой: иначе это количество ("столик на 5 человек", "в 2 раза").
+        "В 12 ночи" возвращается как 24:00 - полночь следующих суток.
+        """
+        match = CLOCK_RE.search(text) or DOTTED_CLOCK_RE.search(text)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+        
+        match = next((m for m in HOUR_RE.finditer(text) if dated or m.group(2) or m.group(3)), None)
+        if match:
+            hour = int(match.group(1))
+            part = match.group(3)
+            night = part in NIGHT_PARTS
+            if night and hour == 12:
+                hour = 24
+            elif part:
+                shift = DAY_PARTS[part][1]
+                if shift and hour < 12 and not (night and hour <= 4):
+                    hour += shift
+            if hour <= 23 or night and hour == 24:
+                return hour, 0
+        
+        match = DAY_PART_RE.search(text)
+        if match:
+            return DAY_PARTS[match.group(1)][0], 0
+        return None
+
+
+# Корпус для проверки точности: (текст, ожидаемый срок или None); отсчет - среда 13.03.2024 10:00
+CORPUS_NOW = datetime(2024, 3, 13, 10, 0)
+CORPUS: List[Tuple[str, Optional[datetime]]] = [
+    ("Позвонить маме", None),
+    ("Сделать отчет сегодня", datetime(2024, 3, 13, 18, 0)),
+    ("Купить молоко завтра", datetime(2024, 3, 14, 18, 0)),
+    ("Завтра в 9:30 созвон с командой", datetime(2024, 3, 14, 9, 30)),
+    ("Послезавтра утром отправить договор", datetime(2024, 3, 15, 9, 0)),
+    ("Встреча в пятницу в 15:00", datetime(2024, 3, 15, 15, 0)),
+    ("в пт сдать макет", datetime(2024, 3, 15, 18, 0)),
+    ("В понедельник созвон", datetime(2024, 3, 18, 18, 0)),
+    ("В следующий вторник в 11:00 ревью", datetime(2024, 3, 19, 11, 0)),
+    ("в среду", datetime(2024, 3, 20, 18, 0)),
+    ("Через 3 дня проверить оплату", datetime(2024, 3, 16, 10, 0)),
+    ("через два часа напомнить", datetime(2024, 3, 13, 12, 0)),
+    ("Через полчаса выйти", datetime(2024, 3, 13, 10, 30)),
+    ("через неделю", datetime(2024, 3, 20, 10, 0)),
+    ("через месяц продлить подписку", datetime(2024, 4, 13, 10, 0)),
+    ("через 2 дня в 10:00", datetime(2024, 3, 15, 10, 0)),
+    ("Подать декларацию 15 марта", datetime(2024, 3, 15, 18, 0)),
+    ("10 марта годовщина", datetime(2025, 3, 10, 18, 0)),
+    ("1 апреля 2024 в 12:00", datetime(2024, 4, 1, 12, 0)),
+    ("Дедлайн 20.03", datetime(2024, 3, 20, 18, 0)),
+    ("оплатить до 05.04.2024", datetime(2024, 4, 5, 18, 0)),
+    ("в 15:00 позвонить в банк", datetime(2024, 3, 13, 15, 0)),
+    ("в 9:00 зарядка", datetime(2024, 3, 14, 9, 0)),
+    ("В 7 вечера ужин", datetime(2024, 3, 13, 19, 0)),
+    ("в 3 часа дня встреча", datetime(2024, 3, 13, 15, 0)),
+    ("Сегодня вечером прочитать статью", datetime(2024, 3, 13, 19, 0)),
+    ("на этой неделе обновить сайт", datetime(2024, 3, 15, 18, 0)),
+    ("на следующей неделе", datetime(2024, 3, 18, 18, 0)),
+    ("до конца месяца закрыть задачи", datetime(2024, 3, 31, 18, 0)),
+    ("Зробити звіт сьогодні", datetime(2024, 3, 13, 18, 0)),
+    ("Купити хліб завтра о 8:00", datetime(2024, 3, 14, 8, 0)),
+    ("Зустріч у п'ятницю о 15:00", datetime(2024, 3, 15, 15, 0)),
+    ("Зустріч у п’ятницю", datetime(2024, 3, 15, 18, 0)),
+    ("у неділю відпочити", datetime(2024, 3, 17, 18, 0)),
+    ("через 3 дні", datetime(2024, 3, 16, 10, 0)),
+    ("через дві години", datetime(2024, 3, 13, 12, 0)),
+    ("через тиждень", datetime(2024, 3, 20, 10, 0)),
+    ("15 березня сплатити податок", datetime(2024, 3, 15, 18, 0)),
+    ("о 7 вечора вечеря", datetime(2024, 3, 13, 19, 0)),
+    ("післязавтра вранці", datetime(2024, 3, 15, 9, 0)),
+    ("до кінця місяця", datetime(2024, 3, 31, 18, 0)),
+    ("наступного тижня", datetime(2024, 3, 18, 18, 0)),
+    ("Версия 2.5 вышла", None),
+    ("Курс 37.5", None),
+    ("Прочитать 3 главы", None),
+    ("Заказать столик на 5 человек", None),
+    ("увеличить продажи в 2 раза", None),
+    ("бюджет до 10 тысяч", None),
+    ("сейчас", None),
+    ("займет 2 недели", None),
+    ("завтра в 9 планерка", datetime(2024, 3, 14, 9, 0)),
+    ("сдать до пятницы", datetime(2024, 3, 15, 18, 0)),
+    ("к пятнице отчёт", datetime(2024, 3, 15, 18, 0)),
+    ("до понедельника", datetime(2024, 3, 18, 18, 0)),
+    ("сдать до пятницы в 12:00", datetime(2024, 3, 15, 12, 0)),
+    ("ко вторнику подготовить слайды", datetime(2024, 3, 19, 18, 0)),
+    ("до следующей среды", datetime(2024, 3, 20, 18, 0)),
+    ("зробити до п'ятниці", datetime(2024, 3, 15, 18, 0)),
+    ("до неділі", datetime(2024, 3, 17, 18, 0)),
+    ("защита окружающей среды", None),
+    ("в 12 ночи выключить сервер", datetime(2024, 3, 14, 0, 0)),
+    ("завтра в 12 ночи", datetime(2024, 3, 15, 0, 0)),
+    ("в 2 ночи бэкап", datetime(2024, 3, 14, 2, 0)),
+]
+
+
+def evaluate(parser: Optional[DeadlineParser] = None, iterations: int = 2000) -> Dict[str, float]:
+    """
+    Проверить точность на корпусе и измерить скорость разбора
+    
+    Returns:
+        Доля верных ответов, список ошибок и микросекунды на сообщение
+    """
+    parser = parser or DeadlineParser("Europe/Moscow")
+    now = CORPUS_NOW.replace(tzinfo=parser.tz) if parser.tz else CORPUS_NOW.astimezone()
+    
+    failures = []
+    for text, expected in CORPUS:
+        result = parser.parse(text, now)
+        actual = result.replace(tzinfo=None) if result else None
+        if actual != expected:
+            failures.append(f"{text!r}: ожидалось {expected}, получено {actual}")
+    
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for text, _expected in CORPUS:
+            parser.parse(text, now)
+    elapsed = time.perf_counter() - started
+    
+    return {
+        'accuracy': 1 - len(failures) / len(CORPUS),
+        'failures': failures,
+        'parse_us': elapsed / (iterations * len(CORPUS)) * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    report = evaluate()
+    print(f"Точность: {report['accuracy']:.1%}, {report['parse_us']:.1f} мкс/сообщение")
+    for failure in report['failures']:
+        print(f"  {failure}")
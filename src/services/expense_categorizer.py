@@ -0,0 +1,379 @@
+"""
+Категоризация расходов: память описаний пользователя, локальный наивный Байес, LLM при сомнениях
+"""
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_CATEGORY = "Прочее"
+# Источники, чьи категории считаются подтвержденными и идут в обучение (кроме указанных
+# пользователем и исправленных): догадки модели и запасная категория не закрепляются
+CONFIRMED_SOURCES = ('llm',)
+
+# Начальные знания модели: слова, по которым категория узнается без истории пользователя
+SEED_KEYWORDS: Dict[str, List[str]] = {
+    "Продукты": [
+        "продукты", "магазин", "супермаркет", "хлеб", "молоко", "овощи", "фрукты", "мясо", "сыр",
+        "яйца", "крупа", "вода", "атб", "сильпо", "новус", "фора", "ашан", "варус",
+        "продукти", "хліб", "молоко", "овочі", "м'ясо",
+    ],
+    "Транспорт": [
+        "такси", "uber", "bolt", "uklon", "уклон", "метро", "автобус", "маршрутка", "трамвай",
+        "троллейбус", "поезд", "электричка", "бензин", "топливо", "заправка", "парковка", "проезд",
+        "таксі", "потяг", "пальне", "проїзд", "wog", "okko", "окко",
+    ],
+    "Развлечения": [
+        "кино", "кинотеатр", "театр", "концерт", "игра", "игры", "steam", "подписка", "netflix",
+        "spotify", "youtube", "боулинг", "квест", "клуб", "бар", "кафе", "ресторан", "кофе", "пицца",
+        "суши", "кава", "розваги", "гра",
+    ],
+    "Здоровье": [
+        "аптека", "лекарства", "таблетки", "врач", "доктор", "стоматолог", "клиника", "анализы",
+        "витамины", "спортзал", "фитнес", "бассейн", "ліки", "лікар", "аптеку",
+    ],
+    "Одежда": [
+        "одежда", "обувь", "куртка", "джинсы", "футболка", "кроссовки", "платье", "рубашка",
+        "носки", "zara", "h&m", "reserved", "одяг", "взуття",
+    ],
+    "Коммунальные услуги": [
+        "коммуналка", "квартплата", "электричество", "свет", "газ", "отопление", "интернет",
+        "связь", "мобильный", "телефон", "аренда", "комуналка", "опалення", "оренда", "київстар",
+        "киевстар", "vodafone", "lifecell",
+    ],
+}
+
+WORD_RE = re.compile(r"[a-zа-яіїєґ&']+")
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+# Длина основы слова: грубая замена стемминга для русского и украинского
+STEM_LENGTH = 5
+# Слова пользователя весят больше начальных: его история важнее общих знаний
+USER_WEIGHT = 3.0
+# Описаний в одном запросе к LLM при пакетной категоризации и максимум запросов на пачку
+LLM_BATCH_SIZE = 40
+LLM_MAX_BATCHES = 5
+# Сглаживание: малое, иначе при большом словаре одно ключевое слово почти не меняет вероятности
+ALPHA = 0.05
+
+
+def normalize_description(text: str) -> str:
+    """Описание без регистра, чисел и лишних пробелов - ключ памяти описаний"""
+    text = NUMBER_RE.sub(" ", text.lower().replace("ё", "е"))
+    return " ".join(WORD_RE.findall(text))
+
+
+def features(text: str) -> List[str]:
+    """Признаки описания: основы слов (первые STEM_LENGTH букв)"""
+    return [word[:STEM_LENGTH] for word in normalize_description(text).split() if len(word) > 1]
+
+
+class NaiveBayesModel:
+    """
+    Мультиномиальный наивный Байес на счетчиках
+    
+    Обучение и исправление меняют только счетчики слов описания, поэтому
+    модель дообучается за O(слов) без пересчета по всей истории.
+    """
+    
+    def __init__(self):
+        self.category_docs: Dict[str, float] = {}
+        self.category_words: Dict[str, float] = {}
+        self.word_counts: Dict[str, Dict[str, float]] = {}
+    
+    def learn(self, words: Iterable[str], category: str, weight: float = 1.0):
+        """Учесть пример (отрицательный вес - забыть его)"""
+        self.category_docs[category] = self.category_docs.get(category, 0.0) + weight
+        for word in words:
+            counts = self.word_counts.setdefault(word, {})
+            counts[category] = counts.get(category, 0.0) + weight
+            self.category_words[category] = self.category_words.get(category, 0.0) + weight
+
+
+def predict(words: List[str], models: List[Tuple[NaiveBayesModel, float]]) -> Tuple[Optional[str], float]:
+    """
+    Самая вероятная категория по нескольким моделям с весами
+    
+    Returns:
+        Категория и ее апостериорная вероятность (0, если ни одно слово не знакомо)
+    """
+    docs: Dict[str, float] = {}
+    totals: Dict[str, float] = {}
+    for model, weight in models:
+        for category, count in model.category_docs.items():
+            docs[category] = docs.get(category, 0.0) + count * weight
+        for category, count in model.category_words.items():
+            totals[category] = totals.get(category, 0.0) + count * weight
+    categories = [category for category, count in docs.items() if count > 0]
+    if not categories:
+        return None, 0.0
+    
+    known = []
+    for word in words:
+        counts: Dict[str, float] = {}
+        for model, weight in models:
+            for category, count in model.word_counts.get(word, {}).items():
+                counts[category] = counts.get(category, 0.0) + count * weight
+        if any(count > 0 for count in counts.values()):
+            known.append(counts)
+    if not known:
+        return None, 0.0
+    
+    vocabulary = sum(len(model.word_counts) for model, _weight in models)
+    all_docs = sum(docs[category] for category in categories)
+    scores = {}
+    for category in categories:
+        score = math.log(docs[category] / all_docs)
+        denominator = totals.get(category, 0.0) + ALPHA * vocabulary
+        for counts in known:
+            score += math.log((max(counts.get(category, 0.0), 0.0) + ALPHA) / denominator)
+        scores[category] = score
+    
+    best = max(scores, key=scores.get)
+    normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+    return best, 1.0 / normalizer
+
+
+class UserCategorizer:
+    """Память описаний и модель одного пользователя"""
+    
+    def __init__(self, memo_size: int):
+        self.memo_size = memo_size
+        self.memo: "OrderedDict[str, str]" = OrderedDict()
+        self.model = NaiveBayesModel()
+    
+    def learn(self, description: str, category: str, weight: float = 1.0):
+        """Запомнить описание и дообучить модель"""
+        key = normalize_description(description)
+        if not key:
+            return
+        if weight > 0:
+            self.memo[key] = category
+            self.memo.move_to_end(key)
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        elif self.memo.get(key) == category:
+            del self.memo[key]
+        self.model.learn(features(description), category, weight)
+
+
+class ExpenseCategorizer:
+    """
+    Ступенчатая категоризация расхода
+    
+    1. Точное совпадение с прошлым описанием пользователя
+    2. Наивный Байес по истории пользователя и начальным ключевым словам
+    3. ChatGPT - только если уверенность модели ниже порога
+    """
+    
+    def __init__(self, store, chatgpt=None, confidence: float = 0.6, history_size: int = 2000,
+                 users: int = 1000, model: str = "gpt-3.5-turbo-1106"):
+        """
+        Args:
+            store: ExpenseStore с историей расходов
+            chatgpt: ChatGPTClient для неуверенных случаев (None - без LLM)
+            confidence: Порог уверенности локальной модели
+            history_size: Сколько последних расходов пользователя учитывать при загрузке
+            users: Сколько пользователей держать в памяти
+            model: Модель для категоризации через LLM
+        """
+        self.store = store
+        self.chatgpt = chatgpt
+        self.confidence = confidence
+        self.history_size = history_size
+        self.users = users
+        self.model = model
+        
+        self.seed = NaiveBayesModel()
+        for category, keywords in SEED_KEYWORDS.items():
+            for keyword in keywords:
+                self.seed.learn(features(keyword), category)
+        self.user_models: "OrderedDict[int, UserCategorizer]" = OrderedDict()
+        self.stats = {'memo': 0, 'model': 0, 'llm': 0, 'fallback': 0}
+    
+    def _user(self, user_id: int) -> UserCategorizer:
+        """Модель пользователя; при первом обращении обучается на его истории"""
+        user = self.user_models.get(user_id)
+        if user is not None:
+            self.user_models.move_to_end(user_id)
+            return user
+        
+        user = UserCategorizer(self.history_size)
+        for description, category in self.store.history(user_id, self.history_size):
+            user.learn(description, category)
+        self.user_models[user_id] = user
+        while len(self.user_models) > self.users:
+            self.user_models.popitem(last=False)
+        return user
+    
+    def predict_local(self, user_id: int, description: str) -> Tuple[Optional[str], float, str]:
+        """
+        Категория без обращения к LLM
+        
+        Returns:
+            Категория (или None), уверенность и источник: memo или model
+        """
+        user = self._user(user_id)
+        category = user.memo.get(normalize_description(description))
+        if category is not None:
+            return category, 1.0, 'memo'
+        category, probability = predict(features(description), [(self.seed, 1.0), (user.model, USER_WEIGHT)])
+        return category, probability, 'model'
+    
+    async def categorize(self, user_id: int, description: str, categories: List[str]) -> Tuple[str, str]:
+        """
+        Подобрать категорию расхода
+        
+        Args:
+            user_id: ID пользователя
+            description: Описание расхода
+            categories: Допустимые категории
+        
+        Returns:
+            Категория и источник: memo, model, llm или fallback
+        """
+        started = time.perf_counter()
+        category, probability, source = self.predict_local(user_id, description)
+        elapsed = (time.perf_counter() - started) * 1000
+        if category is not None and (source == 'memo' or probability >= self.confidence):
+            self.stats[source] += 1
+            logger.info(f"Категория '{category}' ({source}, {probability:.2f}, {elapsed:.2f} мс): {description}")
+            return category, source
+        
+        if self.chatgpt is not None:
+            suggested = await self._ask_llm(description, categories)
+            if suggested is not None:
+                self.stats['llm'] += 1
+                logger.info(f"Категория '{suggested}' (llm, локально {category} {probability:.2f}): {description}")
+                return suggested, 'llm'
+        
+        self.stats['fallback'] += 1
+        return category or FALLBACK_CATEGORY, 'fallback'
+    
+    async def categorize_many(self, user_id: int, descriptions: Iterable[str],
+                              categories: List[str]) -> Dict[str, Tuple[str, str]]:
+        """
+        Категоризировать пачку расходов
+        
+        Одинаковые (после нормализации) описания разбираются один раз, а неуверенные
+        случаи уходят в LLM общими запросами по LLM_BATCH_SIZE описаний.
+        
+        Returns:
+            Описание -> (категория, источник: memo, model, llm или fallback)
+        """
+        descriptions = list(descriptions)
+        unique: Dict[str, str] = {}
+        for description in descriptions:
+            unique.setdefault(normalize_description(description), description)
+        
+        resolved: Dict[str, Tuple[str, str]] = {}
+        uncertain: List[Tuple[str, Optional[str]]] = []
+        for key, description in unique.items():
+            if not key:
+                resolved[key] = (FALLBACK_CATEGORY, 'fallback')
+                continue
+            category, probability, source = self.predict_local(user_id, description)
+            if category is not None and (source == 'memo' or probability >= self.confidence):
+                self.stats[source] += 1
+                resolved[key] = (category, source)
+            else:
+                uncertain.append((key, category))
+        
+        if uncertain and self.chatgpt is not None:
+            asked = uncertain[:LLM_BATCH_SIZE * LLM_MAX_BATCHES]
+            batches = [asked[start:start + LLM_BATCH_SIZE] for start in range(0, len(asked), LLM_BATCH_SIZE)]
+            answers = await asyncio.gather(
+                *(self._ask_llm_batch([unique[key] for key, _category in batch], categories) for batch in batches)
+            )
+            for batch, answer in zip(batches, answers):
+                for (key, _category), category in zip(batch, answer):
+                    if category is not None:
+                        self.stats['llm'] += 1
+                        resolved[key] = (category, 'llm')
+        
+        for key, category in uncertain:
+            if key not in resolved:
+                self.stats['fallback'] += 1
+                resolved[key] = (category or FALLBACK_CATEGORY, 'fallback')
+        
+        logger.info(f"Пакетная категоризация: {len(unique)} уникальных описаний, {len(uncertain)} неуверенных")
+        return {description: resolved[normalize_description(description)] for description in descriptions}
+    
+    async def _ask_llm_batch(self, descriptions: List[str], categories: List[str]) -> List[Optional[str]]:
+        """Категории для нескольких описаний одним запросом; ответ вне списка - None"""
+        try:
+            content = await self.chatgpt.complete(
+                [
+                    {
+                        "role": "system",
+                        "content": "Определи категорию каждого расхода. Категории: " + ", ".join(categories)
+                                   + '. Верни JSON-объект {"номер": "категория"} для всех номеров.'
+                    },
+                    {
+                        "role": "user",
+                        "content": "\n".join(f"{index}. {description}" for index, description in enumerate(descriptions, 1))
+                    }
+                ],
+                model=self.model,
+                temperature=0,
+                max_tokens=20 * len(descriptions),
+                response_format={"type": "json_object"}
+            )
+            answer = json.loads(content or "{}")
+            if not isinstance(answer, dict):
+                raise ValueError(f"ожидался JSON-объект: {content!r}")
+        except Exception as e:
+            logger.error(f"Ошибка пакетной категоризации через LLM: {e}")
+            return [None] * len(descriptions)
+        
+        allowed = {category.lower(): category for category in categories}
+        return [
+            allowed.get(str(answer.get(str(index), "")).strip().lower())
+            for index in range(1, len(descriptions) + 1)
+        ]
+    
+    async def _ask_llm(self, description: str, categories: List[str]) -> Optional[str]:
+        """Спросить категорию у модели; ответ вне списка отбрасывается"""
+        try:
+            content = await self.chatgpt.complete(
+                [
+                    {
+                        "role": "system",
+                        "content": "Определи категорию расхода. Ответь только названием одной категории из списка: "
+                                   + ", ".join(categories)
+                    },
+                    {"role": "user", "content": description}
+                ],
+                model=self.model,
+                temperature=0,
+                max_tokens=20
+            )
+        except Exception as e:
+            logger.error(f"Ошибка категоризации через LLM: {e}")
+            return None
+        
+        answer = (content or "").strip().strip('."\'«»').lower()
+        for category in categories:
+            if category.lower() == answer:
+                return category
+        logger.warning(f"LLM вернула категорию вне списка: {content!r}")
+        return None
+    
+    def learn(self, user_id: int, description: str, category: str):
+        """Учесть сохраненный расход"""
+        # Модель, которая еще не загружена, прочитает этот расход из журнала сама
+        user = self.user_models.get(user_id)
+        if user is not None:
+            user.learn(description, category)
+    
+    def correct(self, user_id: int, description: str, old_category: str, new_category: str):
+        """Исправление пользователя: забыть прежнюю категорию описания и выучить новую"""
+        user = self.user_models.get(user_id)
+        if user is not None:
+            user.learn(description, old_category, weight=-1.0)
+            user.learn(description, new_category)
@@ -0,0 +1,224 @@
+"""
+Разбор пачек расходов: несколько покупок в одном сообщении и банковские выписки CSV
+"""
+import codecs
+import csv
+import logging
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from services.expense_store import to_minor, to_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Покупки в сообщении разделяются переводом строки, точкой с запятой или запятой (но не десятичной)
+SEGMENT_SPLIT_RE = re.compile(r"[;\n]|,(?!\d)")
+AMOUNT_RE = re.compile(
+    r"(?<![\w.,])(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)(?:[.,](\d{1,2}))?(?![\d.,]*\d)"
+    r"\s*(грн|гривен|гривень|uah|₴|usd|\$|eur|€)?\.?",
+    re.IGNORECASE
+)
+CURRENCY_ALIASES = {
+    'грн': 'UAH', 'гривен': 'UAH', 'гривень': 'UAH', 'uah': 'UAH', '₴': 'UAH',
+    'usd': 'USD', '$': 'USD', 'eur': 'EUR', '€': 'EUR',
+}
+
+# Столбцы выписки узнаются по подстрокам заголовка (порядок важен: "сумма списания" - это debit)
+STATEMENT_COLUMNS = (
+    ('date', ('дата', 'date')),
+    ('debit', ('списан', 'расход', 'витрат', 'debit')),
+    ('amount', ('сумма', 'сума', 'amount')),
+    ('description', ('описание', 'опис', 'назначение', 'призначення', 'деталі', 'детали',
+                     'контрагент', 'description', 'details', 'merchant')),
+    ('currency', ('валюта', 'currency')),
+)
+# Сколько строк до заголовка (название банка, номер счета) можно пропустить
+MAX_PREAMBLE_LINES = 20
+DATE_FORMATS = (
+    '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%d.%m.%y',
+)
+
+
+def parse_amount(text: str) -> Optional[Decimal]:
+    """Сумма из ячейки выписки: пробелы в разрядах, запятая или точка"""
+    cleaned = text.strip().replace(" ", "").replace("\u00a0", "").replace("\u2212", "-")
+    if "," in cleaned and "." in cleaned:
+        # Есть оба знака: десятичный - последний, другой разделяет разряды ("1,234.56", "1.234,56")
+        thousands = "," if cleaned.rfind(".") > cleaned.rfind(",") else "."
+        cleaned = cleaned.replace(thousands, "")
+    cleaned = cleaned.replace(",", ".")
+    if not cleaned:
+        return None
+    try:
+        return Decimal(cleaned)
+    except InvalidOperation:
+        return None
+
+
+def parse_expense_list(text: str) -> List[Dict[str, Any]]:
+    """
+    Разобрать сообщение с несколькими покупками: "кофе 60, такси 180; продукты 950 грн"
+    
+    Returns:
+        Расходы (description, amount_minor, currency); части без суммы или описания пропускаются
+    """
+    items = []
+    for segment in SEGMENT_SPLIT_RE.split(text):
+        matches = list(AMOUNT_RE.finditer(segment))
+        if not matches:
+            continue
+        # Сумма - последнее число части: "2 кофе 120" - это 120 за два кофе
+        match = matches[-1]
+        amount = Decimal(match.group(1).replace(" ", "").replace("\u00a0", "") + "." + (match.group(2) or "0"))
+        description = (segment[:match.start()] + " " + segment[match.end():]).strip(" -–—:=\t")
+        description = " ".join(description.split())
+        if not description or amount <= 0:
+            continue
+        currency = CURRENCY_ALIASES.get((match.group(3) or "").lower(), "UAH")
+        items.append({'description': description, 'amount_minor': to_minor(amount), 'currency': currency})
+    return items
+
+
+async def iter_text_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Строки текста из потока байтов
+    
+    Кодировка определяется по первому блоку: UTF-8 (с BOM или без), иначе cp1251,
+    в которой отдают выписки многие банки.
+    """
+    decoder = None
+    pending = ""
+    async for chunk in chunks:
+        if decoder is None:
+            encoding = "utf-8-sig"
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(bytes(chunk), final=False)
+            except UnicodeDecodeError:
+                encoding = "cp1251"
+            logger.info(f"Кодировка выписки: {encoding}")
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pending += decoder.decode(bytes(chunk))
+        lines = pending.splitlines(keepends=True)
+        # Последняя строка может быть неполной - ждем следующий блок
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            yield line.rstrip("\r\n")
+    if decoder is not None:
+        pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+class StatementParser:
+    """
+    Построчный разбор банковской выписки CSV
+    
+    Разделитель и назначение столбцов определяются по строке заголовка; расходом
+    считается отрицательная сумма или положительная сумма в столбце списаний.
+    """
+    
+    def __init__(self):
+        self.delimiter: Optional[str] = None
+        self.columns: Dict[str, int] = {}
+        self.date_format: Optional[str] = None
+        self.partial = ""
+        self.preamble = 0
+        self.rows = 0
+        self.skipped = 0
+    
+    def feed(self, line: str) -> Optional[Dict[str, Any]]:
+        """Обработать строку файла; вернуть расход, если строка его содержит"""
+        # Поле в кавычках может содержать перевод строки - собираем запись целиком
+        record = self.partial + line
+        if record.count('"') % 2:
+            self.partial = record + "\n"
+            return None
+        self.partial = ""
+        if not record.strip():
+            return None
+        
+        if self.delimiter is None:
+            self.delimiter = max((";", ",", "\t"), key=record.count)
+        cells = next(csv.reader([record], delimiter=self.delimiter))
+        
+        if not self.columns:
+            self._detect_columns(cells)
+            return None
+        
+        self.rows += 1
+        item = self._parse_row(cells)
+        if item is None:
+            self.skipped += 1
+        return item
+    
+    def _detect_columns(self, cells: List[str]):
+        """Найти нужные столбцы в заголовке"""
+        for index, cell in enumerate(cells):
+            name = cell.strip().lower()
+            for column, aliases in STATEMENT_COLUMNS:
+                if column not in self.columns and any(alias in name for alias in aliases):
+                    self.columns[column] = index
+                    break
+        if 'date' not in self.columns or not ({'amount', 'debit'} & set(self.columns)):
+            # Это еще не заголовок: разделитель определится заново по следующей строке
+            self.columns = {}
+            self.delimiter = None
+            self.preamble += 1
+            if self.preamble > MAX_PREAMBLE_LINES:
+                raise ValueError("Не найден заголовок выписки со столбцами даты и суммы")
+            return
+        logger.info(f"Столбцы выписки: {self.columns}")
+    
+    def _cell(self, cells: List[str], column: str) -> str:
+        index = self.columns.get(column)
+        return cells[index].strip() if index is not None and index < len(cells) else ""
+    
+    def _parse_date(self, text: str) -> Optional[datetime]:
+        """Дата операции; удачный формат запоминается для следующих строк"""
+        formats = (self.date_format,) + DATE_FORMATS if self.date_format else DATE_FORMATS
+        for date_format in formats:
+            try:
+                moment = datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            self.date_format = date_format
+            return moment
+        return None
+    
+    def _parse_row(self, cells: List[str]) -> Optional[Dict[str, Any]]:
+        """Расход из строки выписки или None (доход, итог, мусор)"""
+        moment = self._parse_date(self._cell(cells, 'date'))
+        if moment is None:
+            return None
+        
+        amount = None
+        debit = parse_amount(self._cell(cells, 'debit'))
+        if debit is not None and debit != 0:
+            amount = abs(debit)
+        else:
+            signed = parse_amount(self._cell(cells, 'amount'))
+            if signed is not None and signed < 0:
+                amount = -signed
+        if amount is None:
+            return None
+        
+        currency = self._cell(cells, 'currency').upper() or "UAH"
+        return {
+            'description': " ".join(self._cell(cells, 'description').split())[:200],
+            'amount_minor': to_minor(amount),
+            'currency': CURRENCY_ALIASES.get(currency.lower(), currency[:3]),
+            'spent_at': to_timestamp(moment),
+        }
+
+
+async def parse_statement(chunks: AsyncIterator[bytes], parser: Optional[StatementParser] = None
+                          ) -> AsyncIterator[Dict[str, Any]]:
+    """Расходы из выписки CSV по мере чтения файла"""
+    parser = parser or StatementParser()
+    async for line in iter_text_lines(chunks):
+        item = parser.feed(line)
+        if item is not None:
+            yield item
@@ -0,0 +1,436 @@
+"""
+Журнал расходов на SQLite: суммы в копейках, индексы по пользователю, дате и категории
+"""
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые можно исправить у записи
+EDITABLE_FIELDS = ('amount_minor', 'currency', 'category', 'description', 'spent_at', 'category_confirmed')
+# Уровни агрегатов: календарные день, неделя (с понедельника), месяц и все время
+GRANULARITIES = ('day', 'week', 'month', 'all')
+
+
+def to_minor(amount) -> int:
+    """Сумма в гривнах (float/str/Decimal) -> целые копейки без ошибок округления float"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_minor(amount_minor: int) -> float:
+    """Копейки -> сумма для отображения"""
+    return amount_minor / 100
+
+
+def to_timestamp(moment: datetime) -> int:
+    """Локальное (или с часовым поясом) время -> секунды Unix"""
+    return int(moment.timestamp())
+
+
+def bucket_starts(spent_at: int) -> Dict[str, int]:
+    """Начала календарных периодов (по локальному времени), в которые попадает расход"""
+    day = datetime.fromtimestamp(spent_at).replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        'day': to_timestamp(day),
+        'week': to_timestamp(day - timedelta(days=day.weekday())),
+        'month': to_timestamp(day.replace(day=1)),
+        'all': 0,
+    }
+
+
+class ExpenseStore:
+    """
+    Расходы в SQLite (WAL) с индексами (user_id, spent_at) и (user_id, category, spent_at)
+    
+    Рядом ведутся агрегаты по дням, неделям, месяцам и категориям: каждое добавление,
+    исправление и удаление меняет их в той же транзакции, поэтому отчет читает
+    несколько строк агрегатов, а не все расходы за период.
+    """
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS expenses (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                amount_minor INTEGER NOT NULL,
+                currency TEXT NOT NULL DEFAULT 'UAH',
+                category TEXT NOT NULL,
+                description TEXT NOT NULL DEFAULT '',
+                spent_at INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                category_confirmed INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses(user_id, spent_at);
+            CREATE INDEX IF NOT EXISTS idx_expenses_user_category ON expenses(user_id, category, spent_at);
+            CREATE TABLE IF NOT EXISTS expense_rollups (
+                user_id INTEGER NOT NULL,
+                granularity TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                currency TEXT NOT NULL,
+                category TEXT NOT NULL,
+                total_minor INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, granularity, bucket, currency, category)
+            ) WITHOUT ROWID;
+            """
+        )
+        
+        # Категории старых записей считаются подтвержденными: источник уже не узнать
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(expenses)")]
+        if 'category_confirmed' not in columns:
+            self.connection.execute("ALTER TABLE expenses ADD COLUMN category_confirmed INTEGER NOT NULL DEFAULT 1")
+        
+        # Агрегаты без валюты складывали суммы в разных валютах - пересоздаем их
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(expense_rollups)")]
+        if 'currency' not in columns:
+            self.connection.executescript(
+                """
+                DROP TABLE expense_rollups;
+                CREATE TABLE expense_rollups (
+                    user_id INTEGER NOT NULL,
+                    granularity TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    currency TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    total_minor INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, granularity, bucket, currency, category)
+                ) WITHOUT ROWID;
+                """
+            )
+        
+        # Журнал, созданный до появления агрегатов, пересчитывается один раз
+        has_expenses = self.connection.execute("SELECT 1 FROM expenses LIMIT 1").fetchone()
+        has_rollups = self.connection.execute("SELECT 1 FROM expense_rollups LIMIT 1").fetchone()
+        if has_expenses and not has_rollups:
+            self.rebuild_rollups()
+        logger.info(f"Журнал расходов открыт: {db_path}")
+    
+    @contextmanager
+    def transaction(self):
+        """Транзакция: фиксация при успехе, откат при исключении (вложенные объединяются)"""
+        if self.connection.in_transaction:
+            yield self.connection
+            return
+        
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+    
+    def _apply_rollup(self, user_id: int, spent_at: int, currency: str, category: str,
+                      amount_minor: int, sign: int):
+        """Учесть расход в агрегатах (sign=1) или убрать его оттуда (sign=-1); валюты не смешиваются"""
+        for granularity, bucket in bucket_starts(spent_at).items():
+            self.connection.execute(
+                """
+                INSERT INTO expense_rollups (user_id, granularity, bucket, currency, category, total_minor, count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, granularity, bucket, currency, category) DO UPDATE SET
+                    total_minor = total_minor + excluded.total_minor,
+                    count = count + excluded.count
+                """,
+                (user_id, granularity, bucket, currency, category, sign * amount_minor, sign)
+            )
+        if sign < 0:
+            self.connection.execute("DELETE FROM expense_rollups WHERE user_id = ? AND count <= 0", (user_id,))
+    
+    def rebuild_rollups(self, user_id: Optional[int] = None):
+        """Пересчитать агрегаты по журналу целиком (для старых баз и проверки)"""
+        with self.transaction():
+            if user_id is None:
+                self.connection.execute("DELETE FROM expense_rollups")
+                rows = self.connection.execute(
+                    "SELECT user_id, spent_at, currency, category, amount_minor FROM expenses"
+                )
+            else:
+                self.connection.execute("DELETE FROM expense_rollups WHERE user_id = ?", (user_id,))
+                rows = self.connection.execute(
+                    "SELECT user_id, spent_at, currency, category, amount_minor FROM expenses WHERE user_id = ?",
+                    (user_id,)
+                )
+            for row in rows.fetchall():
+                self._apply_rollup(row[0], row[1], row[2], row[3], row[4], 1)
+    
+    def rollup(self, user_id: int, granularity: str, bucket: int) -> Dict[str, Dict[str, Tuple[int, int]]]:
+        """
+        Агрегат за один период
+        
+        Args:
+            granularity: day, week, month или all
+            bucket: Начало периода в секундах Unix (см. bucket_starts; для all - 0)
+        
+        Returns:
+            Валюта -> категория -> (сумма в минимальных единицах, количество расходов)
+        """
+        rows = self.connection.execute(
+            """
+            SELECT currency, category, total_minor, count FROM expense_rollups
+            WHERE user_id = ? AND granularity = ? AND bucket = ?
+            """,
+            (user_id, granularity, bucket)
+        )
+        result: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        for currency, category, total, count in rows:
+            result.setdefault(currency, {})[category] = (total, count)
+        return result
+    
+    def rollup_series(self, user_id: int, granularity: str, start: Optional[int] = None,
+                      end: Optional[int] = None, currency: str = "UAH") -> Dict[int, Dict[str, int]]:
+        """Суммы в одной валюте по периодам и категориям: начало периода -> категория -> сумма"""
+        query = (
+            "SELECT bucket, category, total_minor FROM expense_rollups "
+            "WHERE user_id = ? AND granularity = ? AND currency = ?"
+        )
+        params: List[Any] = [user_id, granularity, currency]
+        if start is not None:
+            query += " AND bucket >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND bucket < ?"
+            params.append(end)
+        series: Dict[int, Dict[str, int]] = {}
+        for bucket, category, total in self.connection.execute(query + " ORDER BY bucket", params):
+            series.setdefault(bucket, {})[category] = total
+        return series
+    
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+        """Строка базы -> расход"""
+        return {
+            'id': row['id'],
+            'user_id': row['user_id'],
+            'amount_minor': row['amount_minor'],
+            'amount': from_minor(row['amount_minor']),
+            'currency': row['currency'],
+            'category': row['category'],
+            'description': row['description'],
+            'date': datetime.fromtimestamp(row['spent_at']),
+            'category_confirmed': bool(row['category_confirmed']),
+        }
+    
+    def add(self, user_id: int, amount_minor: int, category: str, description: str = "",
+            spent_at: Optional[int] = None, currency: str = "UAH", category_confirmed: bool = True) -> Dict[str, Any]:
+        """
+        Добавить расход
+        
+        category_confirmed=False - категорию угадали без уверенности (запасная категория или
+        догадка модели), и категоризатор не учится на таком расходе.
+        """
+        now = time.time()
+        spent_at = int(now) if spent_at is None else spent_at
+        with self.transaction():
+            cursor = self.connection.execute(
+                """
+                INSERT INTO expenses (user_id, amount_minor, currency, category, description, spent_at, created_at,
+                                      category_confirmed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, amount_minor, currency, category, description, spent_at, now, int(category_confirmed))
+            )
+            self._apply_rollup(user_id, spent_at, currency, category, amount_minor, 1)
+        return self.get(cursor.lastrowid)
+    
+    def add_many(self, user_id: int, items: Iterable[Dict[str, Any]]) -> List[int]:
+        """
+        Добавить пачку расходов в одной транзакции
+        
+        Args:
+            items: Словари с amount_minor, category и необязательными description, spent_at, currency,
+                category_confirmed
+        
+        Returns:
+            ID добавленных записей в порядке items
+        """
+        now = time.time()
+        ids = []
+        with self.transaction():
+            for item in items:
+                spent_at = item.get('spent_at', int(now))
+                cursor = self.connection.execute(
+                    """
+                    INSERT INTO expenses (user_id, amount_minor, currency, category, description, spent_at, created_at,
+                                          category_confirmed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        user_id,
+                        item['amount_minor'],
+                        item.get('currency', 'UAH'),
+                        item['category'],
+                        item.get('description', ''),
+                        spent_at,
+                        now,
+                        int(item.get('category_confirmed', True))
+                    )
+                )
+                self._apply_rollup(
+                    user_id, spent_at, item.get('currency', 'UAH'), item['category'], item['amount_minor'], 1
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+    
+    def get(self, expense_id: int) -> Optional[Dict[str, Any]]:
+        """Расход по id"""
+        row = self.connection.execute("SELECT * FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+        return self._decode(row) if row else None
+    
+    def update(self, expense_id: int, **fields) -> Optional[Dict[str, Any]]:
+        """Исправить поля расхода (amount_minor, category, description, spent_at, currency)"""
+        unknown = set(fields) - set(EDITABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Нельзя изменить поля расхода: {', '.join(sorted(unknown))}")
+        if not fields:
+            return self.get(expense_id)
+        
+        with self.transaction():
+            old = self._raw(expense_id)
+            if old is None:
+                return None
+            assignments = ", ".join(f"{field} = ?" for field in fields)
+            self.connection.execute(
+                f"UPDATE expenses SET {assignments} WHERE id = ?", (*fields.values(), expense_id)
+            )
+            new = self._raw(expense_id)
+            self._apply_rollup(
+                old['user_id'], old['spent_at'], old['currency'], old['category'], old['amount_minor'], -1
+            )
+            self._apply_rollup(
+                new['user_id'], new['spent_at'], new['currency'], new['category'], new['amount_minor'], 1
+            )
+        return self._decode(new)
+    
+    def delete(self, expense_id: int) -> bool:
+        """Удалить расход"""
+        with self.transaction():
+            old = self._raw(expense_id)
+            if old is None:
+                return False
+            self.connection.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+            self._apply_rollup(
+                old['user_id'], old['spent_at'], old['currency'], old['category'], old['amount_minor'], -1
+            )
+        return True
+    
+    def _raw(self, expense_id: int) -> Optional[sqlite3.Row]:
+        """Строка расхода как есть"""
+        return self.connection.execute("SELECT * FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+    
+    def range(self, user_id: int, start: Optional[int] = None, end: Optional[int] = None,
+              category: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Расходы пользователя за период [start, end) по индексу, новые первыми
+        
+        Args:
+            start, end: Границы периода в секундах Unix (None - без границы)
+            category: Только эта категория
+            limit: Не больше стольких записей
+        """
+        query = "SELECT * FROM expenses WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if category is not None:
+            query += " AND category = ?"
+            params.append(category)
+        if start is not None:
+            query += " AND spent_at >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND spent_at < ?"
+            params.append(end)
+        query += " ORDER BY spent_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [self._decode(row) for row in self.connection.execute(query, params)]
+    
+    def columns(self, user_id: int, start: Optional[int] = None,
+                currency: str = "UAH") -> List[Tuple[int, int, int, str]]:
+        """
+        Расходы пользователя в одной валюте для векторной аналитики, старые первыми
+        
+        Returns:
+            (id, локальный день от 1970-01-01, сумма в минимальных единицах, категория)
+        """
+        query = (
+            "SELECT id, CAST(julianday(spent_at, 'unixepoch', 'localtime') - 2440587.5 AS INTEGER), "
+            "amount_minor, category FROM expenses WHERE user_id = ? AND currency = ?"
+        )
+        params: List[Any] = [user_id, currency]
+        if start is not None:
+            query += " AND spent_at >= ?"
+            params.append(start)
+        # Обычные кортежи вместо sqlite3.Row - заметно дешевле на тысячах строк
+        cursor = self.connection.cursor()
+        cursor.row_factory = None
+        return cursor.execute(query + " ORDER BY spent_at, id", params).fetchall()
+    
+    def totals_by_category(self, user_id: int, start: Optional[int] = None,
+                           end: Optional[int] = None, currency: str = "UAH") -> Dict[str, int]:
+        """Сумма расходов в одной валюте по категориям за период"""
+        query = "SELECT category, SUM(amount_minor) FROM expenses WHERE user_id = ? AND currency = ?"
+        params: List[Any] = [user_id, currency]
+        if start is not None:
+            query += " AND spent_at >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND spent_at < ?"
+            params.append(end)
+        query += " GROUP BY category"
+        return {row[0]: row[1] for row in self.connection.execute(query, params)}
+    
+    def categories(self, user_id: int) -> List[str]:
+        """Категории, которые встречались у пользователя"""
+        rows = self.connection.execute(
+            "SELECT DISTINCT category FROM expenses WHERE user_id = ? ORDER BY category", (user_id,)
+        )
+        return [row[0] for row in rows]
+    
+    def existing_keys(self, user_id: int, start: int, end: int) -> Set[Tuple[int, int, str]]:
+        """(время, сумма в копейках, описание) расходов за [start, end] - для пропуска повторного импорта"""
+        rows = self.connection.execute(
+            "SELECT spent_at, amount_minor, description FROM expenses WHERE user_id = ? AND spent_at BETWEEN ? AND ?",
+            (user_id, start, end)
+        )
+        return {(row[0], row[1], row[2]) for row in rows}
+    
+    def history(self, user_id: int, limit: int = 2000) -> List[Tuple[str, str]]:
+        """
+        Последние (описание, категория) пользователя, старые первыми - для обучения категоризатора
+        
+        Берутся только подтвержденные категории: угаданные без уверенности модель не закрепляет.
+        """
+        rows = self.connection.execute(
+            """
+            SELECT description, category FROM (
+                SELECT id, description, category FROM expenses
+                WHERE user_id = ? AND description != '' AND category_confirmed = 1
+                ORDER BY spent_at DESC, id DESC LIMIT ?
+            ) ORDER BY id
+            """,
+            (user_id, limit)
+        )
+        return [(row[0], row[1]) for row in rows]
+    
+    def count(self, user_id: Optional[int] = None) -> int:
+        """Количество расходов"""
+        if user_id is None:
+            return self.connection.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+        return self.connection.execute("SELECT COUNT(*) FROM expenses WHERE user_id = ?", (user_id,)).fetchone()[0]
+    
+    def close(self):
+        """Закрыть базу"""
+        self.connection.close()
@@ -0,0 +1,310 @@
+"""
+Векторная аналитика расходов: тренды, сравнение месяцев, аномалии и доли категорий
+"""
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from services.expense_store import ExpenseStore, from_minor, to_timestamp
+
+logger = logging.getLogger(__name__)
+
+EPOCH = date(1970, 1, 1)
+# Порог робастной z-оценки (медиана и MAD) для необычно крупного расхода
+ANOMALY_THRESHOLD = 3.5
+# Меньше стольких расходов в категории - статистика ненадежна, аномалии не ищем
+ANOMALY_MIN_SAMPLES = 8
+# Масштаб MAD к стандартному отклонению нормального распределения
+MAD_SCALE = 1.4826
+
+
+class Ledger:
+    """Расходы пользователя в непрерывных массивах, отсортированные по времени"""
+    
+    def __init__(self, ids: np.ndarray, days: np.ndarray, amounts: np.ndarray,
+                 codes: np.ndarray, categories: List[str]):
+        """
+        Args:
+            ids: ID записей (int64)
+            days: Локальные дни от 1970-01-01 (int64)
+            amounts: Суммы в копейках (int64)
+            codes: Номера категорий в categories (int32)
+            categories: Названия категорий
+        """
+        self.ids = ids
+        self.days = days
+        self.amounts = amounts
+        self.codes = codes
+        self.categories = categories
+    
+    @classmethod
+    def from_rows(cls, rows) -> "Ledger":
+        """Собрать массивы из строк ExpenseStore.columns"""
+        count = len(rows)
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=count)
+        days = np.fromiter((row[1] for row in rows), dtype=np.int64, count=count)
+        amounts = np.fromiter((row[2] for row in rows), dtype=np.int64, count=count)
+        categories: List[str] = []
+        index: Dict[str, int] = {}
+        codes = np.empty(count, dtype=np.int32)
+        for position, row in enumerate(rows):
+            code = index.get(row[3])
+            if code is None:
+                code = index[row[3]] = len(categories)
+                categories.append(row[3])
+            codes[position] = code
+        return cls(ids, days, amounts, codes, categories)
+    
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+
+def day_number(moment: date) -> int:
+    """Номер дня от 1970-01-01"""
+    return (moment - EPOCH).days
+
+
+def daily_totals(ledger: Ledger, first_day: int, last_day: int) -> np.ndarray:
+    """Суммы по дням [first_day, last_day] в копейках, включая дни без расходов"""
+    mask = (ledger.days >= first_day) & (ledger.days <= last_day)
+    totals = np.zeros(last_day - first_day + 1, dtype=np.int64)
+    np.add.at(totals, ledger.days[mask] - first_day, ledger.amounts[mask])
+    return totals
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Скользящее среднее за window последних значений (в начале ряда - по имеющимся)"""
+    sums = np.cumsum(values, dtype=np.float64)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def month_numbers(days: np.ndarray) -> np.ndarray:
+    """Номера месяцев от января 1970 для номеров дней"""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def monthly_by_category(ledger: Ledger, first_month: int, last_month: int) -> np.ndarray:
+    """Матрица сумм (месяц x категория) в копейках за месяцы [first_month, last_month]"""
+    months = month_numbers(ledger.days)
+    mask = (months >= first_month) & (months <= last_month)
+    shape = (last_month - first_month + 1, len(ledger.categories))
+    matrix = np.zeros(shape, dtype=np.int64)
+    np.add.at(matrix, (months[mask] - first_month, ledger.codes[mask]), ledger.amounts[mask])
+    return matrix
+
+
+def relative_change(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    """Относительное изменение; там, где раньше расходов не было, - NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(previous > 0, (current - previous) / previous, np.nan)
+
+
+def group_medians(values: np.ndarray, codes: np.ndarray, groups: int) -> np.ndarray:
+    """Медианы values внутри каждой группы без цикла по группам"""
+    order = np.lexsort((values, codes))
+    ordered = values[order]
+    counts = np.bincount(codes, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    low = starts + np.maximum(counts - 1, 0) // 2
+    high = starts + counts // 2
+    medians = np.zeros(groups, dtype=np.float64)
+    medians[present] = (ordered[low[present]] + ordered[high[present]]) / 2
+    return medians
+
+
+def anomaly_flags(ledger: Ledger, threshold: float = ANOMALY_THRESHOLD,
+                  min_samples: int = ANOMALY_MIN_SAMPLES) -> np.ndarray:
+    """
+    Отметить необычно крупные расходы
+    
+    Каждый расход сравнивается с медианой своей категории по робастной z-оценке
+    (отклонение, деленное на масштабированное MAD): единичный крупный чек не сдвигает
+    медиану, как сдвинул бы среднее.
+    """
+    if not len(ledger):
+        return np.zeros(0, dtype=bool)
+    groups = len(ledger.categories)
+    values = ledger.amounts.astype(np.float64)
+    medians = group_medians(values, ledger.codes, groups)
+    deviations = np.abs(values - medians[ledger.codes])
+    spread = group_medians(deviations, ledger.codes, groups) * MAD_SCALE
+    
+    # В категориях с одинаковыми суммами MAD равно нулю - берем среднее отклонение
+    flat = spread == 0
+    if flat.any():
+        mean_deviation = np.bincount(ledger.codes, weights=deviations, minlength=groups)
+        mean_deviation /= np.maximum(np.bincount(ledger.codes, minlength=groups), 1)
+        spread[flat] = mean_deviation[flat] * 1.2533
+    
+    counts = np.bincount(ledger.codes, minlength=groups)
+    reliable = (counts >= min_samples) & (spread > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = (values - medians[ledger.codes]) / spread[ledger.codes]
+    return reliable[ledger.codes] & (scores > threshold)
+
+
+def category_shares(ledger: Ledger, first_day: int) -> Dict[str, float]:
+    """Доли категорий в расходах начиная с first_day, по убыванию"""
+    mask = ledger.days >= first_day
+    totals = np.bincount(ledger.codes[mask], weights=ledger.amounts[mask], minlength=len(ledger.categories))
+    overall = totals.sum()
+    if overall <= 0:
+        return {}
+    order = np.argsort(totals)[::-1]
+    return {
+        ledger.categories[code]: round(float(totals[code] / overall), 4)
+        for code in order if totals[code] > 0
+    }
+
+
+class FinanceAnalytics:
+    """Тренды расходов пользователя поверх журнала ExpenseStore"""
+    
+    def __init__(self, store: ExpenseStore, months: int = 12):
+        """
+        Args:
+            store: Журнал расходов
+            months: Сколько месяцев истории анализировать
+        """
+        self.store = store
+        self.months = months
+    
+    def load(self, user_id: int, now: Optional[datetime] = None, currency: str = "UAH") -> Ledger:
+        """Загрузить историю пользователя в одной валюте за анализируемый период"""
+        now = now or datetime.now()
+        since = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(self.months - 1):
+            since = (since - timedelta(days=1)).replace(day=1)
+        return Ledger.from_rows(self.store.columns(user_id, start=to_timestamp(since), currency=currency))
+    
+    def analyze(self, user_id: int, now: Optional[datetime] = None, currency: str = "UAH") -> Dict[str, Any]:
+        """
+        Посчитать тренды по расходам в одной валюте (суммы в разных валютах не складываются)
+        
+        Returns:
+            Скользящие средние, помесячная динамика, рост по категориям,
+            доли категорий за текущий месяц и недавние аномальные расходы
+        """
+        now = now or datetime.now()
+        ledger = self.load(user_id, now, currency)
+        return self.analyze_ledger(ledger, now)
+    
+    def analyze_ledger(self, ledger: Ledger, now: datetime) -> Dict[str, Any]:
+        """Тренды по уже загруженным массивам"""
+        today = day_number(now.date())
+        month_start = day_number(now.date().replace(day=1))
+        if not len(ledger):
+            return {"expenses": 0}
+        
+        first_day = int(ledger.days.min())
+        daily = daily_totals(ledger, first_day, today)
+        week = rolling_mean(daily, 7)
+        month = rolling_mean(daily, 30)
+        
+        current_month = int(month_numbers(np.array([today]))[0])
+        first_month = int(month_numbers(np.array([first_day]))[0])
+        matrix = monthly_by_category(ledger, first_month, current_month)
+        monthly = matrix.sum(axis=1)
+        
+        # Текущий месяц еще не закончился: сравниваем его темп (в день) с прошлым месяцем
+        elapsed = today - month_start + 1
+        previous_days = month_start - day_number((now.date().replace(day=1) - timedelta(days=1)).replace(day=1))
+        growth = {}
+        month_over_month = None
+        if len(monthly) >= 2:
+            pace = matrix[-1] / elapsed
+            previous_pace = matrix[-2] / previous_days
+            changes = relative_change(pace, previous_pace)
+            month_over_month = relative_change(
+                np.array([monthly[-1] / elapsed]), np.array([monthly[-2] / previous_days])
+            )[0]
+            for code in np.argsort(np.nan_to_num(changes, nan=-np.inf))[::-1]:
+                if np.isnan(changes[code]) or changes[code] <= 0:
+                    break
+                growth[ledger.categories[code]] = round(float(changes[code]), 3)
+        
+        flags = anomaly_flags(ledger)
+        recent = flags & (ledger.days >= today - 30)
+        anomalies = [
+            {
+                "id": int(ledger.ids[index]),
+                "date": (EPOCH + timedelta(days=int(ledger.days[index]))).isoformat(),
+                "category": ledger.categories[ledger.codes[index]],
+                "amount": from_minor(int(ledger.amounts[index])),
+            }
+            for index in np.flatnonzero(recent)[::-1]
+        ]
+        
+        return {
+            "expenses": len(ledger),
+            "rolling_7d": round(from_minor(float(week[-1])), 2),
+            "rolling_30d": round(from_minor(float(month[-1])), 2),
+            "monthly_totals": {
+                str(np.datetime64(first_month + offset, 'M')): from_minor(int(total))
+                for offset, total in enumerate(monthly)
+            },
+            "month_over_month": None if month_over_month is None or np.isnan(month_over_month)
+            else round(float(month_over_month), 3),
+            "growing_categories": growth,
+            "category_shares": category_shares(ledger, month_start),
+            "anomalies": anomalies,
+        }
+
+
+def benchmark(days: int = 365, per_day: int = 25, iterations: int = 20) -> Dict[str, float]:
+    """
+    Измерить загрузку и анализ годовой истории
+    
+    Returns:
+        Число расходов и миллисекунды на загрузку и на расчет
+    """
+    categories = ["Продукты", "Транспорт", "Кафе и рестораны", "Развлечения",
+                  "Здоровье", "Одежда", "Коммунальные услуги", "Образование"]
+    generator = random.Random(42)
+    now = datetime.now().replace(microsecond=0)
+    
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    store = ExpenseStore(path)
+    try:
+        items = [
+            {
+                'amount_minor': generator.randint(2000, 60000) * (20 if generator.random() < 0.002 else 1),
+                'category': generator.choice(categories),
+                'spent_at': to_timestamp(now - timedelta(days=day, minutes=generator.randint(0, 600))),
+            }
+            for day in range(days)
+            for _ in range(per_day)
+        ]
+        store.add_many(1, items)
+        analytics = FinanceAnalytics(store)
+        
+        started = time.perf_counter()
+        for _ in range(iterations):
+            ledger = analytics.load(1, now)
+        load_ms = (time.perf_counter() - started) / iterations * 1000
+        
+        started = time.perf_counter()
+        for _ in range(iterations):
+            analytics.analyze_ledger(ledger, now)
+        analyze_ms = (time.perf_counter() - started) / iterations * 1000
+        
+        return {'expenses': len(ledger), 'load_ms': load_ms, 'analyze_ms': analyze_ms}
+    finally:
+        store.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    report = benchmark()
+    print(f"Расходов: {report['expenses']}, загрузка {report['load_ms']:.1f} мс, "
+          f"анализ {report['analyze_ms']:.1f} мс")
@@ -3,20 +3,79 @@
 """
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, Optional
+
+from services.expense_categorizer import CONFIRMED_SOURCES, ExpenseCategorizer
+from services.expense_import import StatementParser, parse_expense_list, parse_statement
+from services.expense_store import ExpenseStore, from_minor, to_minor, to_timestamp
+from services.finance_analytics import FinanceAnalytics
 
 logger = logging.getLogger(__name__)
 
+# Базовые категории расходов
+DEFAULT_CATEGORIES = [
+    "Продукты",
+    "Транспорт",
+    "Развлечения",
+    "Здоровье",
+    "Одежда",
+    "Коммунальные услуги",
+    "Прочее"
+]
+
+
+# Основная валюта: ее суммы выводятся в отчетах на верхнем уровне, остальные - в by_currency
+BASE_CURRENCY = "UAH"
+
+
+def summarize_categories(categories: Dict[str, int]) -> Dict[str, float]:
+    """Суммы по категориям (минимальные единицы -> сумма) по убыванию"""
+    return {
+        category: from_minor(amount)
+        for category, amount in sorted(categories.items(), key=lambda item: item[1], reverse=True)
+    }
+
+
+def period_start(period: str, now: datetime) -> datetime:
+    """Начало календарного периода: day, week (с понедельника) или month"""
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "day":
+        return start_of_day
+    if period == "week":
+        return start_of_day - timedelta(days=now.weekday())
+    if period == "month":
+        return start_of_day.replace(day=1)
+    raise ValueError(f"Неизвестный период: {period}")
+
 class FinanceService:
     """Сервис для управления финансами"""
     
-    def __init__(self, chatgpt_client):
-        """Инициализация сервиса финансов"""
+    def __init__(self, chatgpt_client, db_path: str = None, category_confidence: float = None):
+        """
+        Инициализация сервиса финансов
+        
+        Args:
+            chatgpt_client: ChatGPTClient
+            db_path: Путь к журналу расходов
+            category_confidence: Ниже этой уверенности локальной модели категорию выбирает ChatGPT
+        """
+        if db_path is None or category_confidence is None:
+            from config import Config
+            if db_path is None:
+                db_path = Config.FINANCE_DB_PATH
+            if category_confidence is None:
+                category_confidence = Config.EXPENSE_CATEGORY_CONFIDENCE
+        
         self.chatgpt_client = chatgpt_client
+        # Суммы хранятся в копейках (целые числа), даты - в секундах Unix
+        self.store = ExpenseStore(db_path)
+        self.analytics = FinanceAnalytics(self.store)
+        self.categorizer = ExpenseCategorizer(self.store, chatgpt_client, confidence=category_confidence)
         logger.info("FinanceService инициализирован")
     
     def add_expense(self, user_id: int, amount: float, description: str, 
-                   category: str = None) -> dict:
+                   category: str = None, date: datetime = None, currency: str = "UAH",
+                   category_confirmed: bool = True) -> dict:
         """
         Добавить расход
         
@@ -25,29 +84,170 @@ class FinanceService:
             amount: Сумма
             description: Описание
             category: Категория
-            
+            date: Время расхода (по умолчанию - сейчас)
+            currency: Валюта
+            category_confirmed: Категория указана пользователем или LLM (иначе - догадка,
+                на которой категоризатор не учится)
+        
         Returns:
             Данные о добавленном расходе
         """
         try:
-            # Заглушка для добавления расхода
-            expense_data = {
-                "id": 1,
-                "user_id": user_id,
-                "amount": amount,
-                "description": description,
-                "category": category or "Прочее",
-                "date": datetime.utcnow(),
-                "currency": "UAH"
-            }
+            amount_minor = to_minor(amount)
+            if amount_minor <= 0:
+                raise ValueError(f"Сумма расхода должна быть положительной: {amount}")
             
-            logger.info(f"Добавлен расход для пользователя {user_id}: {amount} UAH")
-            return expense_data
+            category_confirmed = category_confirmed and bool(category)
+            expense_data = self.store.add(
+                user_id,
+                amount_minor,
+                category or "Прочее",
+                description,
+                spent_at=to_timestamp(date) if date else None,
+                currency=currency,
+                category_confirmed=category_confirmed
+            )
             
+            if category_confirmed:
+                self.categorizer.learn(user_id, description, expense_data['category'])
+            logger.info(f"Добавлен расход для пользователя {user_id}: {expense_data['amount']} {currency}")
+            return expense_data
+        
         except Exception as e:
             logger.error(f"Ошибка при добавлении расхода: {e}")
             raise
     
+    async def add_expense_with_ai(self, user_id: int, amount: float, description: str,
+                                  currency: str = "UAH") -> dict:
+        """
+        Добавить расход с категорией от категоризатора
+        
+        Подтвержденной считается только категория от LLM: догадку модели и запасную
+        категорию пользователь может исправить (correct_expense_category).
+        """
+        categories = self.get_expense_categories(user_id)
+        category, source = await self.categorizer.categorize(user_id, description, categories)
+        return self.add_expense(
+            user_id, amount, description, category, currency=currency,
+            category_confirmed=source in CONFIRMED_SOURCES
+        )
+    
+    async def add_expenses_batch(self, user_id: int, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Добавить пачку расходов одной транзакцией
+        
+        Повторы отсеиваются только для строк с датой (выписки): у расходов без даты
+        ("кофе 60" текстом) нет ключа, отличающего повтор от второй такой же покупки.
+        Такие строки добавляются, а совпавшие с уже записанными сегодня (сумма и описание)
+        считаются в possible_repeats, чтобы пользователь мог их проверить.
+        
+        Args:
+            user_id: ID пользователя
+            items: Расходы (description, amount_minor, необязательные currency, spent_at, category)
+        
+        Returns:
+            Итог: added, duplicates, possible_repeats, by_currency (валюта -> total и суммы по категориям)
+        """
+        try:
+            # Строки выписки, загруженные раньше или повторенные в этой же загрузке, пропускаются
+            dated = [item['spent_at'] for item in items if item.get('spent_at') is not None]
+            existing = self.store.existing_keys(user_id, min(dated), max(dated)) if dated else set()
+            fresh = []
+            for item in items:
+                if item.get('spent_at') is not None:
+                    key = (item['spent_at'], item['amount_minor'], item.get('description', ''))
+                    if key in existing:
+                        continue
+                    existing.add(key)
+                fresh.append(item)
+            
+            # Расходы без даты записываются сейчас: совпадения с сегодняшними - возможные повторы
+            possible_repeats = 0
+            if any(item.get('spent_at') is None for item in fresh):
+                now = datetime.now()
+                today = {
+                    (amount_minor, description)
+                    for _spent_at, amount_minor, description in self.store.existing_keys(
+                        user_id, to_timestamp(period_start("day", now)), to_timestamp(now)
+                    )
+                }
+                possible_repeats = sum(
+                    1 for item in fresh
+                    if item.get('spent_at') is None and (item['amount_minor'], item.get('description', '')) in today
+                )
+            
+            # Одинаковые описания категоризируются один раз, неуверенные - общими запросами к LLM
+            # Указанные категории и ответы LLM подтверждены; догадки модели, запасная категория
+            # и описания сверх лимита запросов к LLM в обучение не идут
+            uncategorized = [item.get('description', '') for item in fresh if not item.get('category')]
+            if uncategorized:
+                assigned = await self.categorizer.categorize_many(
+                    user_id, uncategorized, self.get_expense_categories(user_id)
+                )
+                for item in fresh:
+                    if not item.get('category'):
+                        item['category'], source = assigned[item.get('description', '')]
+                        item['category_confirmed'] = source in CONFIRMED_SOURCES
+            
+            self.store.add_many(user_id, fresh)
+            
+            by_currency: Dict[str, Dict[str, int]] = {}
+            for item in fresh:
+                if item.get('category_confirmed', True):
+                    self.categorizer.learn(user_id, item.get('description', ''), item['category'])
+                by_category = by_currency.setdefault(item.get('currency', BASE_CURRENCY), {})
+                by_category[item['category']] = by_category.get(item['category'], 0) + item['amount_minor']
+            
+            logger.info(f"Добавлено {len(fresh)} расходов пачкой для пользователя {user_id}, "
+                        f"повторов пропущено: {len(items) - len(fresh)}")
+            return {
+                "added": len(fresh),
+                "duplicates": len(items) - len(fresh),
+                "possible_repeats": possible_repeats,
+                "by_currency": {
+                    currency: {
+                        "total": from_minor(sum(by_category.values())),
+                        "categories": summarize_categories(by_category)
+                    }
+                    for currency, by_category in by_currency.items()
+                }
+            }
+        
+        except Exception as e:
+            logger.error(f"Ошибка при пакетном добавлении расходов: {e}")
+            raise
+    
+    async def import_expense_text(self, user_id: int, text: str) -> Dict[str, Any]:
+        """
+        Добавить несколько расходов из одного сообщения ("кофе 60, такси 180, продукты 950")
+        
+        Returns:
+            Итог как у add_expenses_batch
+        """
+        items = parse_expense_list(text)
+        if not items:
+            return {"added": 0, "duplicates": 0, "possible_repeats": 0, "by_currency": {}}
+        return await self.add_expenses_batch(user_id, items)
+    
+    async def import_statement(self, user_id: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Импортировать банковскую выписку CSV, читая файл по частям
+        
+        Args:
+            user_id: ID пользователя
+            chunks: Содержимое файла блоками байтов
+        
+        Returns:
+            Итог как у add_expenses_batch и rows/skipped - строк в выписке и не-расходов среди них
+        """
+        parser = StatementParser()
+        items = [item async for item in parse_statement(chunks, parser)]
+        logger.info(f"Выписка: {parser.rows} строк, расходов {len(items)}")
+        
+        result = await self.add_expenses_batch(user_id, items)
+        result.update(rows=parser.rows, skipped=parser.skipped)
+        return result
+    
     def get_user_expenses(self, user_id: int, start_date: datetime = None, 
                          end_date: datetime = None) -> List[dict]:
         """
@@ -56,17 +256,20 @@ class FinanceService:
         Args:
             user_id: ID пользователя
             start_date: Начальная дата
-            end_date: Конечная дата
-            
+            end_date: Конечная дата (не включая)
+        
         Returns:
-            Список расходов
+            Список расходов, новые первыми
         """
         try:
-            # Заглушка
-            expenses = []
+            expenses = self.store.range(
+                user_id,
+                start=to_timestamp(start_date) if start_date else None,
+                end=to_timestamp(end_date) if end_date else None
+            )
             logger.info(f"Получено {len(expenses)} расходов для пользователя {user_id}")
             return expenses
-            
+        
         except Exception as e:
             logger.error(f"Ошибка при получении расходов: {e}")
             return []
@@ -77,43 +280,67 @@ class FinanceService:
         
         Args:
             user_id: ID пользователя
-            
+        
         Returns:
             Список категорий
         """
         try:
-            # Заглушка с базовыми категориями
-            categories = [
-                "Продукты",
-                "Транспорт", 
-                "Развлечения",
-                "Здоровье",
-                "Одежда",
-                "Коммунальные услуги",
-                "Прочее"
-            ]
+            # Базовые категории и те, что пользователь уже использовал
+            categories = list(DEFAULT_CATEGORIES)
+            categories += [category for category in self.store.categories(user_id) if category not in categories]
             
             return categories
-            
+        
         except Exception as e:
             logger.error(f"Ошибка при получении категорий: {e}")
             return ["Прочее"]
     
-    async def categorize_expense_with_ai(self, description: str) -> str:
+    def correct_expense_category(self, expense_id: int, category: str) -> Optional[dict]:
         """
-        Категоризировать расход с помощью ИИ
+        Исправить категорию расхода и дообучить категоризатор
         
         Args:
-            description: Описание расхода
+            expense_id: ID расхода
+            category: Правильная категория
+        
+        Returns:
+            Обновленный расход или None, если его нет
+        """
+        try:
+            old = self.store.get(expense_id)
+            if old is None:
+                return None
             
+            expense = self.store.update(expense_id, category=category, category_confirmed=1)
+            if not old['category_confirmed']:
+                # Догадку модель не выучила - забывать нечего, выбор пользователя учится как новый
+                self.categorizer.learn(old['user_id'], old['description'], category)
+                logger.info(f"Категория расхода {expense_id} подтверждена: {old['category']} -> {category}")
+            elif old['category'] != category:
+                self.categorizer.correct(old['user_id'], old['description'], old['category'], category)
+                logger.info(f"Категория расхода {expense_id} исправлена: {old['category']} -> {category}")
+            return expense
+        
+        except Exception as e:
+            logger.error(f"Ошибка при исправлении категории: {e}")
+            raise
+    
+    async def categorize_expense_with_ai(self, description: str, user_id: int = None) -> str:
+        """
+        Категоризировать расход: память описаний, локальная модель, ChatGPT при низкой уверенности
+        
+        Args:
+            description: Описание расхода
+            user_id: ID пользователя (его история улучшает категоризацию)
+        
         Returns:
             Предложенная категория
         """
         try:
-            # Заглушка для ИИ категоризации
-            logger.info(f"Категоризация расхода: {description}")
-            return "Прочее"
-            
+            categories = self.get_expense_categories(user_id) if user_id is not None else list(DEFAULT_CATEGORIES)
+            category, _source = await self.categorizer.categorize(user_id, description, categories)
+            return category
+        
         except Exception as e:
             logger.error(f"Ошибка при категоризации расхода: {e}")
             return "Прочее"
@@ -125,23 +352,42 @@ class FinanceService:
         Args:
             user_id: ID пользователя
             period: Период отчета (week, month)
-            
+        
         Returns:
             Финансовый отчет
         """
         try:
-            # Заглушка для отчета
+            now = datetime.now()
+            start = period_start(period, now)
+            # Одна строка агрегата на валюту и категорию вместо просмотра всех расходов периода
+            rollup = self.store.rollup(user_id, period, to_timestamp(start))
+            days = (now.date() - start.date()).days + 1
+            
+            # Суммы в разных валютах не складываются
+            by_currency = {}
+            for currency, categories in rollup.items():
+                by_category = {category: amount for category, (amount, _count) in categories.items()}
+                total = sum(by_category.values())
+                by_currency[currency] = {
+                    "total_expenses": from_minor(total),
+                    "categories": summarize_categories(by_category),
+                    "daily_average": round(from_minor(total) / days, 2)
+                }
+            
             report = {
                 "period": period,
-                "total_expenses": 0,
+                "start_date": start,
+                "currency": BASE_CURRENCY,
+                "total_expenses": 0.0,
                 "categories": {},
-                "daily_average": 0,
-                "currency": "UAH"
+                "daily_average": 0.0,
+                "by_currency": by_currency
             }
+            report.update(by_currency.get(BASE_CURRENCY, {}))
             
             logger.info(f"Сгенерирован финансовый отчет для пользователя {user_id}")
             return report
-            
+        
         except Exception as e:
             logger.error(f"Ошибка при генерации отчета: {e}")
             return {}
@@ -152,24 +398,72 @@ class FinanceService:
         
         Args:
             user_id: ID пользователя
-            
+        
         Returns:
             Статистика расходов
         """
         try:
-            # Заглушка
+            now = datetime.now()
+            rollups = {"all": self.store.rollup(user_id, "all", 0)}
+            for granularity in ("day", "week", "month"):
+                rollups[granularity] = self.store.rollup(
+                    user_id, granularity, to_timestamp(period_start(granularity, now))
+                )
+            
+            # Статистика считается отдельно для каждой валюты
+            by_currency = {}
+            for currency in rollups["all"]:
+                totals = {
+                    granularity: {
+                        category: amount for category, (amount, _count) in rollup.get(currency, {}).items()
+                    }
+                    for granularity, rollup in rollups.items()
+                }
+                month = totals["month"]
+                by_currency[currency] = {
+                    "total_expenses": from_minor(sum(totals["all"].values())),
+                    "this_month": from_minor(sum(month.values())),
+                    "this_week": from_minor(sum(totals["week"].values())),
+                    "today": from_minor(sum(totals["day"].values())),
+                    "average_daily": round(from_minor(sum(month.values())) / now.day, 2),
+                    "top_category": max(month, key=month.get) if month else "Прочее"
+                }
+            
             stats = {
-                "total_expenses": 0,
-                "this_month": 0,
-                "this_week": 0,
-                "today": 0,
-                "average_daily": 0,
-                "top_category": "Прочее"
+                "currency": BASE_CURRENCY,
+                "total_expenses": 0.0,
+                "this_month": 0.0,
+                "this_week": 0.0,
+                "today": 0.0,
+                "average_daily": 0.0,
+                "top_category": "Прочее",
+                "by_currency": by_currency
             }
-            
+            stats.update(by_currency.get(BASE_CURRENCY, {}))
             return stats
-            
+        
         except Exception as e:
             logger.error(f"Ошибка при получении статистики: {e}")
             return {}
-
+    
+    def get_spending_trends(self, user_id: int, currency: str = BASE_CURRENCY) -> Dict[str, Any]:
+        """
+        Получить тренды расходов за последний год
+        
+        Args:
+            user_id: ID пользователя
+            currency: Валюта анализируемых расходов
+        
+        Returns:
+            Скользящие средние, динамика по месяцам, растущие категории, доли и аномалии
+        """
+        try:
+            return self.analytics.analyze(user_id, currency=currency)
+        
+        except Exception as e:
+            logger.error(f"Ошибка при анализе трендов: {e}")
+            return {}
+    
+    def close(self):
+        """Закрыть журнал расходов"""
+        self.store.close()
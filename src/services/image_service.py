@@ -0,0 +1,211 @@
+"""
+Сервис анализа изображений: уменьшение, локальное распознавание чеков, модель зрения по необходимости
+"""
+import asyncio
+import io
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from services.media_cache import MediaResultCache
+from services.media_ingest import MediaIngestor
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# Строка с итоговой суммой чека (русские, украинские и английские чеки)
+RECEIPT_TOTAL_RE = re.compile(
+    r"(?<!\w)(итого|итог|всего|к оплате|сумма|разом|всього|до сплати|сума|total)"
+    r"[^\d\n]{0,20}(\d{1,3}(?:[ \u00a0]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)",
+    re.IGNORECASE
+)
+# Слова окончательного итога; "сумма", "всего" встречаются и в промежуточных строках и НДС
+FINAL_TOTAL_WORDS = {'итого', 'итог', 'к оплате', 'разом', 'до сплати', 'total'}
+# Для подписи расхода - первая строка, похожая на название магазина
+MERCHANT_RE = re.compile(r"[A-Za-zА-Яа-яІіЇїЄєҐґ]{3,}")
+# Меньше стольких символов распознанного текста - это не документ, нужна модель зрения
+MIN_OCR_TEXT_LENGTH = 20
+
+
+def pick_photo_size(photo_sizes, min_side: int):
+    """Самый маленький вариант фото Telegram, у которого длинная сторона не меньше min_side"""
+    sizes = sorted(photo_sizes, key=lambda size: size.width * size.height)
+    for size in sizes:
+        if max(size.width, size.height) >= min_side:
+            return size
+    return sizes[-1]
+
+
+def prepare_image(data: bytes, max_side: int, quality: int) -> Tuple[Image.Image, bytes]:
+    """
+    Повернуть по EXIF, уменьшить и пережать в JPEG
+    
+    Returns:
+        Изображение для OCR и JPEG для модели зрения
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    return image, output.getvalue()
+
+
+def run_ocr(image: Image.Image, languages: str) -> Tuple[str, float]:
+    """
+    Распознать текст локально
+    
+    Returns:
+        Текст и средняя уверенность по словам (0-100)
+    """
+    gray = ImageOps.autocontrast(ImageOps.grayscale(image))
+    data = pytesseract.image_to_data(gray, lang=languages, output_type=pytesseract.Output.DICT)
+    
+    lines: Dict[Tuple[int, int, int], List[str]] = {}
+    confidences = []
+    for index, word in enumerate(data['text']):
+        word = word.strip()
+        confidence = float(data['conf'][index])
+        if not word or confidence < 0:
+            continue
+        confidences.append(confidence)
+        key = (data['block_num'][index], data['par_num'][index], data['line_num'][index])
+        lines.setdefault(key, []).append(word)
+    
+    text = "\n".join(" ".join(words) for _key, words in sorted(lines.items()))
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return text, confidence
+
+
+def parse_receipt(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Найти в распознанном тексте итог чека и название магазина
+    
+    Итог - последняя строка "итого/к оплате/разом/total" (промежуточные итоги печатаются
+    выше), а если таких нет - последняя строка с суммой ("всего", "сумма").
+    """
+    totals = []
+    for match in RECEIPT_TOTAL_RE.finditer(text):
+        raw = match.group(2).replace(" ", "").replace("\u00a0", "").replace(",", ".")
+        try:
+            total = float(raw)
+        except ValueError:
+            continue
+        if total > 0:
+            totals.append((match.group(1).lower() in FINAL_TOTAL_WORDS, total))
+    if not totals:
+        return None
+    final = [total for is_final, total in totals if is_final]
+    total = final[-1] if final else totals[-1][1]
+    
+    merchant = None
+    for line in text.splitlines():
+        if MERCHANT_RE.search(line):
+            merchant = line.strip()[:60]
+            break
+    
+    return {'total': round(total, 2), 'merchant': merchant}
+
+
+class ImageService:
+    """Анализ фотографий: сначала локальный OCR, модель зрения - только если текст не распознан"""
+    
+    def __init__(self, chatgpt, media: MediaIngestor, cache: Optional[MediaResultCache] = None,
+                 max_side: int = 1280, jpeg_quality: int = 80, ocr_languages: str = "rus+ukr+eng",
+                 ocr_min_confidence: float = 70.0, workers: int = 2):
+        """
+        Args:
+            chatgpt: ChatGPTClient для модели зрения
+            media: Загрузчик файлов Telegram
+            cache: Кэш результатов по file_unique_id
+            max_side: Длинная сторона изображения после уменьшения
+            jpeg_quality: Качество JPEG для модели зрения
+            ocr_languages: Языки tesseract
+            ocr_min_confidence: Ниже этой средней уверенности OCR вызывается модель зрения
+            workers: Потоки для обработки изображений
+        """
+        self.chatgpt = chatgpt
+        self.media = media
+        self.cache = cache
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.ocr_languages = ocr_languages
+        self.ocr_min_confidence = ocr_min_confidence
+        # Pillow и tesseract отпускают GIL, поэтому пула потоков достаточно
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        
+        if pytesseract is None:
+            logger.warning("pytesseract не установлен: изображения анализируются только моделью зрения")
+        logger.info("ImageService инициализирован")
+    
+    async def analyze_photo(self, photo_sizes) -> Optional[Dict[str, Any]]:
+        """
+        Проанализировать фото Telegram
+        
+        Args:
+            photo_sizes: Варианты размеров фото (message.photo)
+        
+        Returns:
+            {'text': описание или распознанный текст, 'source': 'ocr'|'vision', 'receipt': {...} или None}
+        """
+        photo = pick_photo_size(photo_sizes, self.max_side)
+        if self.cache is not None:
+            cached = self.cache.get("photo", photo.file_unique_id)
+            if cached is not None:
+                return json.loads(cached)
+        
+        try:
+            async with self.media.fetch(await photo.get_file(), "photo") as buffer:
+                data = buffer.read()
+            result = await self.analyze_bytes(data)
+        except Exception as e:
+            logger.error(f"Ошибка анализа изображения: {e}")
+            return None
+        
+        if result and self.cache is not None:
+            self.cache.set("photo", photo.file_unique_id, json.dumps(result, ensure_ascii=False))
+        return result
+    
+    async def analyze_bytes(self, data: bytes) -> Optional[Dict[str, Any]]:
+        """Проанализировать изображение из памяти"""
+        loop = asyncio.get_running_loop()
+        image, jpeg = await loop.run_in_executor(self.executor, prepare_image, data, self.max_side, self.jpeg_quality)
+        
+        if pytesseract is not None:
+            try:
+                text, confidence = await loop.run_in_executor(self.executor, run_ocr, image, self.ocr_languages)
+            except Exception as e:
+                logger.warning(f"Локальный OCR не сработал: {e}")
+                text, confidence = "", 0.0
+            
+            logger.info(f"OCR: {len(text)} символов, уверенность {confidence:.0f}")
+            if confidence >= self.ocr_min_confidence and len(text) >= MIN_OCR_TEXT_LENGTH:
+                receipt = parse_receipt(text)
+                return {'text': self._describe_ocr(text, receipt), 'source': 'ocr', 'receipt': receipt}
+        
+        analysis = await self.chatgpt.analyze_image_with_text(jpeg)
+        if not analysis:
+            return None
+        return {'text': analysis, 'source': 'vision', 'receipt': parse_receipt(analysis)}
+    
+    @staticmethod
+    def _describe_ocr(text: str, receipt: Optional[Dict[str, Any]]) -> str:
+        """Ответ пользователю по результату OCR"""
+        if receipt:
+            description = f"🧾 Чек на сумму {receipt['total']:.2f} грн"
+            if receipt['merchant']:
+                description += f" ({receipt['merchant']})"
+            return description
+        return f"📄 Распознанный текст:\n{text[:1500]}"
+    
+    def close(self):
+        """Остановить пул обработки изображений"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
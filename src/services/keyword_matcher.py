@@ -0,0 +1,275 @@
+"""
+Однопроходный классификатор сообщений по ключевым словам с нормализацией русских словоформ
+"""
+import re
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Слово (с дефисами: "когда-нибудь") или число
+TOKEN_RE = re.compile(r"\w+(?:-\w+)*")
+
+# Окончания, которые отрезает легкий стеммер (проверяются от длинных к коротким)
+ENDINGS = (
+    'ания', 'ения', 'ание', 'ение', 'иями', 'ость', 'ости', 'ться', 'тесь',
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ать', 'ять', 'еть', 'ить', 'ыть',
+    'аю', 'яю', 'ешь', 'ете', 'ишь', 'ите', 'ует', 'уют', 'ают', 'яют', 'ила', 'ило', 'или', 'ала', 'ало', 'али',
+    'ия', 'ию', 'ий', 'ой', 'ей', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ом', 'ем', 'ах', 'ях', 'ам', 'ям', 'ов', 'ев', 'ил', 'ал', 'ят', 'ит', 'ет', 'ут', 'ют',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'
+)
+ENDINGS_BY_LENGTH = {
+    length: frozenset(ending for ending in ENDINGS if len(ending) == length)
+    for length in sorted({len(ending) for ending in ENDINGS}, reverse=True)
+}
+MIN_STEM_LENGTH = 3
+
+# Таблицы ключевых слов задач: категория -> метка -> слова/фразы (порядок меток = приоритет);
+# слово со звездочкой ("заплан*") - начало слова: формы с разными основами ("запланирую",
+# "запланировать") не сводятся стеммером к одной
+TASK_KEYWORD_TABLES: Dict[str, Dict[str, List[str]]] = {
+    'priority': {
+        'high': ['срочно', 'важно', 'критично', 'немедленно'],
+        'low': ['когда-нибудь', 'не спешно', 'потом'],
+    },
+    'estimate': {
+        '15-30 минут': ['быстро', 'минут', '5 мин'],
+        '1-2 часа': ['час', 'часа', 'часов'],
+        '1 день': ['день', 'дня', 'дней'],
+        '1 неделя': ['неделя', 'недели'],
+    },
+    'steps': {
+        'purchase': ['купить', 'покупка'],
+        'writing': ['написать', 'создать контент'],
+        'meeting': ['встреча', 'созвон'],
+        'analysis': ['анализ', 'исследование'],
+    },
+    'intent': {
+        'task': ['сделать', 'задача', 'нужно', 'план', 'заплан*', 'планир*', 'делегировать'],
+    },
+}
+
+# Делегаты задач: ключ -> имя, тип и навыки (навыки - таблица "delegate" классификатора)
+DELEGATES: Dict[str, Dict[str, Any]] = {
+    'anya': {
+        'name': 'Аня',
+        'type': 'personal',
+        'skills': ['личные дела', 'покупки', 'дом', 'семья']
+    },
+    'dima': {
+        'name': 'Дима',
+        'type': 'marketing_creative',
+        'skills': ['контент', 'креативы', 'дизайн', 'видео', 'фото']
+    },
+    'oleg': {
+        'name': 'Олег',
+        'type': 'marketing_strategy',
+        'skills': ['стратегия', 'процессы', 'аналитика', 'планирование']
+    }
+}
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Нормализовать словоформу: отрезать самое длинное подходящее окончание"""
+    for length, endings in ENDINGS_BY_LENGTH.items():
+        if len(word) - length >= MIN_STEM_LENGTH and word[-length:] in endings:
+            return word[:-length]
+    return word
+
+
+def normalize(text: str) -> List[str]:
+    """Текст -> список основ слов"""
+    return [stem(token) for token in TOKEN_RE.findall(text.lower())]
+
+
+class KeywordHits:
+    """Результат классификации: найденные метки по категориям"""
+    
+    def __init__(self, found: Dict[str, Set[str]], order: Dict[str, List[str]]):
+        self.found = found
+        self.order = order
+    
+    def has(self, category: str, label: Optional[str] = None) -> bool:
+        """Есть ли совпадение в категории (или конкретная метка)"""
+        labels = self.found.get(category)
+        if not labels:
+            return False
+        return label is None or label in labels
+    
+    def first(self, category: str) -> Optional[str]:
+        """Первая по приоритету найденная метка категории"""
+        labels = self.found.get(category)
+        if not labels:
+            return None
+        for label in self.order[category]:
+            if label in labels:
+                return label
+        return None
+
+
+class KeywordMatcher:
+    """
+    Словарь основ, собранный один раз из всех таблиц ключевых слов
+    
+    Текст разбивается на слова одним регулярным выражением, каждое слово
+    нормализуется и ищется в хэш-таблицах однословных и двухсловных ключей,
+    поэтому все категории проверяются за один проход по сообщению.
+    """
+    
+    def __init__(self, tables: Dict[str, Dict[str, Iterable[str]]]):
+        self.order: Dict[str, List[str]] = {category: list(labels) for category, labels in tables.items()}
+        self.unigrams: Dict[str, List[Tuple[str, str]]] = {}
+        self.bigrams: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        self.prefixes: Dict[str, List[Tuple[str, str]]] = {}
+        
+        for category, labels in tables.items():
+            for label, phrases in labels.items():
+                for phrase in phrases:
+                    if phrase.endswith('*'):
+                        prefix = phrase[:-1].lower()
+                        if not TOKEN_RE.fullmatch(prefix):
+                            raise ValueError(f"Начало слова должно быть одним словом: {phrase}")
+                        self.prefixes.setdefault(prefix, []).append((category, label))
+                        continue
+                    stems = normalize(phrase)
+                    if len(stems) == 1:
+                        self.unigrams.setdefault(stems[0], []).append((category, label))
+                    elif len(stems) == 2:
+                        self.bigrams.setdefault((stems[0], stems[1]), []).append((category, label))
+                    else:
+                        raise ValueError(f"Поддерживаются фразы из одного-двух слов: {phrase}")
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes})
+    
+    def match(self, text: str) -> KeywordHits:
+        """Найти все метки всех категорий за один проход"""
+        found: Dict[str, Set[str]] = {}
+        unigrams = self.unigrams
+        bigrams = self.bigrams
+        prefixes = self.prefixes
+        previous = None
+        for token in TOKEN_RE.findall(text.lower()):
+            for length in self.prefix_lengths:
+                hits = prefixes.get(token[:length])
+                if hits:
+                    for category, label in hits:
+                        found.setdefault(category, set()).add(label)
+            current = stem(token)
+            hits = unigrams.get(current)
+            if hits:
+                for category, label in hits:
+                    found.setdefault(category, set()).add(label)
+            hits = bigrams.get((previous, current))
+            if hits:
+                for category, label in hits:
+                    found.setdefault(category, set()).add(label)
+            previous = current
+        return KeywordHits(found, self.order)
+
+
+def _legacy_scan(text: str, tables: Dict[str, Dict[str, List[str]]]) -> Dict[str, Optional[str]]:
+    """Прежний способ: отдельный проход any(word in text) на каждую метку"""
+    text_lower = text.lower()
+    result = {}
+    for category, labels in tables.items():
+        result[category] = None
+        for label, words in labels.items():
+            if any(word.rstrip('*') in text_lower for word in words):
+                result[category] = label
+                break
+    return result
+
+
+def _sample_tables() -> Dict[str, Dict[str, List[str]]]:
+    """Таблицы задач с навыками делегатов, как их собирает SmartTaskService"""
+    tables = dict(TASK_KEYWORD_TABLES)
+    tables['delegate'] = {key: info['skills'] for key, info in DELEGATES.items()}
+    return tables
+
+
+# Корпус сверки с прежним способом: сообщение и категории, где новый разбор расходится с ним
+# намеренно (прежний поиск подстрок не узнавал словоформы: "неделе", "встречу", "семьи")
+ROUTING_CORPUS: List[Tuple[str, Dict[str, Optional[str]]]] = [
+    ("Нужно срочно подготовить стратегию продвижения на неделе и обсудить на созвоне",
+     {'estimate': '1 неделя', 'delegate': 'oleg'}),
+    ("Купить продукты домой сегодня, быстро", {}),
+    ("Когда-нибудь написать статью про дизайн и сделать фото для блога", {}),
+    ("Сделать анализ расходов за месяц, займет пару часов", {}),
+    ("Как дела? Что посоветуешь почитать вечером?", {}),
+    ("Запланировать встречу с подрядчиком", {'steps': 'meeting'}),
+    ("Планирую ремонт на кухне, это займет неделя", {}),
+    ("Составить план продаж на квартал", {}),
+    ("Важно: созвон с клиентом, час на подготовку", {}),
+    ("Делегировать Диме видео для рекламы", {}),
+    ("Задача: исследование рынка, критично к пятнице", {}),
+    ("Покупка подарка для семьи, не спешно", {'delegate': 'anya'}),
+    ("Немедленно отправить договор", {}),
+    ("Потом посмотреть фото с отпуска", {}),
+    ("Анализ процессов отдела займет 2 дня", {'delegate': 'oleg'}),
+    ("Нужно обновить контент на сайте за 5 мин", {}),
+    ("Создать контент для соцсетей", {}),
+    ("Расскажи анекдот", {}),
+]
+
+
+def evaluate(tables: Optional[Dict[str, Dict[str, List[str]]]] = None) -> Dict[str, object]:
+    """
+    Сверить новый разбор с прежним (_legacy_scan) на ROUTING_CORPUS
+    
+    Returns:
+        Доля совпавших решений (сообщение x категория) и список неожиданных расхождений
+    """
+    tables = tables or _sample_tables()
+    matcher = KeywordMatcher(tables)
+    
+    mismatches = []
+    checked = 0
+    for message, differences in ROUTING_CORPUS:
+        legacy = _legacy_scan(message, tables)
+        hits = matcher.match(message)
+        for category in tables:
+            checked += 1
+            expected = differences.get(category, legacy[category])
+            if hits.first(category) != expected:
+                mismatches.append(
+                    f"{message!r} [{category}]: прежний {legacy[category]}, ожидалось {expected}, "
+                    f"получено {hits.first(category)}"
+                )
+    
+    return {
+        'agreement': 1 - len(mismatches) / checked,
+        'mismatches': mismatches,
+    }
+
+
+def benchmark(iterations: int = 20000) -> Dict[str, float]:
+    """
+    Сравнить стоимость классификации одного сообщения до и после
+    
+    Returns:
+        Микросекунды на сообщение для прежнего и нового способа
+    """
+    tables = _sample_tables()
+    messages = [message for message, _differences in ROUTING_CORPUS[:5]]
+    matcher = KeywordMatcher(tables)
+    
+    results = {}
+    for name, run in (
+        ('legacy_us', lambda m: _legacy_scan(m, tables)),
+        ('matcher_us', matcher.match),
+    ):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for message in messages:
+                run(message)
+        results[name] = (time.perf_counter() - started) / (iterations * len(messages)) * 1e6
+    return results
+
+
+if __name__ == "__main__":
+    report = evaluate()
+    print(f"Совпадение с прежним разбором: {report['agreement']:.1%}")
+    for mismatch in report['mismatches']:
+        print(f"  {mismatch}")
+    for name, value in benchmark().items():
+        print(f"{name}: {value:.2f} мкс/сообщение")
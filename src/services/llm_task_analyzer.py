@@ -0,0 +1,163 @@
+"""
+Анализ задач через ChatGPT со структурированным ответом и кэшем результатов
+"""
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_INSTRUCTIONS = """Ты помощник по планированию задач. Проанализируй задачу пользователя и верни только JSON-объект:
+{{
+  "title": "короткий заголовок задачи",
+  "priority": "high" | "medium" | "low",
+  "estimated_time": "оценка времени, например '15-30 минут', '1-2 часа', '1 день'",
+  "due_date": "срок в формате ISO 8601 (YYYY-MM-DDTHH:MM) или null",
+  "steps": ["до 4 конкретных шагов"],
+  "delegate": один из {delegates} или null,
+  "confidence": число от 0 до 1
+}}
+Делегаты: {delegate_skills}.
+Сейчас: {now}."""
+
+PRIORITIES = {'high', 'medium', 'low'}
+
+
+class LLMTaskAnalyzer:
+    """Анализ задач через LLM с ограничением времени ожидания и мемоизацией"""
+    
+    def __init__(self, chatgpt, delegates: Dict[str, Dict[str, Any]], model: str = "gpt-3.5-turbo-1106",
+                 deadline: float = 3.0, memo_size: int = 512):
+        """
+        Args:
+            chatgpt: ChatGPTClient
+            delegates: Делегаты SmartTaskService
+            model: Модель с поддержкой JSON-ответов
+            deadline: Сколько секунд ответ пользователю может ждать LLM
+            memo_size: Сколько результатов анализа хранить
+        """
+        self.chatgpt = chatgpt
+        self.delegates = delegates
+        self.model = model
+        self.deadline = deadline
+        self.memo_size = memo_size
+        
+        self.memo: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Запросы, не уложившиеся в срок: дорабатывают в фоне и пополняют кэш
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.background: Set[asyncio.Task] = set()
+    
+    @staticmethod
+    def normalize(task_text: str) -> str:
+        """Текст без регистра и лишних пробелов"""
+        return " ".join(task_text.lower().split())
+    
+    def memo_key(self, task_text: str) -> str:
+        """
+        Ключ кэша: текущая дата и нормализованный текст
+        
+        Срок в ответе модели посчитан от даты запроса ("завтра", "в пятницу"),
+        поэтому результат вчерашнего анализа того же текста не используется.
+        """
+        return f"{date.today().isoformat()}|{self.normalize(task_text)}"
+    
+    async def analyze(self, task_text: str) -> Optional[Dict[str, Any]]:
+        """
+        Проанализировать задачу, не дольше deadline секунд
+        
+        Returns:
+            Проверенные поля анализа или None (не успели, ошибка) - тогда нужна эвристика
+        """
+        key = self.memo_key(task_text)
+        cached = self.memo.get(key)
+        if cached is not None:
+            self.memo.move_to_end(key)
+            return dict(cached)
+        
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._request(key, task_text))
+            self.inflight[key] = task
+            self.background.add(task)
+            task.add_done_callback(self._finished)
+        
+        try:
+            # shield: по таймауту запрос не отменяется и сохранит результат для следующего раза
+            result = await asyncio.wait_for(asyncio.shield(task), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            logger.info(f"LLM-анализ задачи не уложился в {self.deadline} c, используется эвристика")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка LLM-анализа задачи: {e}")
+            return None
+        return dict(result) if result else None
+    
+    def _finished(self, task: asyncio.Task):
+        """Забыть завершенный фоновый запрос (ошибка уже залогирована или передана ожидающим)"""
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Фоновый LLM-анализ завершился ошибкой: {task.exception()}")
+    
+    async def _request(self, key: str, task_text: str) -> Optional[Dict[str, Any]]:
+        """Запросить анализ у модели и сохранить результат"""
+        try:
+            instructions = ANALYSIS_INSTRUCTIONS.format(
+                delegates=", ".join(f'"{k}"' for k in self.delegates),
+                delegate_skills="; ".join(
+                    f"{k} ({info['name']}): {', '.join(info['skills'])}" for k, info in self.delegates.items()
+                ),
+                now=datetime.now().strftime('%Y-%m-%dT%H:%M (%A)')
+            )
+            content = await self.chatgpt.complete(
+                [
+                    {"role": "system", "content": instructions},
+                    {"role": "user", "content": task_text}
+                ],
+                model=self.model,
+                temperature=0,
+                max_tokens=500,
+                response_format={"type": "json_object"}
+            )
+            result = self.validate(json.loads(content or "{}"))
+        finally:
+            self.inflight.pop(key, None)
+        
+        if result:
+            self.memo[key] = result
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        return result
+    
+    def validate(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Оставить только корректные поля ответа модели"""
+        if not isinstance(data, dict):
+            return None
+        
+        result: Dict[str, Any] = {}
+        if isinstance(data.get('title'), str) and data['title'].strip():
+            result['title'] = data['title'].strip()[:100]
+        if data.get('priority') in PRIORITIES:
+            result['priority'] = data['priority']
+        if isinstance(data.get('estimated_time'), str) and data['estimated_time'].strip():
+            result['estimated_time'] = data['estimated_time'].strip()
+        if isinstance(data.get('due_date'), str):
+            try:
+                due_date = datetime.fromisoformat(data['due_date'])
+                result['due_date'] = due_date.astimezone().replace(tzinfo=None) if due_date.tzinfo else due_date
+            except ValueError:
+                pass
+        if isinstance(data.get('steps'), list):
+            steps = [step.strip() for step in data['steps'] if isinstance(step, str) and step.strip()]
+            if steps:
+                result['steps'] = steps[:4]
+        if data.get('delegate') in self.delegates:
+            result['suggested_delegate'] = data['delegate']
+        elif 'delegate' in data and data['delegate'] is None:
+            result['suggested_delegate'] = None
+        if isinstance(data.get('confidence'), (int, float)):
+            result['analysis_confidence'] = max(0.0, min(1.0, float(data['confidence'])))
+        
+        return result or None
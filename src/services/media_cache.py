@@ -0,0 +1,104 @@
+"""
+Постоянный кэш результатов обработки медиа (расшифровки, анализ изображений)
+"""
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MediaResultCache:
+    """
+    LRU-кэш в SQLite по file_unique_id Telegram
+    
+    file_unique_id одинаков у пересланных и повторно отправленных копий файла,
+    поэтому по нему можно пропустить и скачивание, и распознавание.
+    """
+    
+    def __init__(self, db_path: str = "/tmp/media_cache.db", max_entries: int = 5000):
+        """
+        Args:
+            db_path: Путь к базе кэша
+            max_entries: Максимальное число записей (старые по последнему обращению вытесняются)
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_results (
+                kind TEXT NOT NULL,
+                file_unique_id TEXT NOT NULL,
+                result TEXT NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (kind, file_unique_id)
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS idx_media_results_accessed ON media_results(accessed_at)")
+        self.size = self.connection.execute("SELECT COUNT(*) FROM media_results").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        logger.info(f"Кэш медиа открыт: {db_path} ({self.size} записей)")
+    
+    def get(self, kind: str, file_unique_id: Optional[str]) -> Optional[str]:
+        """Получить сохраненный результат и отметить обращение"""
+        if not file_unique_id:
+            return None
+        row = self.connection.execute(
+            "SELECT result FROM media_results WHERE kind = ? AND file_unique_id = ?", (kind, file_unique_id)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        
+        self.connection.execute(
+            "UPDATE media_results SET accessed_at = ? WHERE kind = ? AND file_unique_id = ?",
+            (time.time(), kind, file_unique_id)
+        )
+        self.hits += 1
+        return row[0]
+    
+    def set(self, kind: str, file_unique_id: Optional[str], result: str):
+        """Сохранить результат и вытеснить давно не использованные записи"""
+        if not file_unique_id or not result:
+            return
+        cursor = self.connection.execute(
+            "UPDATE media_results SET result = ?, accessed_at = ? WHERE kind = ? AND file_unique_id = ?",
+            (result, time.time(), kind, file_unique_id)
+        )
+        if cursor.rowcount:
+            return
+        
+        self.connection.execute(
+            "INSERT INTO media_results (kind, file_unique_id, result, accessed_at) VALUES (?, ?, ?, ?)",
+            (kind, file_unique_id, result, time.time())
+        )
+        self.size += 1
+        if self.size > self.max_entries:
+            # Вытесняем с запасом в 10%, чтобы не удалять по одной записи на каждую вставку
+            excess = self.size - self.max_entries + max(1, self.max_entries // 10)
+            self.connection.execute(
+                "DELETE FROM media_results WHERE rowid IN "
+                "(SELECT rowid FROM media_results ORDER BY accessed_at LIMIT ?)",
+                (excess,)
+            )
+            self.size = self.connection.execute("SELECT COUNT(*) FROM media_results").fetchone()[0]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика попаданий"""
+        total = self.hits + self.misses
+        return {
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+    
+    def close(self):
+        """Закрыть базу"""
+        self.connection.close()
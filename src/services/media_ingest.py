@@ -0,0 +1,172 @@
+"""
+Загрузка медиафайлов Telegram в ограниченные буферы памяти без временных файлов
+"""
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Bot API отдает боту файлы не больше 20 МБ
+TELEGRAM_MAX_DOWNLOAD = 20 * 1024 * 1024
+
+
+class MediaTooLarge(Exception):
+    """Файл превышает допустимый размер"""
+
+
+class MediaBuffer:
+    """
+    Содержимое медиафайла: в памяти до порога, выше - в анонимном временном файле
+    
+    Анонимный файл (TemporaryFile) не имеет имени в файловой системе и удаляется
+    при закрытии или завершении процесса, поэтому утечь на диске не может.
+    """
+    
+    def __init__(self, memory_limit: int, max_bytes: int, name: str = "media"):
+        self.memory_limit = memory_limit
+        self.max_bytes = max_bytes
+        self.name = name
+        self.size = 0
+        self.data = bytearray()
+        self.spill: Optional[BinaryIO] = None
+    
+    @property
+    def in_memory(self) -> bool:
+        """Хранятся ли данные в памяти"""
+        return self.spill is None
+    
+    def write(self, chunk: bytes):
+        """Дописать часть файла"""
+        if self.size + len(chunk) > self.max_bytes:
+            raise MediaTooLarge(f"{self.name}: больше {self.max_bytes} байт")
+        if self.spill is None and self.size + len(chunk) > self.memory_limit:
+            self.spill = tempfile.TemporaryFile()
+            self.spill.write(self.data)
+            self.data = bytearray()
+        if self.spill is None:
+            self.data += chunk
+        else:
+            self.spill.write(chunk)
+        self.size += len(chunk)
+    
+    def getbuffer(self) -> memoryview:
+        """Данные без копирования (только для буфера в памяти)"""
+        if self.spill is not None:
+            raise ValueError("Данные выгружены на диск, используйте iter_chunks() или read()")
+        return memoryview(self.data)
+    
+    def read(self) -> bytes:
+        """Все данные одним блоком"""
+        if self.spill is None:
+            return bytes(self.data)
+        self.spill.seek(0)
+        return self.spill.read()
+    
+    async def iter_chunks(self, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Отдавать данные частями: срезы памяти или чтение файла в потоке"""
+        if self.spill is None:
+            view = memoryview(self.data)
+            for offset in range(0, self.size, chunk_size):
+                yield view[offset:offset + chunk_size]
+            return
+        self.spill.seek(0)
+        while True:
+            chunk = await asyncio.to_thread(self.spill.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    
+    def close(self):
+        """Освободить память и удалить временный файл"""
+        self.data = bytearray()
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MediaIngestor:
+    """Скачивание файлов Telegram потоком в MediaBuffer"""
+    
+    def __init__(self, memory_limit: Optional[int] = None, max_bytes: Optional[int] = None,
+                 http_client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            memory_limit: Сколько байт держать в памяти, прежде чем выгрузить на диск
+            max_bytes: Максимальный размер файла
+            http_client: Общий HTTP-клиент (по умолчанию создается свой)
+        """
+        if memory_limit is None:
+            from config import Config
+            memory_limit = Config.MEDIA_MEMORY_LIMIT
+            max_bytes = Config.MEDIA_MAX_BYTES
+        
+        self.memory_limit = memory_limit
+        self.max_bytes = max_bytes or TELEGRAM_MAX_DOWNLOAD
+        self.owns_client = http_client is None
+        self.http_client = http_client or httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0))
+    
+    async def iter_file(self, telegram_file) -> AsyncIterator[bytes]:
+        """Скачивать файл Telegram частями по мере поступления"""
+        path = telegram_file.file_path
+        if urlparse(path).scheme in ("http", "https"):
+            async with self.http_client.stream("GET", path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+            return
+        
+        # Локальный Bot API сервер отдает путь к файлу на диске
+        async for chunk in iter_local_file(path):
+            yield chunk
+    
+    async def download(self, telegram_file, name: str = "media") -> MediaBuffer:
+        """Скачать файл в буфер (вызывающий обязан закрыть буфер - удобнее через fetch)"""
+        file_size = getattr(telegram_file, 'file_size', None) or 0
+        if file_size > self.max_bytes:
+            raise MediaTooLarge(f"{name}: {file_size} байт, допустимо {self.max_bytes}")
+        
+        buffer = MediaBuffer(self.memory_limit, self.max_bytes, name)
+        try:
+            async for chunk in self.iter_file(telegram_file):
+                buffer.write(chunk)
+        except BaseException:
+            buffer.close()
+            raise
+        return buffer
+    
+    @asynccontextmanager
+    async def fetch(self, telegram_file, name: str = "media") -> AsyncIterator[MediaBuffer]:
+        """Скачать файл и гарантированно освободить буфер после использования"""
+        buffer = await self.download(telegram_file, name)
+        try:
+            yield buffer
+        finally:
+            buffer.close()
+    
+    async def close(self):
+        """Закрыть собственный HTTP-клиент"""
+        if self.owns_client:
+            await self.http_client.aclose()
+
+
+async def iter_local_file(path: str) -> AsyncIterator[bytes]:
+    """Читать файл с диска частями, не блокируя цикл событий"""
+    with open(path, "rb") as source:
+        while True:
+            chunk = await asyncio.to_thread(source.read, DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
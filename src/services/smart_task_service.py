@@ -1,64 +1,82 @@
 """
 Исправленный умный сервис задач с правильными импортами
 """
-import json
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Dict, Optional, Any
-import os
 import asyncio
 
-from services.ticktick_integration import TickTickIntegration
+from services.date_parser import DeadlineParser
+from services.keyword_matcher import DELEGATES, KeywordHits, KeywordMatcher, TASK_KEYWORD_TABLES
+from services.llm_task_analyzer import LLMTaskAnalyzer
+from services.task_store import IndexedTaskStore
+from services.ticktick_integration import TickTickIntegration, parse_ticktick_datetime
+from services.ticktick_outbox import TickTickOutbox
 
 logger = logging.getLogger(__name__)
 
 class SmartTaskService:
     """Умный сервис для управления задачами с TickTick интеграцией"""
     
-    def __init__(self, user_id: str):
+    def __init__(self, user_id: str, ticktick: Optional[TickTickIntegration] = None, chatgpt=None,
+                 llm_model: str = "gpt-3.5-turbo-1106", llm_deadline: float = 3.0, timezone: Optional[str] = None):
         self.user_id = user_id
-        self.tasks_file = f"/tmp/tasks_{user_id}.json"
-        self.ticktick = TickTickIntegration()
+        self.tasks_file = f"/tmp/tasks_{user_id}.db"
+        # Задачи держатся в памяти с индексами и пишутся в базу сразу (write-through);
+        # старый JSON-файл переносится в базу при первом запуске
+        self.store = IndexedTaskStore(self.tasks_file, legacy_json_path=f"/tmp/tasks_{user_id}.json")
+        # Клиент TickTick общий для всего бота (один пул соединений и лимит частоты)
+        self.ticktick = ticktick or TickTickIntegration()
+        # Изменения уходят в TickTick в фоне, не задерживая ответ пользователю
+        self.outbox = TickTickOutbox(self.store, self.ticktick)
         
         # Делегаты для задач
-        self.delegates = {
-            'anya': {
-                'name': 'Аня',
-                'type': 'personal',
-                'skills': ['личные дела', 'покупки', 'дом', 'семья']
-            },
-            'dima': {
-                'name': 'Дима',
-                'type': 'marketing_creative',
-                'skills': ['контент', 'креативы', 'дизайн', 'видео', 'фото']
-            },
-            'oleg': {
-                'name': 'Олег',
-                'type': 'marketing_strategy',
-                'skills': ['стратегия', 'процессы', 'аналитика', 'планирование']
-            }
-        }
+        self.delegates = DELEGATES
+        
+        # Все таблицы ключевых слов (включая навыки делегатов) собираются в один классификатор
+        self.matcher = KeywordMatcher({
+            **TASK_KEYWORD_TABLES,
+            'delegate': {key: info['skills'] for key, info in self.delegates.items()}
+        })
+        
+        # Сроки "в пятницу в 15:00", "через 3 дня" считаются в часовом поясе пользователя
+        self.deadline_parser = DeadlineParser(timezone)
+        
+        # Необязательный LLM-анализ: без клиента ChatGPT используется только эвристика
+        self.llm_analyzer = LLMTaskAnalyzer(chatgpt, self.delegates, model=llm_model, deadline=llm_deadline) if chatgpt else None
         
         logger.info(f"SmartTaskService инициализирован для пользователя {user_id}")
     
+    def start_background_sync(self):
+        """Запустить фоновую отправку изменений в TickTick (нужен запущенный цикл событий)"""
+        self.outbox.start()
+    
+    async def stop_background_sync(self):
+        """Остановить фоновую отправку изменений в TickTick"""
+        await self.outbox.stop()
+    
     def load_tasks(self) -> List[Dict[str, Any]]:
-        """Загрузить задачи из файла"""
+        """Загрузить все задачи"""
         try:
-            if os.path.exists(self.tasks_file):
-                with open(self.tasks_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            return self.store.all()
         except Exception as e:
             logger.error(f"Ошибка загрузки задач: {e}")
         return []
     
     def save_tasks(self, tasks: List[Dict[str, Any]]):
-        """Сохранить задачи в файл"""
+        """Сохранить задачи (одной транзакцией)"""
         try:
-            with open(self.tasks_file, 'w', encoding='utf-8') as f:
-                json.dump(tasks, f, ensure_ascii=False, indent=2, default=str)
+            self.store.put_many(tasks)
         except Exception as e:
             logger.error(f"Ошибка сохранения задач: {e}")
     
+    def save_task(self, task: Dict[str, Any]):
+        """Сохранить одну задачу"""
+        try:
+            self.store.put(task)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения задачи {task.get('id')}: {e}")
+    
     async def create_smart_task(self, task_text: str) -> Dict[str, Any]:
         """Создать умную задачу с анализом и предложениями"""
         try:
@@ -67,7 +85,7 @@ class SmartTaskService:
             
             # Создаем задачу
             task = {
-                'id': len(self.load_tasks()) + 1,
+                'id': self.store.allocate_id(),
                 'title': analysis.get('title', task_text),
                 'description': analysis.get('description', ''),
                 'status': 'pending',
@@ -81,26 +99,12 @@ class SmartTaskService:
                 'external_id': None  # ID в TickTick
             }
             
-            # Сохраняем локально
-            tasks = self.load_tasks()
-            tasks.append(task)
-            self.save_tasks(tasks)
-            
-            # Синхронизируем с TickTick
-            try:
-                ticktick_id = await self.ticktick.sync_task_from_bot(task)
-                if ticktick_id:
-                    task['external_id'] = ticktick_id
-                    # Обновляем локальную копию
-                    tasks = self.load_tasks()
-                    for t in tasks:
-                        if t['id'] == task['id']:
-                            t['external_id'] = ticktick_id
-                            break
-                    self.save_tasks(tasks)
-                    logger.info(f"Задача синхронизирована с TickTick: {ticktick_id}")
-            except Exception as e:
-                logger.error(f"Ошибка синхронизации с TickTick: {e}")
+            # Сохраняем локально и ставим отправку в TickTick в очередь одной транзакцией;
+            # external_id заполнит фоновый обработчик очереди. store.put, а не save_task:
+            # ошибка записи должна откатить и строку очереди
+            with self.store.transaction():
+                self.store.put(task)
+                self.outbox.enqueue(task['id'], 'create')
             
             return task
             
@@ -108,11 +112,39 @@ class SmartTaskService:
             logger.error(f"Ошибка создания умной задачи: {e}")
             return {'error': str(e)}
     
+    def classify(self, text: str) -> KeywordHits:
+        """Классифицировать сообщение по всем таблицам ключевых слов за один проход"""
+        return self.matcher.match(text)
+    
+    def is_task_message(self, text: str) -> bool:
+        """Похоже ли сообщение на постановку задачи"""
+        return self.classify(text).has('intent', 'task')
+    
     async def analyze_task(self, task_text: str) -> Dict[str, Any]:
-        """Анализировать задачу и дать рекомендации"""
+        """
+        Анализировать задачу и дать рекомендации
+        
+        Если подключен LLM-анализ, его поля дополняют эвристику; если модель не успела
+        за отведенное время или ошиблась, возвращается только эвристический анализ.
+        """
+        analysis = self.heuristic_analysis(task_text)
+        if self.llm_analyzer is None or analysis.get('error'):
+            return analysis
+        
+        llm_analysis = await self.llm_analyzer.analyze(task_text)
+        if llm_analysis:
+            if 'analysis_confidence' not in llm_analysis:
+                # Уверенность эвристики к ответу модели не относится
+                analysis.pop('analysis_confidence', None)
+            analysis.update(llm_analysis)
+            analysis['source'] = 'llm'
+        return analysis
+    
+    def heuristic_analysis(self, task_text: str) -> Dict[str, Any]:
+        """Быстрый анализ задачи по ключевым словам"""
         try:
             # Простой анализ на основе ключевых слов
-            text_lower = task_text.lower()
+            hits = self.classify(task_text)
             
             # Определяем заголовок
             title = task_text.split('.')[0].strip()
@@ -120,46 +152,25 @@ class SmartTaskService:
                 title = title[:100] + "..."
             
             # Определяем приоритет
-            priority = 'medium'
-            if any(word in text_lower for word in ['срочно', 'важно', 'критично', 'немедленно']):
-                priority = 'high'
-            elif any(word in text_lower for word in ['когда-нибудь', 'не спешно', 'потом']):
-                priority = 'low'
+            priority = hits.first('priority') or 'medium'
             
             # Оценка времени
-            estimated_time = 'не определено'
-            if any(word in text_lower for word in ['быстро', 'минут', '5 мин']):
-                estimated_time = '15-30 минут'
-            elif any(word in text_lower for word in ['час', 'часа']):
-                estimated_time = '1-2 часа'
-            elif any(word in text_lower for word in ['день', 'дня']):
-                estimated_time = '1 день'
-            elif any(word in text_lower for word in ['неделя', 'недели']):
-                estimated_time = '1 неделя'
-            
-            # Предложение делегирования
-            suggested_delegate = None
-            
-            # Проверяем каждого делегата
-            for delegate_key, delegate_info in self.delegates.items():
-                for skill in delegate_info['skills']:
-                    if skill in text_lower:
-                        suggested_delegate = delegate_key
-                        break
-                if suggested_delegate:
-                    break
+            estimated_time = hits.first('estimate') or 'не определено'
+            
+            # Предложение делегирования (первый делегат по порядку, чей навык упомянут)
+            suggested_delegate = hits.first('delegate')
             
             # Создаем план действий
-            steps = self.generate_action_steps(task_text)
+            steps = self.generate_action_steps(task_text, hits)
             
-            # Определяем дедлайн
-            due_date = None
-            if any(word in text_lower for word in ['сегодня', 'сейчас']):
-                due_date = datetime.now() + timedelta(hours=8)
-            elif any(word in text_lower for word in ['завтра']):
-                due_date = datetime.now() + timedelta(days=1)
-            elif any(word in text_lower for word in ['неделя', 'на неделе']):
-                due_date = datetime.now() + timedelta(days=7)
+            # Определяем дедлайн (задачи хранят локальное время сервера без часового пояса)
+            due_date = self.deadline_parser.parse(task_text)
+            if due_date is not None:
+                due_date = due_date.astimezone().replace(tzinfo=None)
+            
+            # Уверенность растет с числом найденных признаков: приоритет, оценка, делегат, срок
+            found = (hits.first('priority'), hits.first('estimate'), suggested_delegate, due_date)
+            confidence = 0.4 + 0.1 * sum(value is not None for value in found)
             
             return {
                 'title': title,
@@ -169,41 +180,44 @@ class SmartTaskService:
                 'suggested_delegate': suggested_delegate,
                 'steps': steps,
                 'due_date': due_date,
-                'analysis_confidence': 0.8
+                'analysis_confidence': round(confidence, 2),
+                'source': 'heuristic'
             }
             
         except Exception as e:
             logger.error(f"Ошибка анализа задачи: {e}")
             return {'title': task_text, 'error': str(e)}
     
-    def generate_action_steps(self, task_text: str) -> List[str]:
+    def generate_action_steps(self, task_text: str, hits: Optional[KeywordHits] = None) -> List[str]:
         """Генерировать план действий для задачи"""
-        text_lower = task_text.lower()
+        if hits is None:
+            hits = self.classify(task_text)
+        task_type = hits.first('steps')
         steps = []
         
         # Базовые шаги в зависимости от типа задачи
-        if any(word in text_lower for word in ['купить', 'покупка']):
+        if task_type == 'purchase':
             steps = [
                 "Составить список необходимого",
                 "Найти лучшие предложения",
                 "Сделать покупку",
                 "Проверить качество"
             ]
-        elif any(word in text_lower for word in ['написать', 'создать контент']):
+        elif task_type == 'writing':
             steps = [
                 "Исследовать тему",
                 "Создать структуру",
                 "Написать черновик",
                 "Отредактировать и опубликовать"
             ]
-        elif any(word in text_lower for word in ['встреча', 'созвон']):
+        elif task_type == 'meeting':
             steps = [
                 "Подготовить повестку дня",
                 "Отправить приглашения",
                 "Провести встречу",
                 "Зафиксировать результаты"
             ]
-        elif any(word in text_lower for word in ['анализ', 'исследование']):
+        elif task_type == 'analysis':
             steps = [
                 "Собрать данные",
                 "Проанализировать информацию",
@@ -224,13 +238,7 @@ class SmartTaskService:
     async def delegate_task(self, task_id: int, delegate_key: str) -> Dict[str, Any]:
         """Делегировать задачу"""
         try:
-            tasks = self.load_tasks()
-            task = None
-            
-            for t in tasks:
-                if t['id'] == task_id:
-                    task = t
-                    break
+            task = self.store.get(task_id)
             
             if not task:
                 return {'error': 'Задача не найдена'}
@@ -249,20 +257,14 @@ class SmartTaskService:
             instructions = self.generate_delegation_instructions(task, delegate)
             task['delegation_instructions'] = instructions
             
-            # Сохраняем изменения
-            self.save_tasks(tasks)
-            
-            # Обновляем в TickTick (добавляем пометку о делегировании)
-            if task.get('external_id'):
-                try:
-                    updated_title = f"[{delegate['name']}] {task['title']}"
-                    await self.ticktick.update_task(
-                        task['external_id'],
-                        title=updated_title,
-                        content=f"{task.get('description', '')}\n\nДелегировано: {delegate['name']}\n{instructions}"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка обновления делегированной задачи в TickTick: {e}")
+            # Сохраняем изменения и обновление в TickTick (пометка о делегировании) одной
+            # транзакцией; если задача еще не создана в TickTick, обновление дождется ее создания
+            with self.store.transaction():
+                self.store.put(task)
+                self.outbox.enqueue(task['id'], 'update', {
+                    'title': f"[{delegate['name']}] {task['title']}",
+                    'content': f"{task.get('description', '')}\n\nДелегировано: {delegate['name']}\n{instructions}"
+                })
             
             return {
                 'success': True,
@@ -309,24 +311,30 @@ class SmartTaskService:
     
     def get_pending_tasks(self) -> List[Dict[str, Any]]:
         """Получить активные задачи"""
-        tasks = self.load_tasks()
-        return [t for t in tasks if t.get('status') in ['pending', 'in_progress']]
+        return self.store.by_status(['pending', 'in_progress'])
     
     def get_delegated_tasks(self) -> Dict[str, List[Dict[str, Any]]]:
         """Получить делегированные задачи по исполнителям"""
-        tasks = self.load_tasks()
-        delegated = {}
-        
-        for delegate_key in self.delegates.keys():
-            delegated[delegate_key] = [
-                t for t in tasks 
-                if t.get('delegated_to') == delegate_key and t.get('status') == 'delegated'
-            ]
-        
-        return delegated
+        return {
+            delegate_key: self.store.by_delegate(delegate_key, 'delegated')
+            for delegate_key in self.delegates.keys()
+        }
+    
+    @staticmethod
+    def _ticktick_modified_ms(tt_task: Dict[str, Any]) -> Optional[int]:
+        """Время изменения задачи TickTick в миллисекундах или None"""
+        modified_at = parse_ticktick_datetime(tt_task.get('modifiedTime'))
+        return int(modified_at.timestamp() * 1000) if modified_at else None
     
     async def sync_with_ticktick(self) -> Dict[str, Any]:
-        """Синхронизация с TickTick"""
+        """
+        Синхронизация с TickTick
+        
+        Обрабатываются только задачи, измененные после прошлой синхронизации
+        (по modifiedTime), сопоставление идет через индекс по external_id,
+        а все изменения записываются одной транзакцией. Отметка не сдвигается
+        дальше задач, которые не удалось импортировать, чтобы повторить их позже.
+        """
         try:
             # Проверяем подключение
             if not await self.ticktick.test_connection():
@@ -337,42 +345,87 @@ class SmartTaskService:
             
             # Получаем задачи из TickTick
             ticktick_tasks = await self.ticktick.get_all_tasks()
-            local_tasks = self.load_tasks()
-            
-            synced_count = 0
-            new_tasks = 0
+            high_water_mark = self.store.get_meta('ticktick_modified_ms', 0)
             
-            # Синхронизируем задачи из TickTick в локальную базу
+            # Оставляем только изменения после отметки (задачи без modifiedTime проверяем всегда)
+            changed = {}
+            modified = {}
             for tt_task in ticktick_tasks:
-                tt_id = tt_task.get('id')
-                
-                # Ищем задачу в локальной базе
-                local_task = None
-                for lt in local_tasks:
-                    if lt.get('external_id') == tt_id:
-                        local_task = lt
-                        break
+                modified_ms = self._ticktick_modified_ms(tt_task)
+                if modified_ms is not None:
+                    if modified_ms <= high_water_mark:
+                        continue
+                    modified[tt_task.get('id')] = modified_ms
+                changed[tt_task.get('id')] = tt_task
+            
+            # Локальные задачи, чье создание в TickTick еще в очереди: external_id у них
+            # появится позже, и удаленная копия не должна импортироваться как новая задача
+            pending_titles = set()
+            for task_id in self.store.pending_create_ids():
+                task = self.store.get(task_id)
+                if task and not task.get('external_id'):
+                    pending_titles.add(task.get('title'))
+            
+            updated_tasks = []
+            remote_new_tasks = []
+            deferred = []
+            
+            for tt_id, tt_task in changed.items():
+                local_task = self.store.get_by_external_id(tt_id)
                 
                 if local_task:
                     # Обновляем существующую задачу
-                    if tt_task.get('status') == 2:  # completed
-                        local_task['status'] = 'completed'
-                        synced_count += 1
+                    changed_fields = {}
+                    if tt_task.get('status') == 2 and local_task.get('status') != 'completed':  # completed
+                        changed_fields.update(status='completed', completed_at=datetime.now())
+                    # Проект задачи нужен для ее обновления через Open API и после перезапуска
+                    if tt_task.get('projectId') and local_task.get('external_project_id') != tt_task['projectId']:
+                        changed_fields['external_project_id'] = tt_task['projectId']
+                    if changed_fields:
+                        updated_tasks.append({**local_task, **changed_fields})
+                elif tt_task.get('title') in pending_titles:
+                    deferred.append(tt_id)
                 else:
-                    # Создаем новую задачу из TickTick
-                    new_task = await self.ticktick.sync_task_to_bot(tt_task)
-                    if new_task:
-                        new_task['id'] = len(local_tasks) + new_tasks + 1
-                        local_tasks.append(new_task)
-                        new_tasks += 1
+                    remote_new_tasks.append(tt_task)
             
-            # Сохраняем обновленные задачи
-            self.save_tasks(local_tasks)
+            # Создаем новые задачи из TickTick
+            new_tasks = []
+            for tt_task in remote_new_tasks:
+                try:
+                    new_task = await self.ticktick.sync_task_to_bot(tt_task)
+                except Exception as e:
+                    logger.error(f"Ошибка импорта задачи TickTick {tt_task.get('id')}: {e}")
+                    new_task = None
+                if new_task:
+                    new_task.setdefault('external_id', tt_task.get('id'))
+                    new_tasks.append(new_task)
+                else:
+                    deferred.append(tt_task.get('id'))
+            
+            for new_task, task_id in zip(new_tasks, self.store.allocate_ids(len(new_tasks))):
+                new_task['id'] = task_id
+            
+            # Отметка доходит до самого позднего изменения, но останавливается перед
+            # самой ранней отложенной задачей, чтобы следующая синхронизация ее повторила
+            new_high_water_mark = max(modified.values(), default=high_water_mark)
+            retry_marks = [modified[tt_id] for tt_id in deferred if tt_id in modified]
+            if retry_marks:
+                new_high_water_mark = min(retry_marks) - 1
+            new_high_water_mark = max(new_high_water_mark, high_water_mark)
+            if deferred:
+                logger.info(f"Отложен импорт задач TickTick до следующей синхронизации: {len(deferred)}")
+            
+            # Сохраняем все изменения и новую отметку одной транзакцией
+            with self.store.transaction():
+                self.store.put_many(updated_tasks + new_tasks)
+                self.store.set_meta('ticktick_modified_ms', new_high_water_mark)
             
             return {
                 'success': True,
-                'synced_count': synced_count,
-                'new_tasks': new_tasks,
+                'synced_count': len(updated_tasks),
+                'new_tasks': len(new_tasks),
+                'changed_tasks': len(changed),
+                'deferred_tasks': len(deferred),
                 'total_ticktick_tasks': len(ticktick_tasks)
             }
             
@@ -386,13 +439,7 @@ class SmartTaskService:
     async def get_task_summary(self, task_id: int) -> str:
         """Получить подробную сводку по задаче"""
         try:
-            tasks = self.load_tasks()
-            task = None
-            
-            for t in tasks:
-                if t['id'] == task_id:
-                    task = t
-                    break
+            task = self.store.get(task_id)
             
             if not task:
                 return "❌ Задача не найдена"
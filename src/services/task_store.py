@@ -0,0 +1,429 @@
+"""
+Хранилище задач на SQLite с индексами
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Поля задачи, которые хранятся как datetime
+DATETIME_FIELDS = ('created_at', 'due_date', 'delegated_at', 'completed_at')
+
+
+def _json_default(value):
+    """Сериализация datetime в ISO-формат"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_task(task: Dict[str, Any]) -> str:
+    """Задача -> JSON"""
+    return json.dumps(task, ensure_ascii=False, default=_json_default)
+
+
+def decode_task(data: str) -> Dict[str, Any]:
+    """JSON -> задача с восстановленными datetime"""
+    task = json.loads(data)
+    for field in DATETIME_FIELDS:
+        value = task.get(field)
+        if isinstance(value, str):
+            try:
+                task[field] = datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    return task
+
+
+class TaskStore:
+    """Задачи в SQLite (WAL) с индексами по id, статусу, делегату и external_id"""
+    
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                status TEXT,
+                delegated_to TEXT,
+                external_id TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+            CREATE INDEX IF NOT EXISTS idx_tasks_delegated ON tasks(delegated_to, status);
+            CREATE INDEX IF NOT EXISTS idx_tasks_external_id ON tasks(external_id);
+            CREATE TABLE IF NOT EXISTS task_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS ticktick_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id INTEGER NOT NULL,
+                operation TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON ticktick_outbox(next_attempt_at);
+            """
+        )
+        
+        if legacy_json_path:
+            self.migrate_from_json(legacy_json_path)
+    
+    def migrate_from_json(self, json_path: str):
+        """
+        Однократный перенос задач из старого JSON-файла
+        
+        В старом файле ID могли повторяться (их выдавали как длину списка + 1),
+        поэтому повторные ID получают новые номера из счетчика, а не перезаписывают
+        друг друга. Файл переименовывается, только если в базу попали все задачи.
+        """
+        if not os.path.exists(json_path) or self.count() > 0:
+            return
+        
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                raw_tasks = json.load(f)
+            # Прогоняем через JSON-кодек, чтобы восстановить datetime
+            tasks = [decode_task(json.dumps(task, ensure_ascii=False)) for task in raw_tasks]
+            
+            unique, collisions, seen = [], [], set()
+            for task in tasks:
+                if task.get('id') is None or task['id'] in seen:
+                    collisions.append(task)
+                else:
+                    seen.add(task['id'])
+                    unique.append(task)
+            
+            with self.transaction():
+                self.put_many(unique)
+                self._seed_id_counter()
+                if collisions:
+                    for task, new_id in zip(collisions, self.allocate_ids(len(collisions))):
+                        logger.warning(f"Повторный ID задачи {task.get('id')} заменен на {new_id}: {task.get('title')}")
+                        task['id'] = new_id
+                    self.put_many(collisions)
+            
+            stored = self.connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            if stored != len(tasks):
+                logger.error(f"Перенос задач из {json_path} неполный: в базе {stored} из {len(tasks)}, файл оставлен")
+                return
+            os.replace(json_path, json_path + '.migrated')
+            logger.info(f"Перенесено задач из {json_path}: {len(tasks)}, перенумеровано повторов: {len(collisions)}")
+        except Exception as e:
+            logger.error(f"Ошибка переноса задач из {json_path}: {e}")
+    
+    def _seed_id_counter(self):
+        """Поднять счетчик ID выше максимального существующего ID"""
+        self.connection.execute(
+            """
+            INSERT INTO task_meta (key, value)
+            VALUES ('next_task_id', (SELECT COALESCE(MAX(id), 0) + 1 FROM tasks))
+            ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+            """
+        )
+    
+    def get_meta(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        """Прочитать служебное значение"""
+        row = self.connection.execute("SELECT value FROM task_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+    
+    def set_meta(self, key: str, value: int):
+        """Записать служебное значение"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO task_meta (key, value) VALUES (?, ?)", (key, value)
+        )
+    
+    def enqueue_outbox(self, task_id: int, operation: str, payload: Optional[Dict[str, Any]] = None):
+        """Поставить операцию TickTick в очередь отправки"""
+        self.connection.execute(
+            "INSERT INTO ticktick_outbox (task_id, operation, payload, next_attempt_at) VALUES (?, ?, ?, ?)",
+            (task_id, operation, json.dumps(payload or {}, ensure_ascii=False), time.time())
+        )
+    
+    def due_outbox(self, limit: int) -> List[Dict[str, Any]]:
+        """Операции, которые пора отправить (в порядке постановки)"""
+        rows = self.connection.execute(
+            """
+            SELECT id, task_id, operation, payload, attempts FROM ticktick_outbox
+            WHERE next_attempt_at <= ? ORDER BY id LIMIT ?
+            """,
+            (time.time(), limit)
+        )
+        return [
+            {'id': row[0], 'task_id': row[1], 'operation': row[2], 'payload': json.loads(row[3]), 'attempts': row[4]}
+            for row in rows
+        ]
+    
+    def complete_outbox(self, entry_ids: List[int]):
+        """Удалить отправленные операции"""
+        with self.transaction():
+            self.connection.executemany("DELETE FROM ticktick_outbox WHERE id = ?", ((i,) for i in entry_ids))
+    
+    def retry_outbox(self, entry_id: int, attempts: int, next_attempt_at: float, error: str):
+        """Отложить операцию до следующей попытки"""
+        self.connection.execute(
+            "UPDATE ticktick_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, next_attempt_at, error, entry_id)
+        )
+    
+    def pending_create_ids(self) -> List[int]:
+        """ID задач, создание которых в TickTick еще стоит в очереди"""
+        rows = self.connection.execute("SELECT DISTINCT task_id FROM ticktick_outbox WHERE operation = 'create'")
+        return [row[0] for row in rows]
+    
+    def next_outbox_attempt_at(self) -> Optional[float]:
+        """Время ближайшей запланированной попытки"""
+        return self.connection.execute("SELECT MIN(next_attempt_at) FROM ticktick_outbox").fetchone()[0]
+    
+    def allocate_ids(self, count: int = 1) -> List[int]:
+        """
+        Выделить новые ID задач из постоянного монотонного счетчика
+        
+        Чтение и увеличение счетчика выполняются в одной транзакции без await,
+        поэтому ID не повторяются ни между обработчиками, ни после удаления задач.
+        """
+        with self.transaction():
+            row = self.connection.execute("SELECT value FROM task_meta WHERE key = 'next_task_id'").fetchone()
+            if row is None:
+                self._seed_id_counter()
+                row = self.connection.execute("SELECT value FROM task_meta WHERE key = 'next_task_id'").fetchone()
+            first_id = row[0]
+            self.connection.execute(
+                "UPDATE task_meta SET value = ? WHERE key = 'next_task_id'", (first_id + count,)
+            )
+        return list(range(first_id, first_id + count))
+    
+    def allocate_id(self) -> int:
+        """Выделить один новый ID задачи"""
+        return self.allocate_ids(1)[0]
+    
+    @staticmethod
+    def _row(task: Dict[str, Any]) -> tuple:
+        return (
+            task['id'],
+            task.get('status'),
+            task.get('delegated_to'),
+            task.get('external_id'),
+            encode_task(task)
+        )
+    
+    def put(self, task: Dict[str, Any]):
+        """Создать или обновить задачу"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO tasks (id, status, delegated_to, external_id, data) VALUES (?, ?, ?, ?, ?)",
+            self._row(task)
+        )
+    
+    def put_many(self, tasks: Iterable[Dict[str, Any]]):
+        """Создать или обновить несколько задач в одной транзакции"""
+        with self.transaction():
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tasks (id, status, delegated_to, external_id, data) VALUES (?, ?, ?, ?, ?)",
+                (self._row(task) for task in tasks)
+            )
+    
+    @contextmanager
+    def transaction(self):
+        """Транзакция: фиксация при успехе, откат при исключении (вложенные объединяются)"""
+        if self.connection.in_transaction:
+            yield self.connection
+            return
+        
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+    
+    def get(self, task_id: int) -> Optional[Dict[str, Any]]:
+        """Задача по id"""
+        row = self.connection.execute("SELECT data FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return decode_task(row[0]) if row else None
+    
+    def get_by_external_id(self, external_id: str) -> Optional[Dict[str, Any]]:
+        """Задача по ID в TickTick"""
+        row = self.connection.execute(
+            "SELECT data FROM tasks WHERE external_id = ?", (external_id,)
+        ).fetchone()
+        return decode_task(row[0]) if row else None
+    
+    def by_status(self, statuses: Iterable[str]) -> List[Dict[str, Any]]:
+        """Задачи с указанными статусами"""
+        statuses = list(statuses)
+        placeholders = ", ".join("?" for _ in statuses)
+        rows = self.connection.execute(
+            f"SELECT data FROM tasks WHERE status IN ({placeholders}) ORDER BY id", statuses
+        )
+        return [decode_task(row[0]) for row in rows]
+    
+    def delegated(self, status: str = 'delegated') -> List[Dict[str, Any]]:
+        """Делегированные задачи с указанным статусом"""
+        rows = self.connection.execute(
+            "SELECT data FROM tasks WHERE delegated_to IS NOT NULL AND status = ? ORDER BY id", (status,)
+        )
+        return [decode_task(row[0]) for row in rows]
+    
+    def all(self) -> List[Dict[str, Any]]:
+        """Все задачи"""
+        return [decode_task(row[0]) for row in self.connection.execute("SELECT data FROM tasks ORDER BY id")]
+    
+    def count(self) -> int:
+        """Количество задач"""
+        return self.connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+    
+    def close(self):
+        """Закрыть базу"""
+        self.connection.close()
+
+
+
+class IndexedTaskStore(TaskStore):
+    """
+    TaskStore с загруженной в память моделью и словарными индексами (write-through)
+    
+    Индексы меняются только после COMMIT: записи внутри транзакции копятся отдельно и
+    при откате отбрасываются. Чтение возвращает копии задач, чтобы изменение задачи
+    без put не расходилось с базой.
+    """
+    
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None):
+        self.tasks_by_id: Dict[int, Dict[str, Any]] = {}
+        self.status_index: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self.delegate_index: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self.external_index: Dict[str, int] = {}
+        # Ключи, под которыми задача сейчас лежит в индексах: id -> (status, delegated_to, external_id)
+        self.index_keys: Dict[int, tuple] = {}
+        self.loaded_version: Optional[int] = None
+        # Задачи, записанные в текущей транзакции (None - транзакции нет)
+        self.staged: Optional[Dict[int, Dict[str, Any]]] = None
+        super().__init__(db_path, legacy_json_path)
+    
+    def _data_version(self) -> int:
+        """Счетчик изменений базы другими соединениями (аналог mtime для SQLite)"""
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+    
+    def _ensure_loaded(self):
+        """Перечитать базу, если она изменилась вне этого процесса"""
+        version = self._data_version()
+        if version == self.loaded_version:
+            return
+        
+        self.tasks_by_id.clear()
+        self.status_index.clear()
+        self.delegate_index.clear()
+        self.external_index.clear()
+        self.index_keys.clear()
+        for task in super().all():
+            self._index(task)
+        self.loaded_version = version
+        logger.info(f"Индекс задач загружен: {len(self.tasks_by_id)}")
+    
+    def _index(self, task: Dict[str, Any]):
+        """Поместить задачу в индексы, убрав ее старые ключи"""
+        task_id = task['id']
+        old_keys = self.index_keys.get(task_id)
+        if old_keys:
+            old_status, old_delegate, old_external_id = old_keys
+            self.status_index.get(old_status, {}).pop(task_id, None)
+            self.delegate_index.get(old_delegate, {}).pop(task_id, None)
+            if self.external_index.get(old_external_id) == task_id:
+                del self.external_index[old_external_id]
+        
+        status = task.get('status')
+        delegate = task.get('delegated_to')
+        external_id = task.get('external_id')
+        
+        self.tasks_by_id[task_id] = task
+        self.status_index.setdefault(status, {})[task_id] = task
+        if delegate:
+            self.delegate_index.setdefault(delegate, {})[task_id] = task
+        if external_id:
+            self.external_index[external_id] = task_id
+        self.index_keys[task_id] = (status, delegate, external_id)
+    
+    @contextmanager
+    def transaction(self):
+        """Транзакция; индексы получают записанные в ней задачи только после фиксации"""
+        if self.connection.in_transaction:
+            with super().transaction() as connection:
+                yield connection
+            return
+        
+        self.staged = {}
+        try:
+            with super().transaction() as connection:
+                yield connection
+            for task in self.staged.values():
+                self._index(task)
+        finally:
+            self.staged = None
+    
+    def _stage(self, tasks: Iterable[Dict[str, Any]]):
+        """Отложить индексацию до фиксации транзакции (вне транзакции запись уже зафиксирована)"""
+        for task in tasks:
+            if self.staged is not None:
+                self.staged[task['id']] = dict(task)
+            else:
+                self._index(dict(task))
+    
+    def put(self, task: Dict[str, Any]):
+        self._ensure_loaded()
+        super().put(task)
+        self._stage([task])
+    
+    def put_many(self, tasks: Iterable[Dict[str, Any]]):
+        self._ensure_loaded()
+        tasks = list(tasks)
+        super().put_many(tasks)
+        self._stage(tasks)
+    
+    def get(self, task_id: int) -> Optional[Dict[str, Any]]:
+        self._ensure_loaded()
+        task = self.tasks_by_id.get(task_id)
+        return dict(task) if task is not None else None
+    
+    def get_by_external_id(self, external_id: str) -> Optional[Dict[str, Any]]:
+        self._ensure_loaded()
+        task_id = self.external_index.get(external_id)
+        return self.get(task_id) if task_id is not None else None
+    
+    def by_status(self, statuses: Iterable[str]) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        tasks = []
+        for status in statuses:
+            tasks.extend(dict(task) for task in self.status_index.get(status, {}).values())
+        return tasks
+    
+    def by_delegate(self, delegate_key: str, status: str = 'delegated') -> List[Dict[str, Any]]:
+        """Задачи делегата с указанным статусом"""
+        self._ensure_loaded()
+        return [
+            dict(task) for task in self.delegate_index.get(delegate_key, {}).values()
+            if task.get('status') == status
+        ]
+    
+    def delegated(self, status: str = 'delegated') -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        return [dict(task) for task in self.status_index.get(status, {}).values() if task.get('delegated_to')]
+    
+    def all(self) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        return [dict(task) for task in self.tasks_by_id.values()]
+    
+    def count(self) -> int:
+        self._ensure_loaded()
+        return len(self.tasks_by_id)
@@ -0,0 +1,380 @@
+"""
+Клиент TickTick Open API с общим пулом соединений, объединением запросов и ограничением частоты
+"""
+import asyncio
+import fnmatch
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты TickTick: 0 - нет, 1 - низкий, 3 - средний, 5 - высокий
+PRIORITY_TO_TICKTICK = {'low': 1, 'medium': 3, 'high': 5}
+PRIORITY_FROM_TICKTICK = {0: 'medium', 1: 'low', 3: 'medium', 5: 'high'}
+
+TICKTICK_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+
+
+def parse_ticktick_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Разобрать дату TickTick ("2019-11-13T03:00:00.000+0000") или вернуть None"""
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f%z', TICKTICK_DATE_FORMAT):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    logger.warning(f"Не удалось разобрать дату TickTick: {value}")
+    return None
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов (token bucket)"""
+    
+    def __init__(self, rate: float, capacity: int):
+        """
+        Args:
+            rate: Сколько запросов в секунду восполняется
+            capacity: Максимальный всплеск запросов
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Дождаться разрешения на запрос"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def pause(self, seconds: float):
+        """Приостановить выдачу разрешений (ответ 429 от сервера)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class FixtureTransport(httpx.AsyncBaseTransport):
+    """
+    Локальная замена сервера TickTick на записанных ответах для работы без сети
+    
+    Файл фикстур - список записей {"method", "path", "status", "json"}; path может
+    содержать шаблоны fnmatch ("*"). Запись с "echo_body": true возвращает тело запроса,
+    дополненное полями из "json" и сгенерированным id.
+    """
+    
+    def __init__(self, fixtures_path: str):
+        with open(fixtures_path, 'r', encoding='utf-8') as f:
+            self.fixtures = json.load(f)
+        self.requests: List[httpx.Request] = []
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        for fixture in self.fixtures:
+            if fixture['method'] == request.method and fnmatch.fnmatch(request.url.path, fixture['path']):
+                body = fixture.get('json')
+                if fixture.get('echo_body'):
+                    body = {**json.loads(request.content or b'{}'), **(body or {})}
+                    body.setdefault('id', uuid.uuid4().hex[:24])
+                return httpx.Response(fixture.get('status', 200), json=body, request=request)
+        
+        logger.warning(f"Нет фикстуры TickTick для {request.method} {request.url.path}")
+        return httpx.Response(404, json={'errorMessage': 'fixture not found'}, request=request)
+
+
+class TickTickIntegration:
+    """Общий клиент TickTick: один пул HTTP-соединений на процесс"""
+    
+    def __init__(self, access_token: str = None, api_url: str = "https://api.ticktick.com/open/v1",
+                 default_project_id: str = "inbox", rate_limit: float = 2.0, burst: int = 10,
+                 batch_window_ms: int = 50, request_timeout: float = 20.0, fixtures_path: str = None):
+        """Инициализация клиента TickTick"""
+        # Импортируем конфигурацию внутри метода, чтобы избежать циклических импортов
+        if access_token is None:
+            from config import Config
+            access_token = Config.TICKTICK_ACCESS_TOKEN
+            api_url = Config.TICKTICK_API_URL
+            default_project_id = Config.TICKTICK_PROJECT_ID
+            rate_limit = Config.TICKTICK_RATE_LIMIT
+            burst = Config.TICKTICK_BURST
+            fixtures_path = Config.TICKTICK_FIXTURES
+        
+        transport = FixtureTransport(fixtures_path) if fixtures_path else None
+        self.http_client = httpx.AsyncClient(
+            base_url=api_url,
+            headers={'Authorization': f'Bearer {access_token}'},
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            timeout=request_timeout,
+            transport=transport
+        )
+        self.default_project_id = default_project_id
+        self.rate_limiter = TokenBucket(rate_limit, burst)
+        self.batch_window = batch_window_ms / 1000
+        
+        # Проект каждой известной задачи (нужен для обновления в Open API); в памяти - кэш,
+        # постоянно проект хранится в задаче бота (external_project_id)
+        self.task_projects: Dict[str, str] = {}
+        
+        # Одинаковые запросы на чтение, выполняющиеся одновременно, делят один ответ
+        self.inflight: Dict[str, asyncio.Future] = {}
+        
+        # Записи, накопленные за окно объединения
+        self.pending_creates: List[tuple] = []
+        self.pending_updates: Dict[str, Dict[str, Any]] = {}
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        # Запущенные отправки пакетов: ссылки не дают сборщику мусора снять задачу на полпути
+        self.flush_tasks: Set[asyncio.Task] = set()
+        
+        # Метрики по операциям: количество, ошибки, суммарная и максимальная задержка
+        self.metrics: Dict[str, Dict[str, float]] = {}
+        
+        logger.info(f"TickTick клиент инициализирован: {api_url}{' (фикстуры)' if transport else ''}")
+    
+    def _record(self, operation: str, latency: float, error: bool):
+        """Учесть запрос в метриках"""
+        metric = self.metrics.setdefault(
+            operation, {'requests': 0, 'errors': 0, 'total_latency': 0.0, 'max_latency': 0.0}
+        )
+        metric['requests'] += 1
+        metric['errors'] += int(error)
+        metric['total_latency'] += latency
+        metric['max_latency'] = max(metric['max_latency'], latency)
+    
+    async def _request(self, operation: str, method: str, path: str, retries: int = 3, **kwargs) -> Any:
+        """Выполнить запрос с ограничением частоты, повтором после 429 и учетом метрик"""
+        for attempt in range(retries + 1):
+            await self.rate_limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = await self.http_client.request(method, path, **kwargs)
+            except httpx.HTTPError:
+                self._record(operation, time.monotonic() - started, error=True)
+                raise
+            
+            latency = time.monotonic() - started
+            if response.status_code == 429 and attempt < retries:
+                retry_after = float(response.headers.get('Retry-After', 2 ** attempt))
+                logger.warning(f"TickTick ограничил частоту запросов, пауза {retry_after} c")
+                self.rate_limiter.pause(retry_after)
+                self._record(operation, latency, error=True)
+                continue
+            
+            self._record(operation, latency, error=response.is_error)
+            response.raise_for_status()
+            return response.json() if response.content else None
+    
+    async def _single_flight(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Объединить одновременные одинаковые запросы в один"""
+        future = self.inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            result = await call()
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; помечаем его полученным
+            future.exception()
+            raise
+        except BaseException:
+            # Отмена ведущего запроса (CancelledError) не должна оставлять ожидающих навсегда
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.inflight[key]
+    
+    def _schedule_flush(self):
+        """Отправить накопленные записи по истечении окна объединения"""
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._start_flush)
+    
+    def _start_flush(self):
+        """Запустить отправку пакета, сохранив ссылку на задачу до ее завершения"""
+        task = asyncio.get_running_loop().create_task(self._flush())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+    
+    async def _flush(self):
+        """Отправить все накопленные записи одним пакетом"""
+        self.flush_handle = None
+        creates, self.pending_creates = self.pending_creates, []
+        updates, self.pending_updates = self.pending_updates, {}
+        
+        async def send(call: Awaitable[Any], future: asyncio.Future):
+            try:
+                result = await call
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+        
+        # Open API не имеет пакетного эндпоинта: пакет уходит параллельно
+        # по общему пулу соединений в пределах ограничения частоты
+        await asyncio.gather(
+            *(send(self._create(payload), future) for payload, future in creates),
+            *(send(self._update(task_id, entry['fields']), entry['future']) for task_id, entry in updates.items())
+        )
+        if creates or updates:
+            logger.info(f"Отправлен пакет TickTick: создано {len(creates)}, обновлено {len(updates)}")
+    
+    async def test_connection(self) -> bool:
+        """Проверить доступность TickTick"""
+        try:
+            await self.get_projects()
+            return True
+        except Exception as e:
+            logger.error(f"TickTick недоступен: {e}")
+            return False
+    
+    async def get_projects(self) -> List[Dict[str, Any]]:
+        """Список проектов"""
+        return await self._single_flight(
+            'projects', lambda: self._request('get_projects', 'GET', '/project')
+        ) or []
+    
+    async def get_all_tasks(self) -> List[Dict[str, Any]]:
+        """Все незавершенные задачи из всех проектов"""
+        return await self._single_flight('all_tasks', self._fetch_all_tasks)
+    
+    async def _fetch_all_tasks(self) -> List[Dict[str, Any]]:
+        projects = await self.get_projects()
+        project_ids = [self.default_project_id] + [
+            p['id'] for p in projects if p.get('id') != self.default_project_id
+        ]
+        
+        results = await asyncio.gather(
+            *(self._request('get_project_data', 'GET', f'/project/{project_id}/data') for project_id in project_ids)
+        )
+        
+        tasks = []
+        for project_id, data in zip(project_ids, results):
+            for task in (data or {}).get('tasks', []):
+                self.task_projects[task['id']] = task.get('projectId', project_id)
+                tasks.append(task)
+        return tasks
+    
+    async def create_task(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Создать задачу (запросы за окно объединения отправляются пакетом)"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending_creates.append((payload, future))
+        self._schedule_flush()
+        return await future
+    
+    async def update_task(self, task_id: str, project_id: Optional[str] = None, **fields) -> Dict[str, Any]:
+        """
+        Обновить задачу (несколько обновлений одной задачи за окно сливаются в одно)
+        
+        Args:
+            task_id: ID задачи в TickTick
+            project_id: Сохраненный проект задачи - если после перезапуска его нет в кэше
+        """
+        if project_id and task_id not in self.task_projects:
+            self.task_projects[task_id] = project_id
+        entry = self.pending_updates.get(task_id)
+        if entry is None:
+            entry = {'fields': {}, 'future': asyncio.get_running_loop().create_future()}
+            self.pending_updates[task_id] = entry
+        entry['fields'].update(fields)
+        self._schedule_flush()
+        return await asyncio.shield(entry['future'])
+    
+    async def _create(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        payload = {'projectId': self.default_project_id, **payload}
+        created = await self._request('create_task', 'POST', '/task', json=payload)
+        self.task_projects[created['id']] = created.get('projectId', payload['projectId'])
+        return created
+    
+    async def _update(self, task_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        project_id = self.task_projects.get(task_id, self.default_project_id)
+        payload = {'id': task_id, 'projectId': project_id, **fields}
+        return await self._request('update_task', 'POST', f'/task/{task_id}', json=payload)
+    
+    async def sync_task_from_bot(self, task: Dict[str, Any]) -> Optional[str]:
+        """
+        Создать в TickTick задачу бота
+        
+        Returns:
+            ID задачи в TickTick
+        """
+        payload = {
+            'title': task['title'],
+            'content': task.get('description', ''),
+            'priority': PRIORITY_TO_TICKTICK.get(task.get('priority'), 0),
+            'items': [{'title': step} for step in task.get('steps', [])]
+        }
+        due_date = task.get('due_date')
+        if isinstance(due_date, datetime):
+            if due_date.tzinfo is None:
+                due_date = due_date.astimezone()
+            payload['dueDate'] = due_date.astimezone(timezone.utc).strftime(TICKTICK_DATE_FORMAT)
+        
+        created = await self.create_task(payload)
+        return created.get('id')
+    
+    async def sync_task_to_bot(self, tt_task: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Преобразовать задачу TickTick в задачу бота (id назначает вызывающий)"""
+        if not tt_task.get('title'):
+            return None
+        
+        due_date = parse_ticktick_datetime(tt_task.get('dueDate'))
+        if due_date is not None:
+            # Локальные задачи хранят наивное локальное время
+            due_date = due_date.astimezone().replace(tzinfo=None)
+        
+        return {
+            'title': tt_task['title'],
+            'description': tt_task.get('content', ''),
+            'status': 'completed' if tt_task.get('status') == 2 else 'pending',
+            'priority': PRIORITY_FROM_TICKTICK.get(tt_task.get('priority', 0), 'medium'),
+            'estimated_time': 'не определено',
+            'created_at': datetime.now(),
+            'due_date': due_date,
+            'steps': [item.get('title', '') for item in tt_task.get('items', [])],
+            'suggested_delegate': None,
+            'analysis': {},
+            'external_id': tt_task['id'],
+            'external_project_id': tt_task.get('projectId')
+        }
+    
+    def get_metrics(self) -> Dict[str, Dict[str, float]]:
+        """Метрики задержек и ошибок по операциям"""
+        return {
+            operation: {
+                **metric,
+                'avg_latency': metric['total_latency'] / metric['requests'] if metric['requests'] else 0.0
+            }
+            for operation, metric in self.metrics.items()
+        }
+    
+    async def close(self):
+        """Закрыть пул соединений"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            await self._flush()
+        if self.flush_tasks:
+            await asyncio.gather(*self.flush_tasks, return_exceptions=True)
+        await self.http_client.aclose()
@@ -0,0 +1,155 @@
+"""
+Фоновая отправка изменений задач в TickTick через постоянную очередь
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from services.task_store import TaskStore
+
+logger = logging.getLogger(__name__)
+
+
+class PendingDependency(Exception):
+    """Операцию пока нельзя выполнить (например, задача еще не создана в TickTick)"""
+
+
+class TickTickOutbox:
+    """Очередь исходящих операций TickTick с пакетной отправкой и повторами"""
+    
+    def __init__(self, store: TaskStore, ticktick, batch_size: int = 20,
+                 base_backoff: float = 5.0, max_backoff: float = 900.0, idle_interval: float = 60.0):
+        """
+        Args:
+            store: Хранилище задач, в котором лежит очередь
+            ticktick: Клиент TickTick
+            batch_size: Сколько операций отправлять за один проход
+            base_backoff: Задержка перед первым повтором, с
+            max_backoff: Максимальная задержка между повторами, с
+            idle_interval: Как часто проверять очередь без новых событий, с
+        """
+        self.store = store
+        self.ticktick = ticktick
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.idle_interval = idle_interval
+        
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+    
+    def enqueue(self, task_id: int, operation: str, payload: Optional[Dict[str, Any]] = None):
+        """Поставить операцию в очередь и разбудить обработчик"""
+        self.store.enqueue_outbox(task_id, operation, payload)
+        self.wakeup.set()
+    
+    def start(self):
+        """Запустить фоновый обработчик очереди"""
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+            logger.info("Обработчик очереди TickTick запущен")
+    
+    async def stop(self):
+        """Остановить фоновый обработчик"""
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+    
+    async def _run(self):
+        """Цикл обработки очереди"""
+        while True:
+            # Сбрасываем до прохода, чтобы не потерять сигнал о новой операции во время отправки
+            self.wakeup.clear()
+            try:
+                processed = await self.drain_once()
+            except Exception as e:
+                logger.error(f"Ошибка обработки очереди TickTick: {e}")
+                processed = 0
+            
+            # Полная пачка - сразу берем следующую
+            if processed >= self.batch_size:
+                continue
+            
+            next_attempt_at = self.store.next_outbox_attempt_at()
+            timeout = self.idle_interval
+            if next_attempt_at is not None:
+                timeout = min(timeout, max(next_attempt_at - time.time(), 0.1))
+            
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def drain_once(self) -> int:
+        """
+        Отправить одну пачку готовых операций
+        
+        Returns:
+            Количество взятых из очереди операций
+        """
+        entries = self.store.due_outbox(self.batch_size)
+        if not entries:
+            return 0
+        
+        # Создания идут раньше обновлений; внутри группы операции отправляются
+        # одновременно, и клиент TickTick объединяет их в один пакет
+        creates = [entry for entry in entries if entry['operation'] == 'create']
+        others = [entry for entry in entries if entry['operation'] != 'create']
+        
+        done: List[int] = []
+        for group in (creates, others):
+            results = await asyncio.gather(*(self._apply(entry) for entry in group), return_exceptions=True)
+            for entry, result in zip(group, results):
+                if not isinstance(result, Exception):
+                    done.append(entry['id'])
+                    continue
+                attempts = entry['attempts'] + 1
+                delay = min(self.base_backoff * 2 ** (attempts - 1), self.max_backoff)
+                delay *= random.uniform(0.8, 1.2)
+                self.store.retry_outbox(entry['id'], attempts, time.time() + delay, str(result))
+                if not isinstance(result, PendingDependency):
+                    logger.warning(
+                        f"Операция TickTick {entry['operation']} для задачи {entry['task_id']} "
+                        f"не выполнена (попытка {attempts}), повтор через {delay:.0f} c: {result}"
+                    )
+        
+        if done:
+            self.store.complete_outbox(done)
+        return len(entries)
+    
+    async def _apply(self, entry: Dict[str, Any]):
+        """Выполнить одну операцию"""
+        task = self.store.get(entry['task_id'])
+        if task is None:
+            logger.warning(f"Задача {entry['task_id']} удалена, операция {entry['operation']} пропущена")
+            return
+        
+        if entry['operation'] == 'create':
+            if task.get('external_id'):
+                return
+            ticktick_id = await self.ticktick.sync_task_from_bot(task)
+            if not ticktick_id:
+                raise RuntimeError("TickTick не вернул ID задачи")
+            # Берем свежую копию: задача могла измениться, пока шел запрос
+            task = dict(self.store.get(entry['task_id']) or task)
+            task['external_id'] = ticktick_id
+            # Проект сохраняется в задаче: кэш клиента TickTick живет только до перезапуска
+            task['external_project_id'] = self.ticktick.task_projects.get(ticktick_id)
+            self.store.put(task)
+            logger.info(f"Задача синхронизирована с TickTick: {ticktick_id}")
+        
+        elif entry['operation'] == 'update':
+            if not task.get('external_id'):
+                raise PendingDependency("задача еще не создана в TickTick")
+            await self.ticktick.update_task(
+                task['external_id'], project_id=task.get('external_project_id'), **entry['payload']
+            )
+        
+        else:
+            logger.error(f"Неизвестная операция TickTick: {entry['operation']}")
@@ -1,58 +1,346 @@
 """
 Сервис для работы с голосовыми сообщениями
 """
+import asyncio
 import logging
+import multiprocessing
 import os
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.media_cache import MediaResultCache
+from services.media_ingest import MediaBuffer, MediaIngestor, iter_local_file
 
 logger = logging.getLogger(__name__)
 
+# Whisper ожидает моно 16 кГц
+SAMPLE_RATE = 16000
+# Ограничение размера файла в Whisper API
+REMOTE_MAX_BYTES = 25 * 1024 * 1024
+# Длинные записи режутся на куски около CHUNK_SECONDS, но не длиннее MAX_CHUNK_SECONDS
+CHUNK_SECONDS = 30.0
+MAX_CHUNK_SECONDS = 45.0
+
+# Загруженные модели (по одной на параметры) - живут в рабочем процессе
+_models: Dict[Tuple[str, str, str], Any] = {}
+
+
+def _load_model(model_size: str, device: str, compute_type: str, cpu_threads: int):
+    """Загрузить локальную модель один раз на процесс и переиспользовать"""
+    key = (model_size, device, compute_type)
+    model = _models.get(key)
+    if model is None:
+        from faster_whisper import WhisperModel
+        logger.info(f"Загрузка модели распознавания речи {model_size} ({device}, {compute_type})")
+        model = WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+        _models[key] = model
+    return model
+
+
+def _transcribe_pcm(model_size: str, device: str, compute_type: str, cpu_threads: int,
+                    audio: np.ndarray, language: Optional[str]) -> str:
+    """Распознать PCM float32 16 кГц локальной моделью (выполняется в пуле процессов)"""
+    model = _load_model(model_size, device, compute_type, cpu_threads)
+    segments, _info = model.transcribe(audio, language=language, beam_size=1, vad_filter=True)
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+async def decode_audio(chunks: AsyncIterator[bytes], ffmpeg: str = "ffmpeg",
+                       sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Декодировать OGG/Opus (или любой формат ffmpeg) в PCM float32 моно
+    
+    Данные подаются в ffmpeg по мере скачивания через stdin и читаются из stdout,
+    поэтому файл целиком не собирается и не пишется на диск.
+    """
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    
+    async def feed():
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg завершился раньше - причину покажет его stderr
+            pass
+        finally:
+            process.stdin.close()
+    
+    try:
+        _, pcm, errors = await asyncio.gather(feed(), process.stdout.read(), process.stderr.read())
+        await process.wait()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg не смог декодировать аудио: {errors.decode(errors='replace').strip()}")
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def split_on_silence(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, chunk_seconds: float = CHUNK_SECONDS,
+                     max_chunk_seconds: float = MAX_CHUNK_SECONDS, frame_ms: int = 30,
+                     silence_ms: int = 300) -> List[Tuple[int, int]]:
+    """
+    Разбить запись на куски по паузам
+    
+    Граница куска ставится в самом тихом месте (средняя громкость за silence_ms)
+    между половиной chunk_seconds и max_chunk_seconds от начала куска, чтобы не резать слова.
+    
+    Returns:
+        Список (начало, конец) в отсчетах
+    """
+    total = len(audio)
+    if total <= max_chunk_seconds * sample_rate:
+        return [(0, total)]
+    
+    frame = sample_rate * frame_ms // 1000
+    frames = total // frame
+    energy = np.sqrt(np.mean(np.square(audio[:frames * frame].reshape(frames, frame)), axis=1))
+    window = max(1, silence_ms // frame_ms)
+    smoothed = np.convolve(energy, np.ones(window) / window, mode='same')
+    
+    shortest = int(chunk_seconds * 500 / frame_ms)
+    longest = int(max_chunk_seconds * 1000 / frame_ms)
+    bounds = []
+    start = 0
+    while frames - start > longest:
+        low = start + shortest
+        cut = low + int(np.argmin(smoothed[low:start + longest]))
+        bounds.append((start * frame, cut * frame))
+        start = cut
+    bounds.append((start * frame, total))
+    return bounds
+
+
+class TranscriptionBackend:
+    """Движок распознавания речи"""
+    
+    # Нужен ли движку декодированный PCM (иначе передается исходный файл)
+    needs_pcm = True
+    
+    async def transcribe(self, audio, language: Optional[str]) -> str:
+        """Распознать аудио"""
+        raise NotImplementedError
+    
+    async def close(self):
+        """Освободить ресурсы"""
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    Локальная модель в стиле faster-whisper на CPU
+    
+    Инференс идет в пуле процессов: куски длинной записи распознаются параллельно,
+    каждый процесс загружает модель один раз, ядра процессора делятся между процессами.
+    """
+    
+    def __init__(self, model_size: str = "small", device: str = "cpu", compute_type: str = "int8", workers: int = 2):
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn: дочерние процессы не наследуют потоки и цикл событий бота
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    
+    async def transcribe(self, audio: np.ndarray, language: Optional[str]) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, _transcribe_pcm, self.model_size, self.device, self.compute_type,
+            self.cpu_threads, audio, language
+        )
+    
+    async def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """Удаленное распознавание через Whisper API (общий пул соединений ChatGPTClient)"""
+    
+    needs_pcm = False
+    
+    def __init__(self, chatgpt, model: str = "whisper-1"):
+        self.chatgpt = chatgpt
+        self.model = model
+    
+    async def transcribe(self, audio: bytes, language: Optional[str]) -> str:
+        params = {'language': language} if language else {}
+        async with self.chatgpt.request_semaphore:
+            result = await self.chatgpt.async_client.audio.transcriptions.create(
+                model=self.model, file=("voice.ogg", audio), **params
+            )
+        return result.text.strip()
+
+
+def create_transcription_backend(name: str, chatgpt=None, model: Optional[str] = None, device: str = "cpu",
+                                 compute_type: str = "int8", workers: int = 2) -> TranscriptionBackend:
+    """Создать движок распознавания по имени из конфигурации ('local' или 'openai')"""
+    if name == "local":
+        return LocalWhisperBackend(model or "small", device=device, compute_type=compute_type, workers=workers)
+    if name == "openai":
+        if chatgpt is None:
+            raise ValueError("Для распознавания через OpenAI нужен ChatGPTClient")
+        return OpenAIWhisperBackend(chatgpt, model or "whisper-1")
+    raise ValueError(f"Неизвестный движок распознавания речи: {name}")
+
+
 class VoiceService:
     """Сервис для обработки голосовых сообщений"""
     
-    def __init__(self):
-        """Инициализация сервиса голосовых сообщений"""
-        logger.info("VoiceService инициализирован")
+    def __init__(self, backend: Optional[TranscriptionBackend] = None, chatgpt=None,
+                 language: Optional[str] = "ru", ffmpeg: str = "ffmpeg", media: Optional[MediaIngestor] = None,
+                 chunk_seconds: float = CHUNK_SECONDS, cache: Optional[MediaResultCache] = None):
+        """
+        Инициализация сервиса голосовых сообщений
+        
+        Args:
+            backend: Движок распознавания (по умолчанию - из конфигурации)
+            chatgpt: ChatGPTClient для удаленного движка
+            language: Язык речи (None - определить автоматически)
+            ffmpeg: Путь к ffmpeg для декодирования
+            media: Загрузчик файлов Telegram (общий с обработкой фото)
+            chunk_seconds: Примерная длина куска длинной записи
+            cache: Кэш расшифровок по file_unique_id
+        """
+        if backend is None:
+            from config import Config
+            backend = create_transcription_backend(
+                Config.VOICE_BACKEND,
+                chatgpt=chatgpt,
+                model=Config.VOICE_MODEL,
+                device=Config.VOICE_DEVICE,
+                compute_type=Config.VOICE_COMPUTE_TYPE,
+                workers=Config.VOICE_WORKERS
+            )
+            language = Config.VOICE_LANGUAGE
+            ffmpeg = Config.FFMPEG_BINARY
+            chunk_seconds = Config.VOICE_CHUNK_SECONDS
+        
+        self.backend = backend
+        self.language = language
+        self.ffmpeg = ffmpeg
+        self.chunk_seconds = chunk_seconds
+        self.cache = cache
+        self.owns_media = media is None
+        self.media = media or MediaIngestor()
+        logger.info(f"VoiceService инициализирован ({type(backend).__name__})")
     
-    async def transcribe_voice_message(self, voice_file_path: str) -> Optional[str]:
+    async def transcribe_stream(self, chunks: AsyncIterator[bytes],
+                                on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
         """
-        Распознать голосовое сообщение
+        Распознать аудио, поступающее частями
         
         Args:
-            voice_file_path: Путь к голосовому файлу
-            
+            chunks: Части файла
+            on_partial: Вызывается с промежуточным текстом по мере готовности кусков длинной записи
+        
         Returns:
             Распознанный текст или None
         """
         try:
-            # Заглушка для распознавания речи
-            # В будущем здесь будет интеграция с OpenAI Whisper
-            logger.info(f"Обработка голосового файла: {voice_file_path}")
-            
-            # Возвращаем заглушку
-            return "Функция распознавания речи в разработке"
+            if self.backend.needs_pcm:
+                audio = await decode_audio(chunks, self.ffmpeg)
+                if not audio.size:
+                    return None
+                bounds = split_on_silence(audio, chunk_seconds=self.chunk_seconds,
+                                          max_chunk_seconds=self.chunk_seconds * 1.5)
+                if len(bounds) > 1:
+                    return await self._transcribe_chunks(audio, bounds, on_partial) or None
+            else:
+                with MediaBuffer(REMOTE_MAX_BYTES, REMOTE_MAX_BYTES, "voice") as buffer:
+                    async for chunk in chunks:
+                        buffer.write(chunk)
+                    audio = buffer.read()
             
+            text = await self.backend.transcribe(audio, self.language)
+            return text or None
+        
         except Exception as e:
             logger.error(f"Ошибка при распознавании голосового сообщения: {e}")
             return None
     
-    def save_voice_file(self, file_data: bytes, filename: str) -> str:
+    async def _transcribe_chunks(self, audio: np.ndarray, bounds: List[Tuple[int, int]],
+                                 on_partial: Optional[Callable[[str], Awaitable[None]]]) -> str:
+        """Распознать куски параллельно, сообщая промежуточный текст по готовности каждого"""
+        texts: List[Optional[str]] = [None] * len(bounds)
+        
+        async def run(index: int, start: int, end: int):
+            texts[index] = await self.backend.transcribe(audio[start:end], self.language)
+        
+        logger.info(f"Голосовое сообщение {len(audio) / SAMPLE_RATE:.0f} c разбито на {len(bounds)} частей")
+        tasks = [asyncio.ensure_future(run(index, start, end)) for index, (start, end) in enumerate(bounds)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                await finished
+                if on_partial is not None and None in texts:
+                    partial = " ".join(text if text is not None else "…" for text in texts)
+                    try:
+                        await on_partial(partial)
+                    except Exception as e:
+                        logger.warning(f"Не удалось показать промежуточный текст: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        return " ".join(text for text in texts if text).strip()
+    
+    async def transcribe_buffer(self, buffer: MediaBuffer,
+                                on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """Распознать уже скачанный файл, не копируя его"""
+        return await self.transcribe_stream(buffer.iter_chunks(), on_partial)
+    
+    async def transcribe_telegram_file(self, telegram_file,
+                                       on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """Скачать голосовое сообщение Telegram в память и распознать его"""
+        try:
+            async with self.media.fetch(telegram_file, "voice") as buffer:
+                return await self.transcribe_buffer(buffer, on_partial)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки голосового сообщения: {e}")
+            return None
+    
+    async def transcribe_voice(self, voice,
+                               on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """
+        Распознать голосовое сообщение Telegram (Voice/Audio) с кэшем по file_unique_id
+        
+        Пересланное или повторно отправленное сообщение не скачивается и не распознается заново.
         """
-        Сохранить голосовой файл
+        if self.cache is not None:
+            cached = self.cache.get("transcript", voice.file_unique_id)
+            if cached is not None:
+                logger.info(f"Расшифровка {voice.file_unique_id} взята из кэша")
+                return cached
+        
+        text = await self.transcribe_telegram_file(await voice.get_file(), on_partial)
+        if text and self.cache is not None:
+            self.cache.set("transcript", voice.file_unique_id, text)
+        return text
+    
+    async def transcribe_voice_message(self, voice_file_path: str) -> Optional[str]:
+        """
+        Распознать голосовое сообщение
         
         Args:
-            file_data: Данные файла
-            filename: Имя файла
-            
+            voice_file_path: Путь к голосовому файлу
+        
         Returns:
-            Путь к сохраненному файлу
+            Распознанный текст или None
         """
-        try:
-            # Заглушка для сохранения файла
-            logger.info(f"Сохранение голосового файла: {filename}")
-            return f"/tmp/{filename}"
-            
-        except Exception as e:
-            logger.error(f"Ошибка при сохранении голосового файла: {e}")
-            raise
-
+        logger.info(f"Обработка голосового файла: {voice_file_path}")
+        return await self.transcribe_stream(iter_local_file(voice_file_path))
+    
+    async def close(self):
+        """Закрыть пул распознавания (и собственный загрузчик)"""
+        if self.owns_media:
+            await self.media.close()
+        await self.backend.close()
@@ -0,0 +1,132 @@
+"""
+Прогрессивный вывод потокового ответа в одно сообщение Telegram
+"""
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class StreamRenderer:
+    """Редактирует одно сообщение по мере поступления токенов с ограничением частоты правок"""
+    
+    def __init__(self, reply_to: Message, placeholder: str = "💭 ...",
+                 edit_every_tokens: int = 40, edit_interval_ms: int = 1200, cursor: str = " ▌",
+                 interrupted_marker: str = "\n\n⚠️ Ответ прерван"):
+        """
+        Args:
+            reply_to: Сообщение пользователя, на которое отвечаем
+            placeholder: Текст, который показывается до первого токена
+            edit_every_tokens: Правка не раньше, чем накопится столько новых фрагментов
+            edit_interval_ms: Минимальный интервал между правками одного сообщения
+            cursor: Маркер незавершенного ответа
+            interrupted_marker: Пометка в конце ответа, который оборвался на середине
+        """
+        self.reply_to = reply_to
+        self.placeholder = placeholder
+        self.edit_every_tokens = edit_every_tokens
+        self.edit_interval = edit_interval_ms / 1000
+        self.cursor = cursor
+        self.interrupted_marker = interrupted_marker
+        
+        self.message: Optional[Message] = None
+        self.parts: List[str] = []
+        self.rendered_text = ""
+        self.pending_tokens = 0
+        self.last_edit_at = 0.0
+        self.blocked_until = 0.0
+    
+    @property
+    def text(self) -> str:
+        """Текст, накопленный для текущего сообщения"""
+        return "".join(self.parts)
+    
+    async def start(self):
+        """Отправить сообщение-заглушку, которое будет редактироваться"""
+        self.message = await self.reply_to.reply_text(self.placeholder)
+        self.last_edit_at = 0.0
+    
+    async def push(self, delta: str):
+        """Добавить фрагмент ответа и при необходимости обновить сообщение"""
+        if self.message is None:
+            await self.start()
+        
+        self.parts.append(delta)
+        self.pending_tokens += 1
+        
+        # Не помещается в одно сообщение - фиксируем текущее и начинаем новое
+        if len(self.text) + len(self.cursor) > TELEGRAM_MESSAGE_LIMIT:
+            overflow = self.parts.pop()
+            await self._edit(self.text, force=True)
+            self.parts = [overflow]
+            self.rendered_text = ""
+            self.pending_tokens = 1
+            await self.start()
+        
+        now = time.monotonic()
+        first_token = not self.rendered_text
+        if now < self.blocked_until:
+            return
+        if first_token or (
+            self.pending_tokens >= self.edit_every_tokens
+            and now - self.last_edit_at >= self.edit_interval
+        ):
+            await self._edit(self.text + self.cursor)
+    
+    async def finish(self, interrupted: bool = False) -> bool:
+        """
+        Вывести окончательный текст без маркера
+        
+        Args:
+            interrupted: Поток оборвался - ответ помечается как неполный
+        
+        Returns:
+            True, если был получен хотя бы один фрагмент
+        """
+        if not self.parts:
+            return False
+        
+        # Дожидаемся окончания ограничения от Telegram, финальная правка обязательна
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if not interrupted:
+            await self._edit(self.text, force=True)
+        elif len(self.text) + len(self.interrupted_marker) <= TELEGRAM_MESSAGE_LIMIT:
+            await self._edit(self.text + self.interrupted_marker, force=True)
+        else:
+            await self._edit(self.text, force=True)
+            await self.message.reply_text(self.interrupted_marker.strip())
+        return True
+    
+    async def _edit(self, text: str, force: bool = False):
+        """Отредактировать сообщение с учетом лимитов Telegram"""
+        if text == self.rendered_text:
+            return
+        
+        try:
+            await self.message.edit_text(text)
+            self.rendered_text = text
+        except RetryAfter as e:
+            retry_after = float(e.retry_after)
+            logger.warning(f"Telegram ограничил частоту правок на {retry_after} c")
+            self.blocked_until = time.monotonic() + retry_after
+            if force:
+                await asyncio.sleep(retry_after)
+                await self._edit(text, force=True)
+            return
+        except BadRequest as e:
+            # Текст не изменился - не ошибка
+            if "not modified" not in str(e).lower():
+                raise
+        
+        self.pending_tokens = 0
+        self.last_edit_at = time.monotonic()
@@ -3,21 +3,24 @@
 """
 import asyncio
 import logging
-import os
-import tempfile
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 
 from config import Config, setup_logging
 from models.user import db, User
-from chatgpt_client import ChatGPTClient
+from chatgpt_client import ChatGPTClient, StreamInterrupted
+from stream_renderer import StreamRenderer
 from services.smart_task_service import SmartTaskService
 from services.voice_service import VoiceService
+from services.media_ingest import MediaIngestor
+from services.media_cache import MediaResultCache
+from services.image_service import ImageService
 from services.internal_calendar_service import InternalCalendarService
-from services.finance_service import FinanceService
+from services.finance_service import DEFAULT_CATEGORIES, FinanceService
 from services.notification_scheduler import NotificationScheduler
 from services.predictive_analytics import PredictiveAnalytics
 from services.ticktick_integration import TickTickIntegration
@@ -35,21 +38,64 @@ class SuperPersonalAssistantBot:
         
         # Инициализация сервисов
         self.chatgpt = ChatGPTClient()
-        self.smart_tasks = SmartTaskService(str(self.authorized_user_id))
-        self.voice_service = VoiceService()
+        self.ticktick = TickTickIntegration()
+        self.smart_tasks = SmartTaskService(
+            str(self.authorized_user_id),
+            ticktick=self.ticktick,
+            chatgpt=self.chatgpt if Config.TASK_LLM_ANALYSIS else None,
+            llm_model=Config.TASK_LLM_MODEL,
+            llm_deadline=Config.TASK_LLM_DEADLINE,
+            timezone=Config.TIMEZONE
+        )
+        # Общий загрузчик медиа: файлы Telegram скачиваются в память, без временных файлов
+        self.media = MediaIngestor()
+        # Повторно присланные голосовые и фото не скачиваются и не анализируются заново
+        self.media_cache = MediaResultCache(Config.MEDIA_CACHE_PATH, Config.MEDIA_CACHE_SIZE)
+        self.voice_service = VoiceService(chatgpt=self.chatgpt, media=self.media, cache=self.media_cache)
+        self.image_service = ImageService(
+            self.chatgpt,
+            self.media,
+            cache=self.media_cache,
+            max_side=Config.IMAGE_MAX_SIDE,
+            jpeg_quality=Config.IMAGE_JPEG_QUALITY,
+            ocr_languages=Config.OCR_LANGUAGES,
+            ocr_min_confidence=Config.OCR_MIN_CONFIDENCE,
+            workers=Config.IMAGE_WORKERS
+        )
         self.calendar_service = InternalCalendarService()
-        self.finance_service = FinanceService()
+        self.finance_service = FinanceService(self.chatgpt)
         self.analytics = PredictiveAnalytics(str(self.authorized_user_id))
-        self.ticktick = TickTickIntegration()
         
-        # Создание приложения
-        self.application = Application.builder().token(self.config.telegram_token).build()
+        # Создание приложения (обновления обрабатываются параллельно)
+        self.application = (
+            Application.builder()
+            .token(self.config.telegram_token)
+            .concurrent_updates(True)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
         
         # Регистрация обработчиков
         self.register_handlers()
         
         logger.info("Супер персональный ассистент инициализирован")
     
+    async def on_startup(self, application: Application):
+        """Запуск фоновых обработчиков после старта цикла событий"""
+        self.smart_tasks.start_background_sync()
+    
+    async def on_shutdown(self, application: Application):
+        """Освобождение ресурсов при остановке бота"""
+        await self.smart_tasks.stop_background_sync()
+        await self.ticktick.close()
+        await self.voice_service.close()
+        self.image_service.close()
+        self.finance_service.close()
+        await self.media.close()
+        self.media_cache.close()
+        await self.chatgpt.close()
+    
     def check_authorization(self, user_id: int) -> bool:
         """Проверка авторизации пользователя"""
         return user_id == self.authorized_user_id
@@ -69,11 +115,15 @@ class SuperPersonalAssistantBot:
         self.application.add_handler(CommandHandler("sync", self.sync_command))
         self.application.add_handler(CommandHandler("delegate", self.delegate_command))
         self.application.add_handler(CommandHandler("report", self.report_command))
+        self.application.add_handler(CommandHandler("expenses", self.expenses_command))
         
         # Обработчики сообщений
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.application.add_handler(MessageHandler(filters.VOICE, self.handle_voice))
         self.application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))
+        self.application.add_handler(MessageHandler(
+            filters.Document.FileExtension("csv") | filters.Document.MimeType("text/csv"), self.handle_document
+        ))
         
         # Callback обработчики
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
@@ -134,12 +184,14 @@ class SuperPersonalAssistantBot:
 • `/sync` - Синхронизация с TickTick
 • `/delegate` - Делегированные задачи
 • `/report` - Еженедельный отчет
+• `/expenses кофе 60, такси 180` - Несколько расходов сразу
 
 **Как использовать:**
 1. Напишите задачу - получите план и советы
 2. Отправьте фото - автоматический анализ
 3. Голосовое сообщение - распознавание речи
-4. Используйте кнопки для быстрого доступа
+4. Отправьте выписку банка в CSV - импорт расходов
+5. Используйте кнопки для быстрого доступа
 
 **Делегирование:**
 • **Аня** - личные задачи
@@ -270,22 +322,20 @@ class SuperPersonalAssistantBot:
             logger.error(f"Ошибка синхронизации: {e}")
             await update.message.reply_text("❌ Ошибка при синхронизации")
     
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработка текстовых сообщений"""
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: Optional[str] = None):
+        """Обработка текстовых сообщений (text - уже распознанный текст, например из голосового)"""
         if not self.check_authorization(update.effective_user.id):
             await self.unauthorized_handler(update, context)
             return
         
         try:
-            user_message = update.message.text
+            user_message = text or update.message.text
             
             # Записываем взаимодействие
             self.analytics.record_interaction('text_message', {'message': user_message})
             
             # Проверяем, это задача или обычное сообщение
-            task_keywords = ['сделать', 'задача', 'нужно', 'план', 'делегировать']
-            
-            if any(keyword in user_message.lower() for keyword in task_keywords):
+            if self.smart_tasks.is_task_message(user_message):
                 await self.handle_task_creation(update, context, user_message)
             else:
                 # Обычный чат с ChatGPT
@@ -365,9 +415,20 @@ class SuperPersonalAssistantBot:
             # Отправляем в ChatGPT с контекстом
             user_id = update.effective_user.id
             full_message = f"{message}. Контекст: {context_info}" if context_info else message
-            response = await self.chatgpt.get_response(user_id, full_message)
             
-            await update.message.reply_text(response)
+            # Показываем ответ по мере генерации, правя одно сообщение
+            renderer = StreamRenderer(update.message)
+            await renderer.start()
+            interrupted = False
+            try:
+                async for delta in self.chatgpt.stream_response(user_id, full_message):
+                    await renderer.push(delta)
+            except StreamInterrupted as e:
+                logger.warning(f"Ответ пользователю {user_id} оборвался: {e}")
+                interrupted = True
+            
+            if not await renderer.finish(interrupted):
+                await renderer.message.edit_text("❌ Не удалось получить ответ")
             
         except Exception as e:
             logger.error(f"Ошибка чата: {e}")
@@ -404,6 +465,43 @@ class SuperPersonalAssistantBot:
                 summary = await self.smart_tasks.get_task_summary(task_id)
                 await query.edit_message_text(summary, parse_mode=ParseMode.MARKDOWN)
             
+            elif data == "add_expense_from_image":
+                receipt = context.user_data.pop('pending_receipt', None)
+                if not receipt:
+                    await query.edit_message_text("❌ Сумма чека не найдена, отправьте фото еще раз")
+                    return
+                
+                description = receipt.get('merchant') or "Чек"
+                expense = await self.finance_service.add_expense_with_ai(
+                    update.effective_user.id, receipt['total'], description
+                )
+                # Выбор категории кнопкой исправляет расход и дообучает категоризатор
+                keyboard = [
+                    [
+                        InlineKeyboardButton(category, callback_data=f"expense_category_{expense['id']}_{index}")
+                        for index, category in enumerate(DEFAULT_CATEGORIES[start:start + 2], start)
+                    ]
+                    for start in range(0, len(DEFAULT_CATEGORIES), 2)
+                ]
+                await query.edit_message_text(
+                    f"✅ Расход добавлен: {expense['amount']:.2f} грн, {expense['category']} ({description})\n\n"
+                    "Другая категория? Выберите правильную:",
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+            
+            elif data.startswith("expense_category_"):
+                parts = data.split("_")
+                expense_id = int(parts[2])
+                category = DEFAULT_CATEGORIES[int(parts[3])]
+                
+                expense = self.finance_service.correct_expense_category(expense_id, category)
+                if expense is None:
+                    await query.edit_message_text("❌ Расход не найден")
+                    return
+                await query.edit_message_text(
+                    f"✅ Расход {expense['amount']:.2f} грн: категория {expense['category']} ({expense['description']})"
+                )
+            
             elif data == "weekly_report":
                 summary = self.analytics.get_weekly_summary()
                 
@@ -430,29 +528,34 @@ class SuperPersonalAssistantBot:
             return
         
         try:
-            await update.message.reply_text("🎤 Обрабатываю голосовое сообщение...")
-            
-            # Скачиваем голосовое сообщение
-            voice_file = await update.message.voice.get_file()
-            
-            with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as temp_file:
-                await voice_file.download_to_drive(temp_file.name)
-                
-                # Распознаем речь
-                text = await self.voice_service.speech_to_text(temp_file.name)
-                
-                if text:
-                    await update.message.reply_text(f"📝 Распознано: {text}")
-                    
-                    # Обрабатываем как обычное сообщение
-                    context.user_data['last_message'] = text
-                    await self.handle_message(update, context)
-                else:
-                    await update.message.reply_text("❌ Не удалось распознать речь")
-                
-                # Удаляем временный файл
-                os.unlink(temp_file.name)
+            status_message = await update.message.reply_text("🎤 Обрабатываю голосовое сообщение...")
+            
+            # Голосовое скачивается в память и декодируется без временных файлов (или берется из кэша)
+            # Длинная запись распознается кусками параллельно - показываем готовые куски сразу
+            last_edit_at = 0.0
+            
+            async def show_partial(partial: str):
+                nonlocal last_edit_at
+                now = asyncio.get_running_loop().time()
+                if now - last_edit_at < 1.0:
+                    return
+                last_edit_at = now
+                try:
+                    await status_message.edit_text(f"🎤 Распознаю...\n\n{partial[-3500:]} ▌")
+                except TelegramError as e:
+                    logger.debug(f"Промежуточный текст не показан: {e}")
+            
+            text = await self.voice_service.transcribe_voice(update.message.voice, on_partial=show_partial)
+            
+            if text:
+                await status_message.edit_text(f"📝 Распознано: {text}")
                 
+                # Обрабатываем как обычное сообщение
+                context.user_data['last_message'] = text
+                await self.handle_message(update, context, text)
+            else:
+                await status_message.edit_text("❌ Не удалось распознать речь")
+            
         except Exception as e:
             logger.error(f"Ошибка обработки голоса: {e}")
             await update.message.reply_text("❌ Ошибка при обработке голосового сообщения")
@@ -466,36 +569,110 @@ class SuperPersonalAssistantBot:
         try:
             await update.message.reply_text("📸 Анализирую изображение...")
             
-            # Скачиваем фото
-            photo_file = await update.message.photo[-1].get_file()
+            # Берется наименьший достаточный размер фото; чеки распознаются локально,
+            # модель зрения вызывается, только если OCR не справился (результат кэшируется)
+            result = await self.image_service.analyze_photo(update.message.photo)
             
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                await photo_file.download_to_drive(temp_file.name)
-                
-                # Анализируем изображение
-                analysis = await self.chatgpt.analyze_image_with_text(temp_file.name)
-                
-                if analysis:
-                    response = f"🔍 **Анализ изображения:**\n\n{analysis}\n\n"
-                    
-                    # Предлагаем действия
-                    keyboard = [
-                        [InlineKeyboardButton("📋 Создать задачу", callback_data="create_task_from_image")],
-                        [InlineKeyboardButton("💰 Добавить расход", callback_data="add_expense_from_image")]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    await update.message.reply_text(response, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-                else:
-                    await update.message.reply_text("❌ Не удалось проанализировать изображение")
+            if result:
+                # Текст OCR или модели зрения отправляется без разметки: символы * _ [ в нем
+                # ломают Markdown, и Telegram отклоняет сообщение
+                response = f"🔍 Анализ изображения:\n\n{result['text']}\n\n"
                 
-                # Удаляем временный файл
-                os.unlink(temp_file.name)
+                # Предлагаем действия
+                keyboard = [
+                    [InlineKeyboardButton("📋 Создать задачу", callback_data="create_task_from_image")]
+                ]
+                receipt = result.get('receipt')
+                if receipt:
+                    # Сумма из чека записывается в расходы одной кнопкой
+                    context.user_data['pending_receipt'] = receipt
+                    keyboard.append([InlineKeyboardButton(
+                        f"💰 Добавить расход {receipt['total']:.2f} грн", callback_data="add_expense_from_image"
+                    )])
+                reply_markup = InlineKeyboardMarkup(keyboard)
                 
+                await update.message.reply_text(response, reply_markup=reply_markup)
+            else:
+                await update.message.reply_text("❌ Не удалось проанализировать изображение")
+            
         except Exception as e:
             logger.error(f"Ошибка обработки фото: {e}")
             await update.message.reply_text("❌ Ошибка при анализе изображения")
     
+    async def expenses_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /expenses: несколько расходов одним сообщением"""
+        if not self.check_authorization(update.effective_user.id):
+            await self.unauthorized_handler(update, context)
+            return
+        
+        try:
+            # Текст после команды целиком: покупки могут идти и через запятую, и с новой строки
+            parts = update.message.text.split(maxsplit=1)
+            result = await self.finance_service.import_expense_text(
+                update.effective_user.id, parts[1] if len(parts) > 1 else ""
+            )
+            if not result['added'] and not result['duplicates']:
+                await update.message.reply_text(
+                    "💰 Перечислите покупки с суммами: `/expenses кофе 60, такси 180, продукты 950`",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                return
+            
+            await update.message.reply_text(self.format_expense_import(result))
+            self.analytics.record_interaction('expenses_command', {'added': result['added']})
+        
+        except Exception as e:
+            logger.error(f"Ошибка добавления расходов: {e}")
+            await update.message.reply_text("❌ Ошибка при добавлении расходов")
+    
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Импорт банковской выписки CSV"""
+        if not self.check_authorization(update.effective_user.id):
+            await self.unauthorized_handler(update, context)
+            return
+        
+        document = update.message.document
+        if document.file_size and document.file_size > self.media.max_bytes:
+            await update.message.reply_text("❌ Файл слишком большой")
+            return
+        
+        try:
+            await update.message.reply_text("📥 Импортирую выписку...")
+            
+            # Файл разбирается по мере скачивания, без сохранения на диск
+            telegram_file = await document.get_file()
+            result = await self.finance_service.import_statement(
+                update.effective_user.id, self.media.iter_file(telegram_file)
+            )
+            
+            response = self.format_expense_import(result)
+            response += f"\n\nСтрок в выписке: {result['rows']}, не расходов: {result['skipped']}"
+            await update.message.reply_text(response)
+        
+        except ValueError as e:
+            logger.warning(f"Выписка не распознана: {e}")
+            await update.message.reply_text("❌ Не удалось найти в файле столбцы даты и суммы")
+        except Exception as e:
+            logger.error(f"Ошибка импорта выписки: {e}")
+            await update.message.reply_text("❌ Ошибка при импорте выписки")
+    
+    @staticmethod
+    def format_expense_import(result: dict) -> str:
+        """Итог пакетного добавления расходов (суммы в разных валютах выводятся отдельно)"""
+        if not result['added'] and result['duplicates']:
+            return f"☑️ Все расходы уже записаны ранее: {result['duplicates']}"
+        response = f"✅ Добавлено расходов: {result['added']}"
+        if result['duplicates']:
+            response += f"\nУже были записаны ранее: {result['duplicates']}"
+        if result.get('possible_repeats'):
+            response += f"\nСегодня уже были такие же расходы, проверьте повторы: {result['possible_repeats']}"
+        for currency, summary in result['by_currency'].items():
+            unit = "грн" if currency == "UAH" else currency
+            response += f"\n\n💰 {summary['total']:.2f} {unit}"
+            for category, amount in list(summary['categories'].items())[:8]:
+                response += f"\n• {category}: {amount:.2f} {unit}"
+        return response
+    
     def run_sync(self):
         """Синхронный запуск бота"""
         try:
@@ -0,0 +1,7 @@
+"""
+Общая настройка тестов: модули бота лежат в src/ и импортируются как при запуске из нее
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
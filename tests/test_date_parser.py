@@ -0,0 +1,26 @@
+"""
+Точность разбора сроков на корпусе date_parser
+"""
+from datetime import datetime
+
+from services.date_parser import CORPUS_NOW, DeadlineParser, evaluate
+
+
+def test_corpus_accuracy():
+    report = evaluate(iterations=1)
+    assert report['failures'] == []
+    assert report['accuracy'] == 1.0
+
+
+def test_until_weekday():
+    parser = DeadlineParser("Europe/Moscow")
+    now = CORPUS_NOW.replace(tzinfo=parser.tz)
+    for text in ("сдать до пятницы", "к пятнице отчёт", "зробити до п'ятниці"):
+        assert parser.parse(text, now).replace(tzinfo=None) == datetime(2024, 3, 15, 18, 0)
+    assert parser.parse("сдать до пятницы в 12:00", now).replace(tzinfo=None) == datetime(2024, 3, 15, 12, 0)
+
+
+def test_midnight():
+    parser = DeadlineParser("Europe/Moscow")
+    now = CORPUS_NOW.replace(tzinfo=parser.tz)
+    assert parser.parse("в 12 ночи", now).replace(tzinfo=None) == datetime(2024, 3, 14, 0, 0)
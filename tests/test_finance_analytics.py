@@ -0,0 +1,11 @@
+"""
+Дымовой прогон бенчмарка аналитики расходов
+"""
+from services.finance_analytics import benchmark
+
+
+def test_benchmark_smoke():
+    report = benchmark(days=30, per_day=5, iterations=1)
+    assert report['expenses'] == 30 * 5
+    assert report['load_ms'] >= 0
+    assert report['analyze_ms'] >= 0
@@ -0,0 +1,18 @@
+"""
+Сверка однопроходного классификатора с прежним поиском подстрок
+"""
+from services.keyword_matcher import DELEGATES, KeywordMatcher, TASK_KEYWORD_TABLES, evaluate
+
+
+def test_parity_with_legacy_scan():
+    report = evaluate()
+    assert report['mismatches'] == []
+    assert report['agreement'] == 1.0
+
+
+def test_delegate_skills():
+    matcher = KeywordMatcher({
+        **TASK_KEYWORD_TABLES,
+        'delegate': {key: info['skills'] for key, info in DELEGATES.items()}
+    })
+    assert matcher.match("Анализ процессов отдела").first('delegate') == 'oleg'